@@ -0,0 +1,181 @@
+from fractions import Fraction
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from vortex.batch import EventBatch, ticks_to_rand, times_to_rand, vectorized
+from vortex.control import s
+from vortex.pattern import (
+    Event,
+    TimeSpan,
+    fastcat,
+    pure,
+    rand,
+    saw,
+    slowcat,
+    stack,
+    time_to_rand,
+    timecat,
+    wchoose_with,
+)
+from vortex.ticks import set_time_backend
+
+
+def assert_batch_matches_query(pat, span):
+    events = sorted(pat.query_batch(span).to_events())
+    expected = sorted(pat.query(span))
+    assert events == expected
+    # Values keep their types (e.g. ints are not cast to floats)
+    assert [type(e.value) for e in events] == [type(e.value) for e in expected]
+
+
+@pytest.mark.parametrize(
+    "pat",
+    [
+        lambda: pure("bd"),
+        lambda: pure(1).fast(3).early(Fraction(1, 7)),
+        lambda: pure(1).slow(3).late(0.25),
+        lambda: fastcat(1, 2, fastcat(3, 4)),
+        lambda: slowcat("bd", fastcat("sd", "hh")).fast(3),
+        lambda: stack(fastcat(1, 2.5), pure("hh").slow(3)).onsets_only(),
+        lambda: fastcat(1, 2, 3).fast(fastcat(1, 2)),
+        lambda: fastcat(1, 2, 3).fmap(lambda x: x * 10),
+        lambda: fastcat(1, 2.5).fmap(lambda x: x * 2),
+        lambda: fastcat(2**63, -1),
+        lambda: timecat((3, pure("bd").fast(4)), (1, pure("hh").fast(8))),
+        lambda: s(fastcat("bd", "sd")).fast(2),
+        lambda: saw().segment(4).early(0.5),
+        lambda: stack(rand(), pure(1)),
+        lambda: stack(pure(1).fast(16), saw().segment(5)).degrade_by(0.4),
+        lambda: pure(1).fast(Fraction(7, 3)).undegrade_by(Fraction(1, 3)),
+        lambda: pure(1).fast(16).degrade_by(0.5, seed="drums"),
+        lambda: wchoose_with(rand().segment(16), ("a", 1), ("e", 0.5), ("g", 2)),
+        # Cumulative weights too large to be compared as floats
+        lambda: wchoose_with(fastcat(1.0, 0.5), ("a", 2**53 + 3), ("b", 1)),
+        lambda: wchoose_with(saw().segment(8), ("a", 1), ("b", -0.5), ("c", 1)),
+    ],
+)
+def test_query_batch(pat):
+    assert_batch_matches_query(pat(), TimeSpan(Fraction(-1, 3), 4))
+    assert_batch_matches_query(pat(), TimeSpan(Fraction(1, 2), Fraction(1, 2)))
+
+
+@pytest.mark.parametrize(
+    "pat",
+    [
+        lambda: fastcat(1, 2).fast("0 1"),
+        lambda: pure(1)._fast(0),
+        lambda: pure(1).fast("<-1 2>"),
+        lambda: fastcat(1, 2, 3)._fast(-2),
+    ],
+)
+def test_query_batch_non_positive_fast(pat):
+    assert_batch_matches_query(pat(), TimeSpan(0, 4))
+    assert_batch_matches_query(pat(), TimeSpan(Fraction(-1, 3), Fraction(5, 2)))
+
+
+def test_query_batch_ticks_backend():
+    set_time_backend("ticks")
+    try:
+        pat = stack(fastcat(1, 2, 3).early(0.25), pure(4).slow(3))
+        assert_batch_matches_query(pat, TimeSpan(0, 5))
+    finally:
+        set_time_backend("fraction")
+
+
+def test_pure_batch_columns():
+    batch = pure(7).query_batch(TimeSpan(Fraction(1, 2), 2))
+    assert batch.resolution == 2
+    assert batch.whole_begin.tolist() == [0, 2]
+    assert batch.whole_end.tolist() == [2, 4]
+    assert batch.part_begin.tolist() == [1, 2]
+    assert batch.part_end.tolist() == [2, 4]
+    assert batch.has_whole.tolist() == [True, True]
+    assert batch.values.tolist() == [7, 7]
+
+
+def test_batch_transforms_are_normalized():
+    batch = pure(1).fast(4).slow(4).query_batch(TimeSpan(0, 1))
+    assert batch.resolution == 1
+
+
+def test_batch_fast_early():
+    batch = EventBatch.from_events(pure(1).query(TimeSpan(0, 1)))
+    assert batch.fast(2).to_events() == [Event(TimeSpan(0, 0.5), TimeSpan(0, 0.5), 1)]
+    assert batch.early(Fraction(1, 3)).to_events() == [
+        Event(
+            TimeSpan(Fraction(-1, 3), Fraction(2, 3)),
+            TimeSpan(Fraction(-1, 3), Fraction(2, 3)),
+            1,
+        )
+    ]
+    assert batch.late(1).to_events() == batch.early(-1).to_events()
+
+
+def test_batch_concat_keeps_value_types():
+    batch = stack(pure(1), pure(0.5), pure("a")).query_batch(TimeSpan(0, 1))
+    assert [type(v) for v in batch.values.tolist()] == [int, float, str]
+
+
+def test_batch_fmap_vectorized():
+    calls = []
+
+    @vectorized
+    def double(x):
+        calls.append(x)
+        return x * 2
+
+    batch = fastcat(1, 2, 3).fmap(double).query_batch(TimeSpan(0, 1))
+    assert batch.values.tolist() == [2, 4, 6]
+    assert len(calls) == 1
+    assert fastcat(1, 4).fmap(np.sqrt).query_batch(TimeSpan(0, 1)).values.tolist() == [
+        1.0,
+        2.0,
+    ]
+
+
+def test_batch_fmap_object_values():
+    batch = fastcat("a", "b").fmap(lambda x: x + "!").query_batch(TimeSpan(0, 1))
+    assert batch.values.tolist() == ["a!", "b!"]
+
+
+def test_batch_wchoose_with():
+    pairs = [(i, (i * 7) % 5) for i in range(300)]
+    batch = wchoose_with(saw().segment(64), *pairs).query_batch(TimeSpan(0, 2))
+    assert batch.values.tolist() == [e.value for e in sorted(batch.to_events())]
+    with pytest.raises(ValueError):
+        wchoose_with(saw().segment(4).range(0, 2), *pairs).query_batch(TimeSpan(0, 1))
+
+
+def test_batch_overflow():
+    batch = pure(1).query_batch(TimeSpan(0, 1))
+    with pytest.raises(OverflowError):
+        batch.fast(Fraction(1, 2**62)).fast(Fraction(2**62 - 1, 2**62))
+
+
+@pytest.mark.parametrize(
+    "times",
+    [
+        [Fraction(i, 8) for i in range(-64, 64)],
+        [Fraction(i, 7) + 1000 for i in range(64)],
+        # Large times, computed with Python integers
+        [Fraction(i, 3) + 10**9 for i in range(-8, 8)] + [Fraction(-(10**15), 7)],
+    ],
+)
+def test_times_to_rand_matches_time_to_rand(times):
+    assert times_to_rand(times).tolist() == [time_to_rand(t) for t in times]
+
+
+@pytest.mark.parametrize("seed", [1, 2**29 - 1])
+def test_times_to_rand_seed(seed):
+    times = [Fraction(i, 8) for i in range(-64, 64)] + [Fraction(10**15, 7)]
+    expected = [time_to_rand(t, seed) for t in times]
+    assert times_to_rand(times, seed).tolist() == expected
+
+
+def test_ticks_to_rand():
+    ticks = np.arange(-1000, 1000, 7, dtype=np.int64)
+    expected = [time_to_rand(Fraction(int(t), 96)) for t in ticks]
+    assert ticks_to_rand(ticks, 96).tolist() == expected
+    assert ticks_to_rand(np.array([], dtype=np.int64), 96).tolist() == []
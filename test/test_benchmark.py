@@ -0,0 +1,379 @@
+"""
+Benchmarks for pattern queries, run with `pytest --benchmark-enable`.
+
+Benchmarks are disabled by default (see pytest.ini), in which case each of
+them runs once as a regular test.
+
+"""
+
+import tracemalloc
+from fractions import Fraction
+
+import pytest
+
+from vortex.control import gain, n, room, s, size, speed
+from vortex.controlmap import ControlMap
+from vortex.mini import mini
+from vortex.pattern import (
+    Event,
+    TimeSpan,
+    _event,
+    _time_to_rand,
+    _timespan,
+    fastcat,
+    perlin,
+    pure,
+    rand,
+    sine,
+    slowcat,
+    stack,
+    timecat,
+    wchoose,
+)
+from vortex.ticks import set_time_backend
+
+
+@pytest.fixture(params=["fraction", "ticks"])
+def time_backend(request):
+    set_time_backend(request.param)
+    yield request.param
+    set_time_backend("fraction")
+
+
+def test_time_backend_pure(benchmark, time_backend):
+    pat = pure("bd").fast(16)
+    events = benchmark(pat.query, TimeSpan(0, 16))
+    assert len(events) == 256
+
+
+def test_time_backend_fastcat(benchmark, time_backend):
+    pat = fastcat("bd", fastcat("sd", "hh", "hh"), "cp").early(0.25)
+    events = benchmark(pat.query, TimeSpan(0, 16))
+    assert len(events) == 96
+
+
+def test_time_backend_timecat(benchmark, time_backend):
+    pat = timecat((3, pure("bd").fast(4)), (1, pure("hh").fast(8)))
+    events = benchmark(pat.query, TimeSpan(0, 16))
+    assert len(events) == 192
+
+
+def test_time_backend_timecat_ticks(benchmark, time_backend):
+    # Queries of a scheduler tick only overlap one of the 16 segments
+    pat = mini("a b c d e f g h i j k l m n o p")
+    spans = [TimeSpan(Fraction(i, 32), Fraction(i + 1, 32)) for i in range(64)]
+    events = benchmark(lambda: [e for span in spans for e in pat.query(span)])
+    assert len(events) == 64
+
+
+def test_time_backend_slowcat(benchmark, time_backend):
+    pat = slowcat(*range(64))
+    events = benchmark(pat.query, TimeSpan(0, 256))
+    assert len(events) == 256
+
+
+def test_time_backend_long_fastcat(benchmark, time_backend):
+    pat = fastcat(*range(64))
+    events = benchmark(pat.query, TimeSpan(0, 16))
+    assert len(events) == 1024
+
+
+def test_time_backend_control_pattern(benchmark, time_backend):
+    pat = s(mini("bd*4 [sn cp] hh*3 <a b>")).fast(2) >> n("0 1 2")
+    events = benchmark(pat.query, TimeSpan(0, 4))
+    assert len(events) == 84
+
+
+class DictTimeSpan:
+    """Dict-backed TimeSpan, as it was before using __slots__, for comparison"""
+
+    def __init__(self, begin, end):
+        self.begin = Fraction(begin)
+        self.end = Fraction(end)
+
+
+class DictEvent:
+    """Dict-backed Event, as it was before using __slots__, for comparison"""
+
+    def __init__(self, whole, part, value):
+        self.whole = whole
+        self.part = part
+        self.value = value
+
+
+EVENT_CLASSES = {
+    "dict": (DictTimeSpan, DictEvent),
+    "slots": (TimeSpan, Event),
+    "slots_fast": (_timespan, _event),
+}
+
+
+def _make_events(timespan, event, times):
+    """Builds events from existing time values, as combinators do"""
+    return [
+        event(timespan(b, e), timespan(b, e), "bd") for b, e in zip(times, times[1:])
+    ]
+
+
+def _bytes_per_event(timespan, event, n=1000):
+    times = [Fraction(i, 4) for i in range(n + 1)]
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        events = _make_events(timespan, event, times)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(events) == n
+    return (after - before) / n
+
+
+@pytest.mark.parametrize("kind", EVENT_CLASSES.keys())
+def test_event_construction(benchmark, kind):
+    timespan, event = EVENT_CLASSES[kind]
+    benchmark.extra_info["bytes_per_event"] = _bytes_per_event(timespan, event)
+    times = [Fraction(i, 4) for i in range(1001)]
+    events = benchmark(_make_events, timespan, event, times)
+    assert len(events) == 1000
+
+
+def test_slotted_events_use_less_memory():
+    assert _bytes_per_event(TimeSpan, Event) < _bytes_per_event(DictTimeSpan, DictEvent)
+
+
+def _dense_pattern():
+    return stack(*[fastcat(*range(i)).fast(8) for i in range(1, 17)]).early(0.125)
+
+
+def test_query_list(benchmark):
+    pat = _dense_pattern()
+    events = benchmark(pat.query, TimeSpan(0, 4))
+    assert len(events) == 4352
+
+
+def test_query_batch(benchmark):
+    pytest.importorskip("numpy")
+    pat = _dense_pattern()
+    batch = benchmark(pat.query_batch, TimeSpan(0, 4))
+    assert len(batch) == 4352
+
+
+def test_iter_query_first_event(benchmark):
+    pat = stack(*[fastcat(*range(16)).fast(8)] * 1024)
+    event = benchmark(lambda: next(pat.iter_query(TimeSpan(0, 4))))
+    assert event.value == 0
+
+
+def _control_pattern():
+    return s(mini("bd*2 <sn cp> [~ hh]*2 lt")) >> n("0 1 2") >> speed("1 2")
+
+
+def test_query_cycles_loop(benchmark):
+    pat = _control_pattern()
+    results = benchmark(lambda: [pat.query(TimeSpan(c, c + 1)) for c in range(64)])
+    assert len(results) == 64
+
+
+def test_query_cycles_many(benchmark):
+    pat = _control_pattern()
+    results = benchmark(pat.cycles, 0, 64)
+    assert len(results) == 64
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_query_cached(benchmark, cached):
+    # Queries the same cycles over and over, like a visualization would
+    pat = s(mini("bd*4 [sn cp] hh*3 <a b>")) >> n("0 1 2") >> gain("1 0.8")
+    if cached:
+        pat = pat.cached()
+    results = benchmark(lambda: [pat.query(TimeSpan(c, c + 1)) for c in range(8)])
+    assert sum(len(events) for events in results) == 88
+
+
+@pytest.mark.parametrize("periodic", [False, True])
+def test_query_periodic(benchmark, periodic):
+    # Queries 4 cycles in spans of 1/20 cycle, like the scheduler does
+    pat = s(mini("bd*2 <sn cp> [~ hh]*3 {a b c}%4")) >> n("0 1 2") >> gain("1 0.8")
+    if periodic:
+        pat = pat.periodic()
+    spans = [TimeSpan(Fraction(i, 20), Fraction(i + 1, 20)) for i in range(80)]
+    results = benchmark(lambda: [pat.query(span) for span in spans])
+    assert sum(len(events) for events in results) == 100
+
+
+def _time_chain(depth):
+    # Alternates patterned transformations, as in `fast(2).late(0.25)...`
+    methods = [("fast", 2), ("late", 0.25), ("slow", 2), ("early", 0.25)]
+    pat = fastcat("bd", "sn", "hh")
+    for i in range(depth):
+        method, arg = methods[i % len(methods)]
+        pat = getattr(pat, method)(arg)
+    return pat
+
+
+@pytest.mark.parametrize("optimized", [False, True])
+@pytest.mark.parametrize("depth", [1, 8, 64])
+def test_query_time_chain(benchmark, depth, optimized):
+    pat = _time_chain(depth)
+    if optimized:
+        pat = pat.optimize()
+    events = benchmark(pat.query, TimeSpan(0, 4))
+    assert len(events) == 24
+
+
+def _app_operands(events_per_cycle):
+    # The values are shifted by half an event, so that each function event
+    # overlaps two value events
+    pat_func = fastcat(*range(events_per_cycle)).fmap(lambda a: lambda b: a + b)
+    pat_val = fastcat(*range(events_per_cycle))._late(Fraction(1, 2 * events_per_cycle))
+    return pat_func, pat_val
+
+
+@pytest.mark.parametrize("method", ["app_both", "app_left", "app_right"])
+@pytest.mark.parametrize("events_per_cycle", [16, 128, 1024])
+def test_query_app(benchmark, method, events_per_cycle):
+    pat_func, pat_val = _app_operands(events_per_cycle)
+    pat = getattr(pat_func, method)(pat_val)
+    events = benchmark(pat.query, TimeSpan(0, 1))
+    assert len(events) == 2 * events_per_cycle
+
+
+def _merge_chain(pats):
+    # Merges control patterns one by one with app_left, as >> used to
+    pat = pats[0]
+    for other in pats[1:]:
+        pat = pat.fmap(lambda x: lambda y: {**x, **y}).app_left(other)
+    return pat
+
+
+@pytest.mark.parametrize("merge", ["app_left", "combine"])
+def test_query_control_merge(benchmark, merge):
+    pats = [
+        s(mini("bd*4 [sn cp]*2 hh*8")),
+        n("0 1 2"),
+        speed("1 2"),
+        gain("1 0.8 0.9"),
+        room("0.1 0.2"),
+        size("0.5 0.9"),
+    ]
+    pat = (
+        _merge_chain(pats) if merge == "app_left" else pats[0].combine_right(*pats[1:])
+    )
+    events = benchmark(pat.query, TimeSpan(0, 8))
+    assert len(events) == 128
+
+
+@pytest.mark.parametrize("signal", ["perlin", "sine", "rand"])
+def test_query_segment(benchmark, signal):
+    pat = {"perlin": perlin, "sine": sine, "rand": rand}[signal]().segment(64)
+    events = benchmark(pat.query, TimeSpan(0, 4))
+    assert len(events) == 256
+
+
+@pytest.mark.parametrize("params", ["constant", "patterned"])
+def test_query_euclid(benchmark, params):
+    if params == "constant":
+        pat = s("bd").euclid(13, 32, 3)
+    else:
+        pat = s("bd").euclid("<13 7 5>", "32 16", "<0 3>")
+    events = benchmark(pat.query, TimeSpan(0, 8))
+    assert len(events) > 0
+
+
+def test_query_wchoose(benchmark):
+    pat = wchoose(*[(f"s{i}", i % 7 + 1) for i in range(500)]).segment(64)
+    events = benchmark(pat.query, TimeSpan(0, 4))
+    assert len(events) == 256
+
+
+@pytest.mark.parametrize("pushdown", [False, True])
+def test_query_onsets_long_notes(benchmark, pushdown):
+    # Ticks of a stream playing long notes, most of which began in earlier
+    # ticks
+    pat = stack(*[s(fastcat("bd", "sn", "hh")).slow(4 + i) >> n(i) for i in range(32)])
+    spans = [TimeSpan(Fraction(i, 20), Fraction(i + 1, 20)) for i in range(80)]
+
+    def play():
+        if pushdown:
+            return [e for span in spans for e in pat.iter_onsets(span)]
+        return [e for span in spans for e in pat.iter_query(span) if e.has_onset()]
+
+    events = benchmark(play)
+    assert len(events) == 42
+
+
+def test_query_degrade_by(benchmark):
+    pat = pure("hh").fast(64).sometimes_by(0.3, lambda p: p.fast(2))
+
+    def query():
+        _time_to_rand.cache_clear()
+        return pat.query(TimeSpan(0, 4))
+
+    events = benchmark(query)
+    assert 0 < len(events) < 512
+
+
+def _control_values(kind, n=1000):
+    # Values of the events of `s(...) >> n(...) >> speed(...)`, before merging
+    if kind == "dict":
+        return [({"s": "bd"}, {"n": i}, {"speed": 2}) for i in range(n)]
+    return [
+        (ControlMap(s="bd"), ControlMap(n=i), ControlMap(speed=2)) for i in range(n)
+    ]
+
+
+def _merge_dicts(values):
+    merged = {}
+    for value in values:
+        merged.update(value)
+    return merged
+
+
+CONTROL_MERGES = {"dict": _merge_dicts, "control_map": ControlMap.merge}
+
+
+def _merge_control_values(kind, values):
+    merge = CONTROL_MERGES[kind]
+    return [merge(v) for v in values]
+
+
+def _bytes_per_control_value(kind, n=1000):
+    values = _control_values(kind, n)
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        merged = _merge_control_values(kind, values)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(merged) == n
+    return (after - before) / n
+
+
+@pytest.mark.parametrize("kind", CONTROL_MERGES.keys())
+def test_control_merge(benchmark, kind):
+    benchmark.extra_info["bytes_per_value"] = _bytes_per_control_value(kind)
+    values = _control_values(kind)
+    merged = benchmark(_merge_control_values, kind, values)
+    assert merged[1] == {"s": "bd", "n": 1, "speed": 2}
+
+
+def test_control_maps_use_less_memory():
+    assert _bytes_per_control_value("control_map") < _bytes_per_control_value("dict")
+
+
+@pytest.mark.parametrize("processes", [1, 2, 4])
+def test_pool_many_streams(benchmark, processes):
+    # A set of 24 streams, each evaluated for a window of 4 cycles, spread
+    # over worker processes (the speedup depends on the number of cores)
+    from vortex.pool import ProcessPool, define
+
+    source = (
+        's(mini("bd*4 [sn cp]*2 <hh*8 [~ hh]*4>")).every(3, lambda p: p.fast(2))'
+        ".sometimes(lambda p: p.speed(2)) >> n(irand(8).segment(16))"
+    )
+    queries = [(f"d{i}", define(source), TimeSpan(i, i + 4), None) for i in range(24)]
+    with ProcessPool(processes) as pool:
+        pool.query_many(queries)
+        results = benchmark(pool.query_many, queries)
+    assert all(results)
@@ -0,0 +1,68 @@
+import pickle
+from fractions import Fraction
+
+import pytest
+
+from vortex.control import n, s, speed
+from vortex.controlmap import ControlMap
+from vortex.pattern import TimeSpan
+
+
+def test_mapping():
+    cm = ControlMap(s="bd", n=1)
+    assert cm == {"s": "bd", "n": 1}
+    assert {"s": "bd", "n": 1} == cm
+    assert cm != {"s": "bd"}
+    assert cm["s"] == "bd"
+    assert cm.get("speed") is None
+    assert cm.get("speed", 1) == 1
+    assert "n" in cm and "speed" not in cm
+    assert list(cm) == ["s", "n"]
+    assert list(cm.items()) == [("s", "bd"), ("n", 1)]
+    assert len(cm) == 2
+    assert {**cm, "n": 2} == {"s": "bd", "n": 2}
+    assert repr(cm) == "{'s': 'bd', 'n': 1}"
+    with pytest.raises(KeyError):
+        cm["speed"]
+    with pytest.raises(AttributeError):
+        cm.foo = 1
+
+
+def test_merge():
+    a = ControlMap(s="bd", n=1)
+    b = ControlMap(n=2, speed=3)
+    merged = ControlMap.merge([a, b])
+    assert list(merged.items()) == list({**a, **b}.items())
+    assert list((a | b).items()) == [("s", "bd"), ("n", 2), ("speed", 3)]
+    assert list(({"speed": 1} | a).items()) == [("speed", 1), ("s", "bd"), ("n", 1)]
+    assert ControlMap.merge([a, {"n": 2}, {"s": "sn"}]) == {"s": "sn", "n": 2}
+
+
+def test_merge_shares_structure():
+    a = ControlMap(s="bd", n=1)
+    b = ControlMap(s="sn", n=2)
+    assert ControlMap.merge([a, ControlMap()]) is a
+    assert ControlMap.merge([ControlMap(s="hh"), b]) is b
+    assert ControlMap.merge([a, b]) is b
+    # Maps with the same keys share their keys
+    c = ControlMap.merge([ControlMap(s="cp"), ControlMap(n=3)])
+    assert c._shape is a._shape
+
+
+def test_control_patterns():
+    events = (s("bd sn") >> n("1 2") >> speed(Fraction(1, 2))).query(TimeSpan(0, 1))
+    values = [e.value for e in events]
+    assert all(isinstance(v, ControlMap) for v in values)
+    assert values == [
+        {"s": "bd", "n": 1, "speed": Fraction(1, 2)},
+        {"s": "sn", "n": 2, "speed": Fraction(1, 2)},
+    ]
+    assert values[0].osc_args() == ("s", "bd", "n", 1, "speed", 0.5)
+    assert values[0].osc_args() is values[0].osc_args()
+
+
+def test_pickle():
+    cm = ControlMap(s="bd", n=1)
+    restored = pickle.loads(pickle.dumps(cm))
+    assert restored == cm
+    assert restored._shape is cm._shape
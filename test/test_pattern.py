@@ -1,16 +1,33 @@
 import math
+import pickle
+from fractions import Fraction
 from itertools import groupby
 
+import pytest
+
 from vortex.control import (
     s, 
+    gain,
     speed, 
     n, 
     create_param, 
     create_params)
 
+from vortex.euclid import bjorklund
+from vortex.mini import mini
 from vortex.pattern import (
+    Affine,
     Event,
+    Fast,
+    Pattern,
+    Pure,
+    Query,
+    Slowcat,
+    SplitQueries,
+    SplitQueriesAt,
     TimeSpan,
+    _euclid,
+    _perlin_with,
     choose,
     choose_cycles,
     choose_with,
@@ -18,14 +35,23 @@ from vortex.pattern import (
     fastcat,
     irand,
     perlin,
+    polymeter,
     pure,
     rand,
     randcat,
+    random_seed,
+    reify,
     rev,
     saw,
+    sequence,
+    set_cache_size,
+    set_time_backend,
+    signal,
+    sine,
     slowcat,
     stack,
     timecat,
+    tri,
     wchoose,
     wchoose_with,
 )
@@ -157,6 +183,53 @@ def test_timecat():
     ]
 
 
+@pytest.mark.parametrize(
+    "span",
+    [
+        TimeSpan(0, 5),
+        TimeSpan(Fraction(-1, 3), Fraction(7, 5)),
+        TimeSpan(Fraction(1, 7), Fraction(2, 7)),
+        TimeSpan(Fraction(1, 2), Fraction(1, 2)),
+    ],
+)
+def test_cat_dispatch(span):
+    pats = [reify(pat) for pat in ["bd", slowcat("sn", "cp"), pure(1).slow(3), saw()]]
+    expected = [
+        event
+        for subspan in span.span_cycles()
+        for event in pats[math.floor(subspan.begin) % len(pats)].query(subspan)
+    ]
+    assert slowcat(*pats).query(span) == expected
+    assert list(slowcat(*pats).iter_query(span)) == expected
+    fast = Pattern(Fast(slowcat(*pats), Fraction(len(pats))))
+    assert fastcat(*pats).query(span) == fast.query(span)
+    assert list(fastcat(*pats).iter_query(span)) == fast.query(span)
+
+
+@pytest.mark.parametrize(
+    "span",
+    [
+        TimeSpan(0, 3),
+        TimeSpan(Fraction(-1, 3), Fraction(7, 5)),
+        TimeSpan(Fraction(1, 7), Fraction(2, 7)),
+        TimeSpan(Fraction(5, 6), Fraction(7, 6)),
+        TimeSpan(Fraction(3, 4), Fraction(3, 4)),
+        TimeSpan(1, 1),
+    ],
+)
+def test_timecat_queries_overlapping_segments(span):
+    args = [(1, pure("bd").fast(3)), (2, slowcat("hh", saw())), (Fraction(1, 2), "sd")]
+    total = Fraction(7, 2)
+    stacked, begin = [], 0
+    for time, pat in args:
+        stacked.append(reify(pat).compress(begin / total, (begin + time) / total))
+        begin += time
+    pat = timecat(*args)
+    assert pat.query(span) == stack(*stacked).query(span)
+    assert pat.query_many([span, span]) == [pat.query(span)] * 2
+    assert list(pat.iter_query(span)) == pat.query(span)
+
+
 def test_striate():
     assert s(fastcat("bd", "sd")).striate(4).first_cycle() == [
         Event(
@@ -221,6 +294,37 @@ def test_rand():
     ]
 
 
+def test_rand_seed():
+    # Seeded sequences are the same in every process
+    assert [e.value for e in rand(seed="drums").segment(4).first_cycle()] == [
+        0.5286597721278667,
+        0.8305632341653109,
+        0.9709474500268698,
+        0.5549295134842396,
+    ]
+    assert_equal_patterns(rand(seed=0), rand())
+    assert rand(seed=1).segment(4).first_cycle() != rand().segment(4).first_cycle()
+
+
+def test_random_seed():
+    pats = [rand().segment(4), irand(8).segment(3), pure(1).fast(8).degrade()]
+    seeded_pats = [
+        rand(seed="drums").segment(4),
+        irand(8, seed="drums").segment(3),
+        pure(1).fast(8).degrade_by(0.5, seed="drums"),
+    ]
+    span = TimeSpan(0, 2)
+    with random_seed("drums"):
+        for pat, seeded_pat in zip(pats, seeded_pats):
+            assert pat.query(span) == seeded_pat.query(span)
+        # Patterns given a seed keep their own sequence
+        assert rand(seed=0).query(span) != rand().query(span)
+    for pat, seeded_pat in zip(pats, seeded_pats):
+        assert pat.query(span) != seeded_pat.query(span)
+    with random_seed(None):
+        assert rand(seed=0).query(span) == rand().query(span)
+
+
 def test_irand():
     assert irand(8).segment(4).first_cycle() == [
         Event(TimeSpan(0, 1 / 4), TimeSpan(0, 1 / 4), 2),
@@ -246,6 +350,32 @@ def test_perlin_with():
     ]
 
 
+@pytest.mark.parametrize(
+    "span",
+    [
+        TimeSpan(Fraction(-7, 3), 3),
+        TimeSpan(Fraction(1, 3), Fraction(1, 3)),
+        TimeSpan(Fraction(1, 5), Fraction(2, 7)),
+    ],
+)
+def test_perlin_signal(span):
+    # The default perlin noise is sampled directly from a signal
+    expected = _perlin_with(signal(lambda t: t))
+    assert perlin().query(span) == expected.query(span)
+    assert perlin().segment(7).query(span) == expected.segment(7).query(span)
+
+
+@pytest.mark.parametrize(
+    "pat",
+    [perlin, sine, tri, rand, lambda: irand(8), lambda: mini("a [b c] d")],
+)
+def test_segment_samples_at_once(pat):
+    span = TimeSpan(Fraction(-1, 3), Fraction(7, 2))
+    for n in [4, 7, Fraction(3, 2), "<2 3>"]:
+        expected = pure(lambda x: x).fast(n).app_left(pat())
+        assert pat().segment(n).query(span) == expected.query(span)
+
+
 def test_choose():
     assert choose("a", "b", "c").segment(4).first_cycle() == [
         Event(TimeSpan(0, 1 / 4), TimeSpan(0, 1 / 4), "a"),
@@ -293,6 +423,30 @@ def test_wchoose_with():
     ]
 
 
+def test_wchoose_with_large_tables():
+    pairs = [(f"s{i}", (i * 7) % 5) for i in range(300)]
+    total = sum(w for _, w in pairs)
+    events = wchoose_with(rand(), *pairs).segment(64).query(TimeSpan(0, 4))
+    for event in events:
+        r = rand().query(event.whole)[0].value
+        cweight = 0
+        for value, weight in pairs:
+            cweight += weight
+            if cweight >= r * total:
+                break
+        assert event.value == value
+    with pytest.raises(ValueError):
+        wchoose_with(saw().range(0, 2), *pairs).segment(4).first_cycle()
+
+
+def test_wchoose_with_negative_weights():
+    # The first value whose cumulative weight reaches the random value is
+    # chosen, even if cumulative weights are not increasing
+    pairs = [("a", 1), ("b", -0.5), ("c", 1), ("d", Fraction(-1, 3))]
+    pat = wchoose_with(saw(), *pairs).segment(8)
+    assert [e.value for e in pat.first_cycle()] == ["a"] * 7 + ["c"]
+
+
 def test_wchoose_distribution():
     values = [
         e.value
@@ -349,6 +503,25 @@ def test_degrade_by_diff_rand():
     ]
 
 
+@pytest.mark.parametrize("by", [0.25, Fraction(1, 3), 0.9])
+@pytest.mark.parametrize(
+    "span",
+    [
+        TimeSpan(Fraction(-7, 3), 3),
+        TimeSpan(1000, 1002),
+        TimeSpan(Fraction(1, 2), Fraction(1, 2)),
+        TimeSpan(Fraction(5, 8), Fraction(5, 8)),
+    ],
+)
+def test_degrade_by_samples_rand(by, span):
+    # Degrading without a random pattern samples `rand()` directly
+    pat = stack(pure("sd").fast(24), pure("bd").slow(Fraction(3, 2)), saw())
+    assert pat.degrade_by(by).query(span) == pat.degrade_by(by, rand()).query(span)
+    assert pat.undegrade_by(by).query(span) == pat.undegrade_by(by, rand()).query(
+        span
+    )
+
+
 def test_undegrade():
     assert_equal_patterns(
         pure("sd").fast(8).undegrade(), pure("sd").fast(8).undegrade_by(0.5, rand())
@@ -493,11 +666,78 @@ def test_euclid():
     ]
 
 
+def test_bjorklund():
+    assert bjorklund(3, 8) == [1, 0, 0, 1, 0, 0, 1, 0]
+    assert bjorklund(5, 8) == [1, 0, 1, 1, 0, 1, 1, 0]
+    assert bjorklund(7, 12) == [1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0]
+    assert bjorklund(13, 24) == [1, 0, 1, 1, 0, 1] + [0, 1] * 4 + [1, 0] * 5
+    assert bjorklund(-3, 8) == bjorklund(5, 8)
+    assert bjorklund(3, -8) == bjorklund(3, 8)
+    assert bjorklund(0, 8) == bjorklund(8, 8) == []
+    # Long sequences are maximally even: the gaps between onsets differ by
+    # at most one step
+    for k, n in [(1, 1000), (37, 1000), (999, 1000), (610, 987)]:
+        seq = bjorklund(k, n)
+        assert len(seq) == n and sum(seq) == k
+        onsets = [i for i, x in enumerate(seq) if x] + [n]
+        gaps = {b - a for a, b in zip(onsets, onsets[1:])}
+        assert max(gaps) - min(gaps) <= 1
+
+
+def test_euclid_builds_sequences_once():
+    _euclid.cache_clear()
+    pat = s("bd").euclid("<3 5>", 8, "0 2")
+    pat.query(TimeSpan(0, 16))
+    assert _euclid.cache_info().currsize == 4
+    # Constant parameters build the sequence when the pattern is built
+    pat = s("bd").euclid(7, 12)
+    assert _euclid.cache_info().currsize == 5
+    assert len(pat.query(TimeSpan(0, 16))) == 112
+
+
 def test_app_left():
     assert saw().segment(1).query(TimeSpan(0, 0.25)) == [
         Event(TimeSpan(0, 1), TimeSpan(0, 1 / 4), 0.5)
     ]
 
+
+def _app_both_pairwise(pat_func, pat_val, span):
+    events = []
+    for event_func in pat_func.query(span):
+        for event_val in pat_val.query(span):
+            part = event_func.part.intersection(event_val.part)
+            if part is not None:
+                whole = event_func.whole.intersection_e(event_val.whole)
+                events.append(Event(whole, part, event_func.value(event_val.value)))
+    return events
+
+
+def test_app_both():
+    points = Pattern(
+        lambda span: [
+            Event(TimeSpan(t, t), TimeSpan(t, t), 10) for t in (span.begin, 0.5)
+        ]
+    )
+    pat_funcs = [
+        fastcat(1, 2, 3).fmap(lambda a: lambda b: a + b),
+        stack(fastcat(1, [2, 3]), slowcat(4, 5).slow(2)).fmap(
+            lambda a: lambda b: a * b
+        ),
+        points.fmap(lambda a: lambda b: a - b),
+    ]
+    pat_vals = [
+        fastcat(1, 2, 3, 4).late(1 / 3),
+        stack(slowcat(1, 2), fastcat(3, 4, 5)),
+        points,
+    ]
+    for pat_func in pat_funcs:
+        for pat_val in pat_vals:
+            for span in [TimeSpan(0, 1), TimeSpan(Fraction(1, 2), 3), TimeSpan(0, 0)]:
+                assert pat_func.app_both(pat_val).query(span) == _app_both_pairwise(
+                    pat_func, pat_val, span
+                )
+
+
 def test_rshift():
     assert_equal_patterns(
         s("a") >> n("0 1"),
@@ -514,6 +754,48 @@ def test_lshift():
         s("a").combine_left(n("0 1"))
     )
 
+def _app_left_chain(pats, merge):
+    # Merges control patterns one by one, as combine_right/left used to
+    pat = pats[0]
+    for other in pats[1:]:
+        pat = pat.fmap(lambda x: lambda y: merge(x, y)).app_left(other)
+    return pat
+
+
+@pytest.mark.parametrize(
+    "pats",
+    [
+        [s("a b"), n("0 1 2"), speed("1 <2 3>"), s("c? d")],
+        [s("a [b c]/2").late(0.25), n("0 1").slow(3), speed(saw().segment(3))],
+        [speed(saw()), n("0 1"), s("a b c")],
+    ],
+)
+def test_combine(pats):
+    right = _app_left_chain(pats, lambda x, y: {**x, **y})
+    left = _app_left_chain(pats, lambda x, y: {**y, **x})
+    span = TimeSpan(Fraction(-1, 3), 3)
+    for pat, expected in [
+        (pats[0].combine_right(*pats[1:]), right),
+        (pats[0].combine_left(*pats[1:]), left),
+    ]:
+        events = pat.query(span)
+        assert events == expected.query(span)
+        # Keys are in the same order too
+        assert [list(e.value) for e in events] == [
+            list(e.value) for e in expected.query(span)
+        ]
+        assert pat.query_many([span, TimeSpan(0, 1)]) == expected.query_many(
+            [span, TimeSpan(0, 1)]
+        )
+
+
+def test_combine_is_flattened():
+    pat = s("a") >> n("0 1") >> speed("1 2") >> [gain(1), s("b")]
+    assert len(pat.node.pats) == 5
+    assert len((s("a") << n("0 1") << speed("1 2")).node.pats) == 3
+    assert len((s("a") >> n("0 1") << speed("1 2")).node.pats) == 2
+    assert len(s("a").n("0 1").speed("1 2").node.pats) == 3
+
 def test_create_param():
     _foo = create_param('foo')
     assert _foo(5).first_cycle() == [
@@ -528,3 +810,305 @@ def test_create_params():
     assert s('bd').foo(17).bar(42).first_cycle() == [
         Event(TimeSpan(0, 1), TimeSpan(0, 1), {"s": "bd", "foo": 17, "bar": 42})
     ]
+
+
+QUERY_PATTERNS = [
+    lambda: pure("bd"),
+    lambda: stack(fastcat("bd", "sd"), slowcat("hh", "cp", "lt").fast(3)),
+    lambda: timecat((1, pure("bd").fast(3)), (2, fastcat("hh", "sd"))),
+    lambda: s(mini("bd*2 <sn cp> [~ hh]/3 lt@2")) >> n("0 1 2") >> speed(2),
+    lambda: s("bd sd").mask(fastcat(1, 0, 1)).rev().iter(4),
+    lambda: pure(1).segment(4) + saw(),
+    lambda: (fastcat(1, 2) * fastcat(3, 4, 5)).fmap(str),
+    lambda: s("bd").euclid(fastcat(3, 5), 8, fastcat(0, 1)),
+    lambda: n(irand(8).segment(4)).degrade(),
+]
+
+
+@pytest.mark.parametrize("pat", QUERY_PATTERNS)
+def test_query_many(pat):
+    spans = [
+        TimeSpan(0, 1),
+        TimeSpan(Fraction(1, 3), Fraction(5, 2)),
+        TimeSpan(7, 7),
+        TimeSpan(-1, Fraction(-1, 4)),
+        TimeSpan(0, 1),
+    ]
+    assert pat().query_many(spans) == [pat().query(span) for span in spans]
+
+
+def test_cycles():
+    pat = s(mini("bd <sn cp>"))
+    assert pat.cycles(2, 5) == [pat.query(TimeSpan(c, c + 1)) for c in range(2, 5)]
+    assert pat.cycles(5, 5) == []
+
+
+@pytest.mark.parametrize("pat", QUERY_PATTERNS)
+def test_iter_query(pat):
+    span = TimeSpan(Fraction(-1, 3), Fraction(5, 2))
+    events = pat().iter_query(span)
+    assert iter(events) is events
+    assert list(events) == pat().query(span)
+
+
+def test_iter_query_is_lazy():
+    def fail(span):
+        raise AssertionError("should not be queried")
+
+    pat = stack(fastcat("bd", "sd"), Pattern(fail)).fast(2).onsets_only()
+    assert next(pat.iter_query(TimeSpan(0, 1))) == Event(
+        TimeSpan(0, Fraction(1, 4)), TimeSpan(0, Fraction(1, 4)), "bd"
+    )
+
+
+@pytest.mark.parametrize("pat", QUERY_PATTERNS)
+def test_iter_onsets(pat):
+    for i in range(-2, 12):
+        span = TimeSpan(Fraction(i, 5), Fraction(i + 1, 5))
+        expected = [e for e in pat().iter_query(span) if e.has_onset()]
+        assert list(pat().iter_onsets(span)) == expected
+        assert pat().onsets_only().query(span) == expected
+
+
+def test_iter_onsets_skips_fragments():
+    values = []
+
+    def record(value):
+        values.append(value)
+        return value
+
+    pat = stack(pure("bd").slow(4), fastcat("hh", pure("sd").slow(3))).fmap(record)
+    assert list(pat.iter_onsets(TimeSpan(Fraction(1, 2), 1))) == []
+    assert values == []
+    assert list(pat.iter_onsets(TimeSpan(0, Fraction(1, 2)))) == [
+        Event(TimeSpan(0, 4), TimeSpan(0, Fraction(1, 2)), "bd"),
+        Event(TimeSpan(0, Fraction(1, 2)), TimeSpan(0, Fraction(1, 2)), "hh"),
+    ]
+    assert values == ["bd", "hh"]
+
+
+def test_onsets_only_is_built_once():
+    pat = s("bd sn")
+    assert pat.onsets_only() is pat.onsets_only()
+
+
+def test_cached():
+    pat = s(mini("bd*2 <sn cp>")) >> n("0 1 2")
+    cached = pat.cached(maxsize=2)
+    spans = [TimeSpan(0, 1), TimeSpan(1, 2), TimeSpan(0, 1), TimeSpan(2, 3)]
+    for span in spans:
+        assert cached.query(span) == pat.query(span)
+    info = cached.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 3, 2)
+    # Least recently used span was evicted
+    cached.query(TimeSpan(1, 2))
+    assert cached.cache_info().misses == 4
+    # Results can be modified without affecting the cache
+    cached.query(TimeSpan(2, 3)).clear()
+    assert cached.query(TimeSpan(2, 3)) == pat.query(TimeSpan(2, 3))
+    cached.cache_clear()
+    assert cached.cache_info().currsize == 0
+
+
+def test_cached_continuous():
+    pat = saw().cached()
+    assert pat.query(TimeSpan(0, Fraction(1, 2)))[0].value == Fraction(1, 4)
+    assert pat.query(TimeSpan(0, 1))[0].value == Fraction(1, 2)
+    assert pat.query(TimeSpan(0, Fraction(1, 2)))[0].value == Fraction(1, 4)
+    assert pat.cache_info().hits == 1
+
+
+def test_cache_size():
+    set_cache_size(3)
+    try:
+        assert pure(1).cached().cache_info().maxsize == 3
+    finally:
+        set_cache_size(256)
+    with pytest.raises(ValueError):
+        set_cache_size(-1)
+
+
+@pytest.mark.parametrize(
+    "pat, period",
+    [
+        (lambda: pure("bd"), 1),
+        (lambda: fastcat("bd", slowcat("sn", "cp", "hh")), 3),
+        (lambda: stack(pure(1).slow(2), fastcat(1, 2).slow(3)), 6),
+        (lambda: timecat((1, pure(1)), (2, slowcat(1, 2))), 2),
+        (lambda: polymeter(fastcat(1, 2, 3), fastcat(1, 2)), 1),
+        (lambda: pure(1)._fast(Fraction(2, 3)), Fraction(3, 2)),
+        (lambda: pure(1).fast(Fraction(2, 3)), 3),
+        (lambda: s("bd").euclid(fastcat(3, 5), 8), 1),
+        (lambda: s(mini("bd*2 <sn cp> {a b c}%4")) >> n("<0 1 2>"), 6),
+        (lambda: rand(), None),
+        (lambda: saw().segment(4), None),
+        (lambda: mini("bd? sn"), None),
+    ],
+)
+def test_period(pat, period):
+    assert pat().period() == period
+
+
+def event_key(event):
+    return (event.part.begin, event.part.end, event.whole.begin, str(event.value))
+
+
+@pytest.mark.parametrize(
+    "pat",
+    [
+        lambda: slowcat(1, fastcat(2, 3)),
+        lambda: pure(1).slow(2).early(0.5),
+        lambda: s(mini("bd*2 <sn cp> [~ hh]*3 {a b c}%4")) >> n("0 1 2"),
+        lambda: mini("bd(3,8,<0 2>) [sn cp]/1.5"),
+        lambda: fastcat(1, 2).rev().every(3, lambda p: p.fast(2)),
+        lambda: pure(1)._late(Fraction(1, 2)),
+        lambda: fastcat(1, 2, 3)._slow(2)._late(Fraction(1, 3)),
+    ],
+)
+def test_periodic(pat):
+    periodic = pat().periodic()
+    for span in [
+        TimeSpan(0, 1),
+        TimeSpan(Fraction(-7, 3), Fraction(25, 4)),
+        TimeSpan(5, Fraction(51, 10)),
+        TimeSpan(Fraction(1, 3), Fraction(1, 3)),
+    ]:
+        assert sorted(periodic.query(span), key=event_key) == sorted(
+            pat().query(span), key=event_key
+        )
+
+
+@pytest.mark.parametrize(
+    "pat, period",
+    [
+        (lambda: pure("a")._late(Fraction(1, 2)), None),
+        (lambda: fastcat("a", "b")._slow(3), None),
+        (lambda: stack(fastcat("a", "b"), pure("c")._late(Fraction(1, 4))), None),
+        # Events longer than the period can't be sliced
+        (lambda: pure("a")._slow(3), 2),
+    ],
+)
+def test_periodic_boundaries(pat, period):
+    # Events crossing the boundary of a period are not split, and events are
+    # returned in the same order as the pattern
+    periodic = pat().periodic(period)
+    for span in [
+        TimeSpan(Fraction(1, 4), Fraction(5, 4)),
+        TimeSpan(Fraction(5, 4), Fraction(15, 4)),
+        TimeSpan(Fraction(-2, 3), Fraction(1, 2)),
+    ]:
+        assert periodic.query(span) == pat().query(span)
+
+
+def test_periodic_fallback():
+    pat = n(irand(8).segment(4))
+    assert pat.periodic() is pat
+    # Continuous events can't be taken from a table
+    assert saw().periodic(1).query(TimeSpan(0, Fraction(1, 2))) == saw().query(
+        TimeSpan(0, Fraction(1, 2))
+    )
+    with pytest.raises(ValueError):
+        pure(1).periodic(0)
+
+
+def test_periodic_declared():
+    pat = n(irand(8).segment(4))
+    periodic = pat.periodic(period=1)
+    assert periodic.period() == 1
+    assert periodic.query(TimeSpan(3, 4)) == [
+        event.with_span(lambda span: span.with_time(lambda t: t + 3))
+        for event in pat.query(TimeSpan(0, 1))
+    ]
+
+
+def test_pattern_nodes():
+    pat = fastcat("bd", slowcat("sn", "cp"))
+    assert isinstance(pat.node, Fast)
+    assert pat.node.factor == 2
+    (child,) = pat.node.children()
+    assert isinstance(child.node, Slowcat)
+    assert len(child.node.children()) == 2
+    assert pure("bd").node == Pure("bd")
+    assert repr(pure(1)._fast(2).node) == "Fast(Pure(1), Fraction(2, 1))"
+
+
+def test_pattern_nodes_are_structural():
+    a = stack(fastcat("bd", "sd"), pure(1)._early(0.25))
+    b = stack(fastcat("bd", "sd"), pure(1)._early(0.25))
+    assert a.node == b.node
+    assert hash(a.node) == hash(b.node)
+    assert a.node != stack(fastcat("bd", "hh"), pure(1)._early(0.25)).node
+    assert len({a.node, b.node}) == 1
+    with pytest.raises(AttributeError):
+        a.node.pats = ()
+
+
+def test_pattern_from_query():
+    pat = Pattern(lambda span: [Event(span, span, "bd")])
+    assert isinstance(pat.node, Query)
+    assert pat.query(TimeSpan(0, 1)) == [Event(TimeSpan(0, 1), TimeSpan(0, 1), "bd")]
+
+
+def test_pickle_pattern():
+    pat = s(mini("bd*2 <sn cp> [~ hh]"))
+    restored = pickle.loads(pickle.dumps(mini("bd*2 <sn cp> [~ hh]")))
+    assert restored.node == mini("bd*2 <sn cp> [~ hh]").node
+    assert s(restored).query(TimeSpan(0, 2)) == pat.query(TimeSpan(0, 2))
+
+
+OPTIMIZE_PATTERNS = [
+    pure("bd").fast(2).slow(3).early(0.25),
+    fastcat("a", "b", "c").fast(Fraction(5, 3)).late(Fraction(1, 7)).slow(2),
+    saw().fast(3).slow(2).late(0.1),
+    pure(1).fast("<1 2>").slow(2),
+    rev(fastcat(1, 2, 3).fast(2).late(0.5)).early(Fraction(1, 3)),
+    mini("[[bd sn]*2]/3 [bd*2]*3 <a b>*3"),
+    s(mini("bd*2 <sn cp> [hh hh hh]/3")) >> n("0 1 2 3"),
+    timecat((3, pure("bd").fast(4)), (1, pure("hh").fast(8))),
+]
+
+
+@pytest.mark.parametrize("backend", ["fraction", "ticks"])
+@pytest.mark.parametrize("pat", OPTIMIZE_PATTERNS)
+def test_optimize(pat, backend):
+    set_time_backend(backend)
+    try:
+        optimized = pat.optimize()
+        for span in [
+            TimeSpan(0, 4),
+            TimeSpan(Fraction(-1, 3), Fraction(7, 5)),
+            TimeSpan(Fraction(1, 10), Fraction(3, 10)),
+            TimeSpan(Fraction(1, 2), Fraction(1, 2)),
+        ]:
+            assert optimized.query(span) == pat.query(span)
+            assert list(optimized.iter_query(span)) == pat.query(span)
+        assert optimized.cycles(0, 3) == pat.cycles(0, 3)
+        assert optimized.period() == pat.period()
+    finally:
+        set_time_backend("fraction")
+
+
+def test_optimize_fuses_time_transforms():
+    pat = pure("bd")._fast(2)._slow(3)._early(0.25)
+    node = pat.optimize().node
+    assert node == Affine(pure("bd"), Fraction(2, 3), Fraction(1, 6))
+    assert pure("bd")._fast(2)._slow(2).optimize().node == Pure("bd")
+    # Patterned transformations split queries at cycle boundaries
+    node = mini("[bd*2]/2").optimize().node
+    assert node == SplitQueries(pure("bd"))
+    node = pure("bd").fast(2).fast(3).optimize().node
+    assert node == SplitQueriesAt(pure("bd")._fast(6), ((Fraction(1, 3), 0),))
+
+
+@pytest.mark.parametrize("arg", [2, Fraction(2, 3), "2", pure(2), [2], mini("0.5")])
+def test_patternify_constant(arg):
+    pat = fastcat("bd", slowcat("sn", "cp")).slow(3)
+    joined = sequence(arg).fmap(lambda value: pat._fast(value)).inner_join()
+    assert pat.fast(arg).query(TimeSpan(0, 5)) == joined.query(TimeSpan(0, 5))
+    assert isinstance(pat.fast(arg).node, SplitQueries)
+
+
+def test_patternify_mini_modifiers():
+    # Constant modifiers do not join a pattern of values
+    assert "Bind" not in repr(mini("bd*2 [sn cp]/3").node)
+    assert "Bind" in repr(mini("bd*<2 3>").node)
@@ -0,0 +1,76 @@
+from fractions import Fraction
+
+import pytest
+
+from vortex.pattern import TimeSpan, random_seed
+from vortex.pool import ProcessPool, define, query_records, records_to_events
+from vortex.ticks import set_time_backend
+
+SOURCES = [
+    's("bd*2 <sn cp> [~ hh]*3").every(3, lambda p: p.fast(2)) >> n("0 1")',
+    'n(irand(8).segment(5)).degrade_by(0.3) >> s("superpiano")',
+    's("arpy(3,8)").slow(3).late(0.25)',
+]
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with ProcessPool(2) as pool:
+        yield pool
+
+
+def test_define():
+    pat = define('s("bd sn").fast(2)')
+    assert pat.source == 's("bd sn").fast(2)'
+    assert [e.value for e in pat.first_cycle()] == [{"s": s} for s in ["bd", "sn"] * 2]
+    with pytest.raises(TypeError):
+        define("1 + 2")
+
+
+def test_records():
+    pat = define(SOURCES[0])
+    span = TimeSpan(Fraction(1, 3), 3)
+    records = query_records(pat, span)
+    assert records == [
+        (e.whole.begin, e.whole.end, e.value) for e in pat.iter_onsets(span)
+    ]
+    events = records_to_events(records)
+    assert [(e.whole, e.value) for e in events] == [
+        (e.whole, e.value) for e in pat.iter_onsets(span)
+    ]
+
+
+def test_query_many(pool):
+    queries = [
+        (f"d{i}", define(source), TimeSpan(i, i + Fraction(7, 3)), "seed")
+        for i, source in enumerate(SOURCES * 2)
+    ]
+    expected = []
+    for _, pat, span, seed in queries:
+        with random_seed(seed):
+            expected.append(query_records(pat, span))
+    assert pool.query_many(queries) == expected
+    # Streams are assigned to workers in turn
+    assert [pool.worker(f"d{i}") for i in range(6)] == [0, 1, 0, 1, 0, 1]
+    # Queries of streams without a name are sent to the workers in turn,
+    # without assigning them
+    assert [pool.worker(None) for i in range(4)] == [0, 1, 0, 1]
+    assert None not in pool._workers
+
+
+def test_submit(pool):
+    pat = define(SOURCES[1])
+    span = TimeSpan(0, 4)
+    assert pool.submit("d1", pat, span).result() == query_records(pat, span)
+    with pytest.raises(ValueError):
+        pool.submit("d1", pat.fast(2), span)
+
+
+def test_query_many_ticks_backend(pool):
+    set_time_backend("ticks")
+    try:
+        pat = define(SOURCES[2])
+        span = TimeSpan(0, 6)
+        assert pool.query_many([("d1", pat, span, None)]) == [query_records(pat, span)]
+    finally:
+        set_time_backend("fraction")
@@ -71,6 +71,19 @@ def test_span_cycles():
     assert sc[2].end == a.end
 
 
+def test_timespan_is_immutable():
+    a = pyt.TimeSpan(1, 4)
+    with pytest.raises(AttributeError):
+        a.begin = Fraction(2)
+    with pytest.raises(AttributeError):
+        a.foo = 1
+
+
+def test_timespan_hash():
+    assert hash(pyt.TimeSpan(1, 4)) == hash(pyt.TimeSpan(Fraction(1), 4.0))
+    assert len({pyt.TimeSpan(0, 1), pyt.TimeSpan(0, 1), pyt.TimeSpan(0, 2)}) == 2
+
+
 # Event Class tests
 def test_event_span():
     e = pyt.Event(0.25, 0.5, 1)
@@ -93,6 +106,27 @@ def test_event_value():
     assert ws.value == 2
 
 
+def test_event_is_immutable():
+    e = pyt.Event(pyt.TimeSpan(0, 1), pyt.TimeSpan(0, 1), 1)
+    with pytest.raises(AttributeError):
+        e.value = 2
+    assert not hasattr(e, "__dict__")
+
+
+def test_event_hash():
+    a = pyt.Event(pyt.TimeSpan(0, 1), pyt.TimeSpan(0, 0.5), "bd")
+    b = pyt.Event(pyt.TimeSpan(0, 1), pyt.TimeSpan(0, 0.5), "bd")
+    assert hash(a) == hash(b)
+    assert len({a, b}) == 1
+
+
+def test_event_pickle():
+    import pickle
+
+    e = pyt.Event(pyt.TimeSpan(0, 1), pyt.TimeSpan(0, 0.5), "bd")
+    assert pickle.loads(pickle.dumps(e)) == e
+
+
 def test_has_onset():
     e = pyt.Event(pyt.TimeSpan(0.5, 1.5), pyt.TimeSpan(0.5, 1), "hello")
     assert e.has_onset
@@ -0,0 +1,51 @@
+import pytest
+
+from vortex.stats import ClockStats, Samples, StreamStats, format_stats
+
+
+def test_samples():
+    samples = Samples(window=100)
+    assert samples.percentile(50) is None
+    assert samples.summary() == {}
+    for i in range(150):
+        samples.add(i)
+    # Only the last values are summarized
+    assert samples.values() == list(range(50, 150))
+    assert (samples.count, samples.total) == (150, sum(range(150)))
+    assert samples.percentile(0) == 50
+    assert samples.percentile(50) == 99.5
+    assert samples.percentile(100) == 149
+    assert samples.summary() == {
+        "mean": 99.5,
+        "p50": 99.5,
+        "p95": pytest.approx(144.05),
+        "p99": pytest.approx(148.01),
+        "max": 149,
+    }
+    with pytest.raises(ValueError):
+        samples.percentile(101)
+
+
+def test_stream_stats():
+    stats = StreamStats()
+    stats.record_tick(0.002, 3, 0)
+    stats.record_tick(0.004, 1, 1)
+    summary = stats.summary()
+    assert summary["ticks"] == 2
+    assert summary["query_time"]["max"] == 0.004
+    assert summary["events"]["mean"] == 2
+    assert summary["late"] == 1
+
+
+def test_format_stats():
+    clock = ClockStats()
+    clock.record_tick(0.001, 0.003)
+    stream = StreamStats()
+    stream.record_tick(0.002, 4, 1)
+    line = format_stats(clock, {"d1": stream, "d2": StreamStats()})
+    assert line == (
+        "ticks 1 | jitter p50 1.00ms p99 1.00ms max 1.00ms"
+        " | tick p50 3.00ms p99 3.00ms max 3.00ms"
+        " | d1: query p50 2.00ms p99 2.00ms max 2.00ms, 4.0 events/tick, 1 late"
+        " | d2: query -, 0.0 events/tick, 0 late"
+    )
@@ -0,0 +1,367 @@
+import logging
+import sys
+import threading
+import time
+import types
+from fractions import Fraction
+
+import pytest
+
+from vortex.control import n, s
+from vortex.mini import mini
+from vortex.pattern import Pattern, TimeSpan, irand, random_seed
+from vortex.pool import ProcessPool, define
+
+# Streams send events with liblo and follow a Link session, which are not
+# needed to test how they query patterns
+try:
+    import liblo  # noqa: F401
+except ImportError:
+    liblo = sys.modules["liblo"] = types.ModuleType("liblo")
+    liblo.time = lambda: 0.0
+try:
+    import link  # noqa: F401
+except ImportError:
+    sys.modules["link"] = types.ModuleType("link")
+
+from vortex.stream import BaseStream, LinkClock  # noqa: E402
+
+
+class SessionState:
+    """Link session state at 120 BPM, starting at time 0"""
+
+    def tempo(self):
+        return 120.0
+
+    def beatAtTime(self, time, quantum):
+        return time / 500000
+
+    def timeAtBeat(self, beat, quantum):
+        return beat * 500000
+
+    def isPlaying(self):
+        return True
+
+
+class RecordingStream(BaseStream):
+    """Records the cycle and value of the events it plays"""
+
+    latency = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.played = []
+
+    def notify_event(self, event, timestamp, cps, cycle, delta):
+        self.played.append((cycle, event))
+
+
+def tick(stream, begin, end):
+    stream.notify_tick((begin, end), SessionState(), 0.5, 4, 1000000, 0)
+
+
+def play(stream, bounds):
+    """Ticks the stream over consecutive spans, between the given bounds"""
+    for begin, end in zip(bounds, bounds[1:]):
+        tick(stream, begin, end)
+
+
+def ticks(begin, end, widths=(Fraction(1, 20),)):
+    """Bounds of ticks from `begin` to `end`, of the given widths in turn"""
+    bounds = [Fraction(begin)]
+    i = 0
+    while bounds[-1] < end:
+        bounds.append(min(bounds[-1] + widths[i % len(widths)], Fraction(end)))
+        i += 1
+    return bounds
+
+
+def onsets(pattern, spans, seed=None):
+    """The events of a pattern with onsets in the spans, as streams play them"""
+    events = []
+    with random_seed(seed):
+        for begin, end in spans:
+            events.extend(
+                (float(e.whole.begin), e.value)
+                for e in pattern.iter_onsets(TimeSpan(begin, end))
+            )
+    return events
+
+
+def event_key(event):
+    return event[0], str(event[1])
+
+
+def assert_played(stream, expected):
+    assert sorted(stream.played, key=event_key) == sorted(expected, key=event_key)
+
+
+PATTERN = s(mini("bd*8? <sn cp> [~ hh]*3 arpy(3,8)"))
+# Every event depends on the random seed
+RANDOM = n(irand(100).segment(16))
+
+
+@pytest.mark.parametrize("lookahead", [Fraction(1, 40), Fraction(1, 2), 2])
+@pytest.mark.parametrize(
+    "widths",
+    [
+        [Fraction(1, 20)],
+        # Ticks on the onsets of events
+        [Fraction(1, 8)],
+        # The tempo changes
+        [Fraction(1, 20), Fraction(1, 10), Fraction(1, 50), Fraction(1, 7)],
+    ],
+)
+def test_lookahead(lookahead, widths):
+    stream = RecordingStream(seed="d1", lookahead=lookahead)
+    stream.pattern = PATTERN
+    play(stream, ticks(0, 3, widths))
+    assert_played(stream, onsets(PATTERN, [(0, 3)], seed="d1"))
+    assert stream.played == sorted(stream.played, key=lambda e: e[0])
+
+
+def test_lookahead_metrics():
+    stream = RecordingStream(lookahead=Fraction(1, 2))
+    assert stream.metrics() == {"queue_depth": 0, "ahead": 0.0}
+    stream.pattern = s(mini("bd*8"))
+    tick(stream, 0, Fraction(1, 20))
+    # The window up to the lookahead is buffered, except for the event due
+    assert stream.metrics() == {"queue_depth": 4, "ahead": 0.5}
+    play(stream, ticks(Fraction(1, 20), Fraction(3, 10)))
+    # Until half of it is left
+    assert stream.metrics() == {"queue_depth": 2, "ahead": 0.25}
+    tick(stream, Fraction(3, 10), Fraction(7, 20))
+    assert stream.metrics() == {"queue_depth": 4, "ahead": 0.5}
+
+
+def test_lookahead_pattern_change():
+    stream = RecordingStream(lookahead=Fraction(1, 2))
+    stream.pattern = PATTERN
+    play(stream, ticks(0, 1))
+    # The buffered events of the previous pattern are dropped
+    stream.pattern = other = s(mini("superpiano*3"))
+    play(stream, ticks(1, 2))
+    assert_played(stream, onsets(PATTERN, [(0, 1)]) + onsets(other, [(1, 2)]))
+
+
+def test_lookahead_seed_change():
+    stream = RecordingStream(seed=1, lookahead=Fraction(1, 2))
+    stream.pattern = PATTERN
+    play(stream, ticks(0, 1))
+    stream.seed = 2
+    play(stream, ticks(1, 2))
+    assert onsets(PATTERN, [(1, 2)], seed=1) != onsets(PATTERN, [(1, 2)], seed=2)
+    assert_played(
+        stream, onsets(PATTERN, [(0, 1)], seed=1) + onsets(PATTERN, [(1, 2)], seed=2)
+    )
+
+
+def test_lookahead_clock_jumps():
+    stream = RecordingStream(lookahead=Fraction(1, 2))
+    stream.pattern = PATTERN
+    # The clock jumps forward, within and past the lookahead, and back
+    for begin, end in [(0, 1), (Fraction(5, 4), 2), (5, 6), (3, 4)]:
+        play(stream, ticks(begin, end))
+    expected = onsets(PATTERN, [(0, 1), (Fraction(5, 4), 2), (5, 6), (3, 4)])
+    assert_played(stream, expected)
+
+
+def test_lookahead_sends_before_refill():
+    log = []
+
+    def query(span):
+        # Patterns are queried without holding the lock of the buffer
+        locked = []
+
+        def try_lock():
+            locked.append(not stream._pending_cond.acquire(blocking=False))
+            if not locked[-1]:
+                stream._pending_cond.release()
+
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        log.append(("query", span.begin, span.end, locked[0]))
+        return s(mini("bd*8")).query(span)
+
+    class LoggingStream(RecordingStream):
+        def notify_event(self, event, timestamp, cps, cycle, delta):
+            log.append(("send", cycle))
+
+    stream = LoggingStream(lookahead=Fraction(1, 2))
+    stream.pattern = Pattern(query)
+    tick(stream, 0, Fraction(1, 20))
+    tick(stream, Fraction(1, 20), Fraction(1, 10))
+    # The due events are queried and sent, then the buffer is refilled
+    assert log == [
+        ("query", 0, Fraction(1, 20), False),
+        ("send", 0.0),
+        ("query", Fraction(1, 20), Fraction(11, 20), False),
+    ]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_threaded():
+    stream = RecordingStream(seed="d1", lookahead=Fraction(1, 2), threaded=True)
+    stream.pattern = PATTERN
+    try:
+        tick(stream, 0, Fraction(1, 20))
+        # The worker fills the buffer up to the lookahead
+        wait_for(lambda: stream.metrics()["ahead"] == 0.5)
+        bounds = ticks(Fraction(1, 20), 3, [Fraction(1, 20), Fraction(1, 7)])
+        for begin, end in zip(bounds, bounds[1:]):
+            tick(stream, begin, end)
+            time.sleep(0.001)
+    finally:
+        stream.close()
+    assert stream._worker is None
+    assert_played(stream, onsets(PATTERN, [(0, 3)], seed="d1"))
+
+
+def test_threaded_stale_window():
+    # The worker is blocked querying a window with the first seed, while the
+    # seed changes and the clock jumps back to the start of that window
+    started = threading.Event()
+    resume = threading.Event()
+
+    def query(span):
+        if threading.current_thread() is stream._worker:
+            started.set()
+            resume.wait(5)
+        return RANDOM.query(span)
+
+    pattern = Pattern(query)
+    stream = RecordingStream(seed=1, lookahead=Fraction(1, 2), threaded=True)
+    stream.pattern = pattern
+    try:
+        tick(stream, 0, Fraction(1, 20))
+        assert started.wait(5)
+        stream.seed = 2
+        tick(stream, 0, Fraction(1, 20))
+        resume.set()
+        wait_for(lambda: stream.metrics()["ahead"] == 0.5)
+        play(stream, ticks(Fraction(1, 20), 1))
+    finally:
+        stream.close()
+    # The window queried with the previous seed is dropped
+    assert_played(
+        stream,
+        onsets(RANDOM, [(0, Fraction(1, 20))], seed=1)
+        + onsets(RANDOM, [(0, 1)], seed=2),
+    )
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with ProcessPool(2) as pool:
+        yield pool
+
+
+def test_pool(pool, monkeypatch):
+    workers = []
+    worker = pool.worker
+    monkeypatch.setattr(
+        pool, "worker", lambda name: workers.append(worker(name)) or workers[-1]
+    )
+    pattern = define('s("bd*2 <sn cp> [~ hh]*3") >> n(irand(8).segment(16))')
+    streams = [
+        RecordingStream(seed=seed, lookahead=Fraction(1, 2), pool=pool)
+        for seed in [1, 2]
+    ]
+    for stream in streams:
+        stream.pattern = pattern
+    bounds = ticks(0, 2, [Fraction(1, 20), Fraction(1, 7)])
+    for begin, end in zip(bounds, bounds[1:]):
+        for stream in streams:
+            tick(stream, begin, end)
+            # The pool keeps the buffer filled ahead of the clock
+            wait_for(lambda: stream.metrics()["ahead"] >= 0.25)
+    for seed, stream in zip([1, 2], streams):
+        assert_played(stream, onsets(pattern, [(0, 2)], seed=seed))
+    # The queries of streams without a name are spread over the workers
+    assert set(workers) == {0, 1}
+
+
+def test_pool_undefined_pattern(pool):
+    # Patterns not built with `define` are queried by the stream itself
+    stream = RecordingStream(lookahead=Fraction(1, 2), pool=pool)
+    stream.pattern = PATTERN
+    play(stream, ticks(0, 2))
+    assert_played(stream, onsets(PATTERN, [(0, 2)]))
+
+
+class FakeLink:
+    """Link session of `SessionState`, following the monotonic clock"""
+
+    def __init__(self, bpm):
+        self.enabled = False
+
+    def clock(self):
+        return self
+
+    def micros(self):
+        return int(time.monotonic() * 1000000)
+
+    def captureSessionState(self):
+        return SessionState()
+
+
+class FailingSubscriber:
+    def __init__(self):
+        self.ticks = 0
+
+    def notify_tick(self, *args):
+        self.ticks += 1
+        if self.ticks % 2:
+            raise RuntimeError("failing subscriber")
+        raise ValueError("failing subscriber")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr("vortex.stream.link.Link", FakeLink, raising=False)
+    return LinkClock()
+
+
+def run(clock, stream, ticks):
+    clock.start()
+    try:
+        wait_for(lambda: stream.stats.query_time.count >= ticks)
+    finally:
+        clock.stop()
+
+
+def test_clock_failing_subscriber(clock, caplog):
+    stream = RecordingStream(name="d1")
+    stream.pattern = s(mini("bd*16"))
+    clock.subscribe(FailingSubscriber())
+    clock.subscribe(stream)
+    with caplog.at_level(logging.ERROR, logger="vortex.stream"):
+        run(clock, stream, 5)
+    # The other subscribers are notified, and errors are counted, but only
+    # logged the first time for each type
+    assert stream.played
+    assert clock.stats.errors >= 5
+    errors = [r for r in caplog.records if r.levelno == logging.ERROR]
+    assert [r.exc_info[0] for r in errors] == [RuntimeError, ValueError]
+
+
+def test_clock_stats(clock):
+    stream = RecordingStream(name="d1")
+    stream.pattern = s(mini("bd*16"))
+    clock.subscribe(stream)
+    run(clock, stream, 5)
+    assert clock.stats.jitter.count >= 5
+    assert clock.stats.tick_time.count == clock.stats.jitter.count
+    assert stream.stats.events.total == len(stream.played) > 0
+    summary = clock.stats_summary()
+    assert summary["ticks"] == clock.stats.jitter.count
+    assert summary["errors"] == 0
+    assert summary["streams"]["d1"]["ticks"] == stream.stats.query_time.count
+    assert summary["streams"]["d1"]["query_time"]["max"] > 0
@@ -0,0 +1,141 @@
+from fractions import Fraction
+
+import pytest
+
+from vortex.control import n, s
+from vortex.mini import mini
+from vortex.pattern import (
+    Event,
+    TimeSpan,
+    fastcat,
+    pure,
+    saw,
+    slowcat,
+    stack,
+    timecat,
+    tri,
+)
+from vortex.ticks import Tick, get_time_backend, quantize_time, set_time_backend
+
+
+@pytest.fixture
+def ticks_backend():
+    set_time_backend("ticks")
+    yield
+    set_time_backend("fraction")
+
+
+def test_default_backend():
+    assert get_time_backend() == "fraction"
+    assert type(TimeSpan(0, 1).begin) is Fraction
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        set_time_backend("floats")
+
+
+def test_tick_from_value():
+    assert Tick.from_value(1).ticks == Tick.resolution
+    assert Tick.from_value(Fraction(1, 3)).ticks == Tick.resolution // 3
+    assert Tick.from_value(0.25).ticks == Tick.resolution // 4
+    # Not representable at the default resolution, falls back to a Fraction
+    assert type(Tick.from_value(Fraction(1, 17))) is Fraction
+    assert type(Tick.from_value(0.1)) is Fraction
+
+
+def test_tick_equals_fraction():
+    t = Tick.from_value(Fraction(3, 4))
+    assert t == Fraction(3, 4)
+    assert Fraction(3, 4) == t
+    assert t == 0.75
+    assert hash(t) == hash(Fraction(3, 4))
+    assert hash(Tick.from_value(2)) == hash(2)
+    assert (t.numerator, t.denominator) == (3, 4)
+    assert Fraction(t) == Fraction(3, 4)
+
+
+def test_tick_arithmetic():
+    a = Tick.from_value(Fraction(1, 2))
+    b = Tick.from_value(Fraction(1, 3))
+    assert type(a + b) is Tick and a + b == Fraction(5, 6)
+    assert type(a - 1) is Tick and a - 1 == Fraction(-1, 2)
+    assert type(1 - a) is Tick and 1 - a == Fraction(1, 2)
+    assert type(a * 3) is Tick and a * 3 == Fraction(3, 2)
+    assert type(a / 2) is Tick and a / 2 == Fraction(1, 4)
+    assert a * Fraction(2, 3) == Fraction(1, 3)
+    assert a / Fraction(2, 3) == Fraction(3, 4)
+    assert 1 / a == 2
+    assert a / 17 == Fraction(1, 34)
+    assert type(a / 17) is Fraction
+    assert a * 0.5 == 0.25
+    assert b < a and a > b and a <= a and a >= Fraction(1, 2)
+    assert Fraction(1, 3) < a
+
+
+def test_tick_repr():
+    assert repr(Tick.from_value(Fraction(3, 4))) == "Tick(3/4)"
+    assert repr(Tick.from_value(2)) == "Tick(2/1)"
+    assert str(Tick.from_value(Fraction(3, 4))) == "3/4"
+
+
+def test_tick_cycle_functions():
+    t = Tick.from_value(Fraction(7, 4))
+    assert t.sam() == 1
+    assert t.next_sam() == 2
+    assert t.cycle_pos() == Fraction(3, 4)
+    assert t.whole_cycle() == TimeSpan(1, 2)
+    assert int(t) == 1
+    assert float(t) == 1.75
+    assert round(t) == 2
+
+
+def test_quantize_time(ticks_backend):
+    t = quantize_time(0.1)
+    assert type(t) is Tick
+    assert t <= 0.1 < t + Tick(1)
+
+
+def test_timespan_with_ticks(ticks_backend):
+    span = TimeSpan(0.25, Fraction(3, 2))
+    assert type(span.begin) is Tick
+    assert type(span.end) is Tick
+    assert span.span_cycles() == [TimeSpan(0.25, 1), TimeSpan(1, 1.5)]
+    assert span.midpoint() == Fraction(7, 8)
+
+
+@pytest.mark.parametrize(
+    "pat",
+    [
+        lambda: pure("bd"),
+        lambda: fastcat("bd", "sd", "hh"),
+        lambda: slowcat("bd", fastcat("sd", "hh")).fast(3),
+        lambda: stack(fastcat("bd", "sd"), pure("hh").slow(3)),
+        lambda: timecat((3, pure("bd").fast(4)), (1, pure("hh").fast(8))),
+        lambda: s(mini("bd*2 <sn cp> [hh hh hh]/3")) >> n("0 1 2 3"),
+        lambda: pure("bd").fast(Fraction(1, 17)).early(0.1),
+    ],
+)
+def test_backends_are_equivalent(pat):
+    span = TimeSpan(Fraction(-1, 3), 4)
+    expected = sorted(pat().query(span))
+    set_time_backend("ticks")
+    try:
+        events = sorted(pat().query(span))
+    finally:
+        set_time_backend("fraction")
+    assert events == expected
+
+
+@pytest.mark.parametrize("pat", [saw, tri, lambda: saw().segment(4)])
+def test_signal_values_are_not_ticks(pat):
+    # Times sampled by signals become values as fractions, with either backend
+    span = TimeSpan(Fraction(1, 3), 2)
+    expected = pat().query(span)
+    set_time_backend("ticks")
+    try:
+        events = pat().query(span)
+    finally:
+        set_time_backend("fraction")
+    assert events == expected
+    assert [type(e.value) for e in events] == [type(e.value) for e in expected]
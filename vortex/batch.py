@@ -0,0 +1,415 @@
+"""
+Columnar query results
+
+`Pattern.query_batch` returns an `EventBatch` instead of a list of `Event`
+objects.  An event batch stores the timespans of its events as integer NumPy
+arrays of ticks (at a per-batch resolution, i.e. a common denominator), and
+the values as a NumPy array, so that combinators can transform all events at
+once without creating Python objects per event.
+
+Requires NumPy.
+
+"""
+
+import math
+from fractions import Fraction
+from functools import reduce
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from .ticks import to_time
+
+# Largest absolute tick value that fits in an int64
+_MAX_TICKS = 2**63 - 1
+
+
+def _lcm(a: int, b: int) -> int:
+    return a * b // math.gcd(a, b)
+
+
+def vectorized(func):
+    """
+    Decorator to mark a function as accepting (and returning) NumPy arrays,
+    so that batched queries can apply it to a whole column of values at once
+    instead of calling it once per value.
+
+    NumPy ufuncs are always considered vectorized.
+
+    >>> pat.fmap(vectorized(lambda x: x * 2 + 1))
+
+    """
+    func.vectorized = True
+    return func
+
+
+def _check_numpy():
+    if np is None:
+        raise ImportError("Batched queries require NumPy")
+
+
+def is_vectorized(func) -> bool:
+    """Returns whether a function can be applied to NumPy arrays"""
+    return isinstance(func, np.ufunc) or getattr(func, "vectorized", False)
+
+
+def values_array(values: list):
+    """Builds a NumPy array of values, with a numeric dtype if all values are
+    ints or all are floats, otherwise with an object dtype (so that mixed
+    ints and floats are not cast to floats, like in `EventBatch.concat`)"""
+    types = {type(v) for v in values}
+    if types == {float} or (
+        types <= {int} and all(-(2**63) <= v < 2**63 for v in values)
+    ):
+        return np.array(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+class EventBatch:
+    """
+    A batch of events, stored as columns of NumPy arrays.
+
+    Time values are stored as int64 tick arrays, where `resolution` is the
+    number of ticks per cycle, so the time of tick `t` is `t / resolution`.
+    Events without a whole (from continuous patterns) have `has_whole` set to
+    False, and their whole columns are equal to their part columns.
+
+    """
+
+    __slots__ = (
+        "resolution",
+        "whole_begin",
+        "whole_end",
+        "part_begin",
+        "part_end",
+        "has_whole",
+        "values",
+    )
+
+    def __init__(
+        self,
+        resolution,
+        whole_begin,
+        whole_end,
+        part_begin,
+        part_end,
+        has_whole,
+        values,
+    ):
+        self.resolution = resolution
+        self.whole_begin = whole_begin
+        self.whole_end = whole_end
+        self.part_begin = part_begin
+        self.part_end = part_end
+        self.has_whole = has_whole
+        self.values = values
+
+    @staticmethod
+    def empty():
+        """Returns a batch without events"""
+        _check_numpy()
+        ticks = np.zeros(0, dtype=np.int64)
+        return EventBatch(
+            1, ticks, ticks, ticks, ticks, np.zeros(0, dtype=bool), values_array([])
+        )
+
+    @staticmethod
+    def from_events(events):
+        """Builds a batch from a list of events"""
+        _check_numpy()
+        if not events:
+            return EventBatch.empty()
+        wholes = [e.whole or e.part for e in events]
+        parts = [e.part for e in events]
+        resolution = reduce(
+            _lcm,
+            (t.denominator for span in wholes + parts for t in (span.begin, span.end)),
+            1,
+        )
+
+        def ticks(times):
+            return np.array(
+                [t.numerator * (resolution // t.denominator) for t in times],
+                dtype=np.int64,
+            )
+
+        return EventBatch(
+            resolution,
+            ticks([span.begin for span in wholes]),
+            ticks([span.end for span in wholes]),
+            ticks([span.begin for span in parts]),
+            ticks([span.end for span in parts]),
+            np.array([e.whole is not None for e in events], dtype=bool),
+            values_array([e.value for e in events]),
+        )
+
+    @staticmethod
+    def pure(span, value):
+        """Returns the batch of a `pure` pattern of `value` queried over `span`"""
+        _check_numpy()
+        resolution = _lcm(span.begin.denominator, span.end.denominator)
+        begin = span.begin.numerator * (resolution // span.begin.denominator)
+        end = span.end.numerator * (resolution // span.end.denominator)
+        if end <= begin:
+            return EventBatch.empty()
+        cycles = np.arange(begin // resolution, -(-end // resolution), dtype=np.int64)
+        whole_begin = cycles * resolution
+        whole_end = whole_begin + resolution
+        return EventBatch(
+            resolution,
+            whole_begin,
+            whole_end,
+            np.maximum(whole_begin, begin),
+            np.minimum(whole_end, end),
+            np.ones(len(cycles), dtype=bool),
+            values_array([value] * len(cycles)),
+        )
+
+    @staticmethod
+    def concat(batches):
+        """Concatenates a list of batches (i.e. stacks them)"""
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return EventBatch.empty()
+        if len(batches) == 1:
+            return batches[0]
+        resolution = reduce(_lcm, (b.resolution for b in batches), 1)
+        batches = [b.with_resolution(resolution) for b in batches]
+        values = [b.values for b in batches]
+        if len({v.dtype for v in values}) > 1:
+            # Avoid casting values (e.g. ints to floats) when mixing dtypes
+            values = [v.astype(object) for v in values]
+        return EventBatch(
+            resolution,
+            np.concatenate([b.whole_begin for b in batches]),
+            np.concatenate([b.whole_end for b in batches]),
+            np.concatenate([b.part_begin for b in batches]),
+            np.concatenate([b.part_end for b in batches]),
+            np.concatenate([b.has_whole for b in batches]),
+            np.concatenate(values),
+        )
+
+    def __len__(self) -> int:
+        return len(self.part_begin)
+
+    def __repr__(self) -> str:
+        return f"<EventBatch of {len(self)} events at resolution {self.resolution}>"
+
+    def _max_ticks(self) -> int:
+        if not len(self):
+            return 0
+        return max(
+            int(np.abs(a).max())
+            for a in (self.whole_begin, self.whole_end, self.part_begin, self.part_end)
+        )
+
+    def _transform(self, mul: int, add: int, resolution: int):
+        """Returns a new batch with all ticks `t` mapped to `t * mul + add` at
+        the given resolution"""
+        if self._max_ticks() * abs(mul) + abs(add) > _MAX_TICKS:
+            raise OverflowError("Event times can not be represented as int64 ticks")
+        return EventBatch(
+            resolution,
+            self.whole_begin * mul + add,
+            self.whole_end * mul + add,
+            self.part_begin * mul + add,
+            self.part_end * mul + add,
+            self.has_whole,
+            self.values,
+        ).normalized()
+
+    def with_resolution(self, resolution: int):
+        """Returns the same batch at a (multiple of the current) resolution"""
+        if resolution == self.resolution:
+            return self
+        if resolution % self.resolution:
+            raise ValueError(
+                f"{resolution} is not a multiple of the resolution {self.resolution}"
+            )
+        mul = resolution // self.resolution
+        if self._max_ticks() * mul > _MAX_TICKS:
+            raise OverflowError("Event times can not be represented as int64 ticks")
+        return EventBatch(
+            resolution,
+            self.whole_begin * mul,
+            self.whole_end * mul,
+            self.part_begin * mul,
+            self.part_end * mul,
+            self.has_whole,
+            self.values,
+        )
+
+    def normalized(self):
+        """Returns the same batch at the lowest possible resolution"""
+        if not len(self):
+            return EventBatch.empty()
+        g = math.gcd(
+            self.resolution,
+            *(
+                int(np.gcd.reduce(a))
+                for a in (
+                    self.whole_begin,
+                    self.whole_end,
+                    self.part_begin,
+                    self.part_end,
+                )
+            ),
+        )
+        if g == 1:
+            return self
+        return EventBatch(
+            self.resolution // g,
+            self.whole_begin // g,
+            self.whole_end // g,
+            self.part_begin // g,
+            self.part_end // g,
+            self.has_whole,
+            self.values,
+        )
+
+    def filter(self, mask):
+        """Returns a batch with the events selected by a boolean mask"""
+        return EventBatch(
+            self.resolution,
+            self.whole_begin[mask],
+            self.whole_end[mask],
+            self.part_begin[mask],
+            self.part_end[mask],
+            self.has_whole[mask],
+            self.values[mask],
+        )
+
+    def fast(self, factor):
+        """Speeds up event times by the given factor"""
+        factor = Fraction(factor)
+        if factor <= 0:
+            raise ValueError("fast factor must be positive")
+        # t / (p / q) == (t * q) / p
+        return self._transform(
+            factor.denominator, 0, self.resolution * factor.numerator
+        )
+
+    def slow(self, factor):
+        """Slows down event times by the given factor"""
+        return self.fast(1 / Fraction(factor))
+
+    def early(self, offset):
+        """Shifts event times earlier by the given offset"""
+        offset = Fraction(offset)
+        # t - (p / q) == (t * q - p * resolution) / (resolution * q)
+        return self._transform(
+            offset.denominator,
+            -offset.numerator * self.resolution,
+            self.resolution * offset.denominator,
+        )
+
+    def late(self, offset):
+        """Shifts event times later by the given offset"""
+        return self.early(-Fraction(offset))
+
+    def onsets_only(self):
+        """Returns only the events that include their onset"""
+        return self.filter(self.has_whole & (self.whole_begin == self.part_begin))
+
+    def fmap(self, func):
+        """
+        Returns a batch with the function applied to the values. If the values
+        are numeric and the function is vectorized (see `vectorized`), it is
+        applied to the whole values array at once, otherwise it is called once
+        per value.
+
+        """
+        if self.values.dtype != object and is_vectorized(func):
+            values = np.asarray(func(self.values))
+        else:
+            values = values_array([func(v) for v in self.values.tolist()])
+        return EventBatch(
+            self.resolution,
+            self.whole_begin,
+            self.whole_end,
+            self.part_begin,
+            self.part_end,
+            self.has_whole,
+            values,
+        )
+
+    def to_events(self) -> list:
+        """Converts the batch to a list of `Event` objects"""
+        from .pattern import _event, _timespan
+
+        resolution = self.resolution
+
+        def time(ticks):
+            return to_time(Fraction(ticks, resolution))
+
+        return [
+            _event(
+                _timespan(time(wb), time(we)) if has_whole else None,
+                _timespan(time(pb), time(pe)),
+                value,
+            )
+            for wb, we, pb, pe, has_whole, value in zip(
+                self.whole_begin.tolist(),
+                self.whole_end.tolist(),
+                self.part_begin.tolist(),
+                self.part_end.tolist(),
+                self.has_whole.tolist(),
+                self.values.tolist(),
+            )
+        ]
+
+
+def xorwise(x):
+    """Vectorized `vortex.pattern.xorwise`, for an array of integers"""
+    a = (x << 13) ^ x
+    b = (a >> 17) ^ a
+    return (b << 5) ^ b
+
+
+def ticks_to_rand(ticks, resolution: int, seed: int = 0):
+    """
+    Vectorized `vortex.pattern.time_to_rand`, for an array of times given as
+    ticks at a resolution (ticks per cycle), and a seed offset.
+
+    Computes the same values as `time_to_rand`: with int64 arrays when the
+    seeds are small enough for `xorwise` not to overflow, and with Python
+    integers (object arrays) otherwise.
+
+    """
+    from .pattern import RANDOM_CONSTANT, RANDOM_CYCLES_LENGTH
+
+    _check_numpy()
+    ticks = np.asarray(ticks)
+    divisor = resolution * RANDOM_CYCLES_LENGTH
+    bound = int(np.abs(ticks).max()) if len(ticks) else 0
+    # Seeds are at most bound * RANDOM_CONSTANT / divisor (plus the seed
+    # offset, below RANDOM_CONSTANT), and xorwise needs them below 2**50 to
+    # fit in an int64
+    if ticks.dtype == object or bound >= min(2**34, divisor << 20):
+        ticks = ticks.astype(object)
+    else:
+        ticks = ticks.astype(np.int64)
+    # Seeds are time / RANDOM_CYCLES_LENGTH * RANDOM_CONSTANT, truncated
+    scaled = ticks * RANDOM_CONSTANT
+    seeds = scaled // divisor
+    seeds += (scaled < 0) & (scaled % divisor != 0)
+    seeds += seed
+    values = xorwise(seeds) % RANDOM_CONSTANT
+    if seed:
+        values = xorwise(values + seed) % RANDOM_CONSTANT
+    return values.astype(np.float64) / RANDOM_CONSTANT
+
+
+def times_to_rand(times: list, seed: int = 0):
+    """Vectorized `vortex.pattern.time_to_rand`, for a list of rational times
+    and a seed offset"""
+    _check_numpy()
+    resolution = reduce(_lcm, {t.denominator for t in times}, 1)
+    ticks = [t.numerator * (resolution // t.denominator) for t in times]
+    if max(map(abs, ticks), default=0) > _MAX_TICKS:
+        ticks = np.array(ticks, dtype=object)
+    return ticks_to_rand(ticks, resolution, seed)
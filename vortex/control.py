@@ -1,5 +1,6 @@
 import sys
 
+from .controlmap import control_map_maker
 from .pattern import *
 
 # Create functions for making control patterns (patterns of dictionaries)
@@ -334,11 +335,13 @@ module_obj = sys.modules[__name__]
 
 # This had to go in its own function, for weird scoping reasons..
 def make_control(name):
+    make_value = control_map_maker(name)
+
     def ctrl(*args):
-        return sequence(*[reify(arg) for arg in args]).fmap(lambda v: {name: v})
+        return sequence(*[reify(arg) for arg in args]).fmap(make_value)
 
     def ctrl_pattern(self, *args):
-        return self >> sequence(*[reify(arg) for arg in args]).fmap(lambda v: {name: v})
+        return self >> ctrl(*args)
 
     # setattr(Pattern, name, lambda pat: Pattern(reify(pat).fmap(lambda v: {name: v}).query))
     setattr(module_obj, name, ctrl)
@@ -0,0 +1,211 @@
+"""
+Control maps
+
+The values of control patterns (see `vortex.control`) are `ControlMap`
+objects, immutable mappings of control names (e.g. "s", "n", "speed") to
+values, that can be used like dicts.
+
+A control map stores its keys in a shape, shared by all the maps that have
+the same keys in the same order, and its values in a tuple.  Shapes intern
+their keys and cache how to merge them with other shapes, so that merging
+control maps (as `>>` and `<<` do for every event) only picks values from
+the merged maps, and returns one of them when the result is the same.
+Control maps also cache the arguments of the OSC message they are sent as.
+
+"""
+
+import sys
+from collections.abc import Mapping
+from fractions import Fraction
+from operator import itemgetter
+
+from .ticks import Tick
+
+
+class _Shape:
+    """The keys of control maps, with their positions, and the plans to
+    merge them with other shapes"""
+
+    __slots__ = ("keys", "index", "merges")
+
+    def __init__(self, keys: tuple):
+        self.keys = keys
+        self.index = {key: i for i, key in enumerate(keys)}
+        self.merges = {}
+
+
+# Shapes by their keys, so that maps with the same keys share their shape
+_shapes = {}
+
+
+def _shape(keys: tuple) -> _Shape:
+    shape = _shapes.get(keys)
+    if shape is None:
+        keys = tuple(sys.intern(k) if type(k) is str else k for k in keys)
+        shape = _shapes[keys] = _Shape(keys)
+    return shape
+
+
+# Plans to merge maps, by the shapes of the merged maps
+_merge_plans = {}
+
+
+def _merge_plan(shapes: tuple):
+    """
+    Returns how to merge maps of the given shapes, like `{**a, **b, ...}`
+    does: either the position of the map that is the same as the result, or
+    the shape of the result and a function that picks its values from the
+    values of all maps (concatenated).
+
+    """
+    index = {}
+    offset = 0
+    for shape in shapes:
+        for key, i in shape.index.items():
+            # Keys keep their first position, and take their last value
+            index[key] = offset + i
+        offset += len(shape.keys)
+    keys = tuple(index)
+    positions = list(index.values())
+    offset = 0
+    for i, shape in enumerate(shapes):
+        size = len(shape.keys)
+        if keys == shape.keys and positions == list(range(offset, offset + size)):
+            plan = i
+            break
+        offset += size
+    else:
+        # Results of a single key are always one of the merged maps
+        plan = (_shape(keys), itemgetter(*positions) if positions else None)
+    _merge_plans[shapes] = plan
+    return plan
+
+
+class ControlMap(Mapping):
+    """
+    Immutable mapping of control names to values, the value of the events of
+    control patterns.  Behaves like a (read-only) dict, and compares equal to
+    dicts with the same items.
+
+    >>> s("bd").n(3).first_cycle()[0].value
+    {'s': 'bd', 'n': 3}
+
+    """
+
+    __slots__ = ("_shape", "_values", "_args")
+
+    def __init__(self, *args, **kwargs):
+        items = dict(*args, **kwargs)
+        _set_shape(self, _shape(tuple(items)))
+        _set_values(self, tuple(items.values()))
+
+    @classmethod
+    def merge(cls, maps) -> "ControlMap":
+        """
+        Merges a sequence of mappings into a control map, with the values of later mappings
+        replacing the values of earlier ones with the same keys, like
+        `{**a, **b, ...}`.
+
+        >>> ControlMap.merge([{"s": "bd", "n": 1}, {"n": 2}])
+        {'s': 'bd', 'n': 2}
+
+        """
+        shapes = []
+        values = ()
+        for m in maps:
+            if type(m) is not ControlMap:
+                m = cls(m)
+            shapes.append(m._shape)
+            values += m._values
+        shapes = tuple(shapes)
+        plan = _merge_plans.get(shapes)
+        if plan is None:
+            plan = _merge_plan(shapes)
+        if type(plan) is int:
+            m = maps[plan]
+            return m if type(m) is ControlMap else cls(m)
+        shape, pick = plan
+        return _control_map(shape, pick(values) if pick else ())
+
+    def osc_args(self) -> tuple:
+        """Returns the keys and values of the map, flattened in a tuple as
+        the arguments of an OSC message, with rational values converted to
+        floats"""
+        try:
+            return self._args
+        except AttributeError:
+            args = []
+            for key, value in zip(self._shape.keys, self._values):
+                if isinstance(value, (Fraction, Tick)):
+                    value = float(value)
+                args.append(key)
+                args.append(value)
+            args = tuple(args)
+            _set_args(self, args)
+            return args
+
+    def __getitem__(self, key):
+        return self._values[self._shape.index[key]]
+
+    def __iter__(self):
+        return iter(self._shape.keys)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, key) -> bool:
+        return key in self._shape.index
+
+    def get(self, key, default=None):
+        i = self._shape.index.get(key)
+        return default if i is None else self._values[i]
+
+    def __or__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return ControlMap.merge([self, other])
+
+    def __ror__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return ControlMap.merge([other, self])
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ControlMap) and other._shape is self._shape:
+            return self._values == other._values
+        if isinstance(other, Mapping):
+            return dict(self) == dict(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ControlMap objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("ControlMap objects are immutable")
+
+    def __reduce__(self):
+        return (ControlMap, (dict(self),))
+
+
+_set_shape = ControlMap._shape.__set__
+_set_values = ControlMap._values.__set__
+_set_args = ControlMap._args.__set__
+_object_new = object.__new__
+
+
+def _control_map(shape: _Shape, values: tuple) -> ControlMap:
+    """Fast ControlMap constructor for internal use"""
+    control_map = _object_new(ControlMap)
+    _set_shape(control_map, shape)
+    _set_values(control_map, values)
+    return control_map
+
+
+def control_map_maker(key):
+    """Returns a function that builds control maps of a single key, with the
+    value it is given (the key is interned once)"""
+    shape = _shape((key,))
+    return lambda value: _control_map(shape, (value,))
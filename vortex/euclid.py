@@ -1,7 +1,5 @@
 from typing import List
 
-from .utils import flatten
-
 
 def bjorklund(k: int, n: int, safe=True) -> List[int]:
     """Applies Bjorklund's algorithm for generating an euclidean rhythm sequence"""
@@ -20,22 +18,24 @@ def bjorklund(k: int, n: int, safe=True) -> List[int]:
     if n == 0 or k == 0:
         return []
 
-    bins = [[1] for _ in range(k)]
     if n == k:
-        return flatten(bins)
-    remainders = [[0] for _ in range(n - k)]
-
-    while len(remainders) > 1:
-        new_remainders = []
-        for i, bin in enumerate(bins):
-            if not remainders:
-                new_remainders.append(bin)
-            else:
-                bin += remainders.pop(0)
-                bins[i] = bin
-
-        if new_remainders:
-            bins = bins[: -len(new_remainders)]
-            remainders = new_remainders
-
-    return flatten(bins + remainders)
+        return [1] * k
+
+    # All the bins of the original algorithm are the same sequence, and so
+    # are all the remainders, so only their counts need to be tracked.
+    # Each round appends a remainder to as many bins as possible, and the
+    # bins left without one become the new remainders.
+    bin, bins = [1], k
+    remainder, remainders = [0], n - k
+    while remainders > 1:
+        if bins <= remainders:
+            # Rounds repeat until there are fewer remainders than bins (or
+            # at most one), so do them all at once
+            rounds = (remainders - max(bins, 2)) // bins + 1
+            bin = bin + remainder * rounds
+            remainders -= bins * rounds
+        else:
+            bin, remainder = bin + remainder, bin
+            bins, remainders = remainders, bins - remainders
+
+    return bin * bins + remainder * remainders
@@ -1,12 +1,26 @@
+import builtins
 import math
 import sys
+import zlib
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from contextvars import ContextVar
 from fractions import Fraction
-from functools import partial, reduce, total_ordering
-from itertools import accumulate
+from functools import lru_cache, partial, reduce, total_ordering
+from itertools import accumulate, chain, islice
 from pprint import pformat
-from typing import Iterable, Optional
+from typing import Iterable, Mapping, Optional
 
+from .controlmap import ControlMap
 from .euclid import bjorklund
+from .ticks import (
+    Tick,
+    get_time_backend,
+    quantize_time,
+    set_time_backend,
+    time_value,
+    to_time,
+)
 from .utils import *
 
 """Returns the start of the cycle."""
@@ -21,15 +35,23 @@ Fraction.whole_cycle = lambda self: TimeSpan(self.sam(), self.next_sam())
 """Returns the position of a time value relative to the start of its cycle."""
 Fraction.cycle_pos = lambda self: self - self.sam()
 
+"""Returns a TimeSpan representing the begin and end of the Tick value's cycle"""
+Tick.whole_cycle = lambda self: _timespan(self.sam(), self.next_sam())
+
+_object_new = object.__new__
+_object_id = builtins.id
+
 
 @total_ordering
 class TimeSpan(object):
 
     """TimeSpan is (Time, Time)"""
 
+    __slots__ = ("begin", "end")
+
     def __init__(self, begin: Fraction, end: Fraction):
-        self.begin = Fraction(begin)
-        self.end = Fraction(end)
+        _set_begin(self, to_time(begin))
+        _set_end(self, to_time(end))
 
     def span_cycles(self) -> list:
         """Splits a timespan at cycle boundaries"""
@@ -41,11 +63,11 @@ class TimeSpan(object):
         while end > begin:
             # If begin and end are in the same cycle, we're done.
             if begin.sam() == end_sam:
-                spans.append(TimeSpan(begin, self.end))
+                spans.append(_timespan(begin, end))
                 break
             # add a timespan up to the next sam
             next_begin = begin.next_sam()
-            spans.append(TimeSpan(begin, next_begin))
+            spans.append(_timespan(begin, next_begin))
 
             # continue with the next cycle
             begin = next_begin
@@ -70,7 +92,7 @@ class TimeSpan(object):
             if intersect_begin == other.end and other.begin < other.end:
                 return None
 
-        return TimeSpan(intersect_begin, intersect_end)
+        return _timespan(intersect_begin, intersect_end)
 
     def intersection_e(self, other):
         """Like 'sect', but raises an exception if the timespans don't intersect."""
@@ -96,6 +118,31 @@ class TimeSpan(object):
     def __le__(self, other) -> bool:
         return self.begin <= other.begin and self.end <= other.end
 
+    def __hash__(self) -> int:
+        return hash((self.begin, self.end))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TimeSpan objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("TimeSpan objects are immutable")
+
+    def __reduce__(self):
+        return (TimeSpan, (self.begin, self.end))
+
+
+_set_begin = TimeSpan.begin.__set__
+_set_end = TimeSpan.end.__set__
+
+
+def _timespan(begin, end) -> TimeSpan:
+    """Fast TimeSpan constructor for internal use. Unlike `TimeSpan()`,
+    `begin` and `end` are not converted, so they must already be time values."""
+    span = _object_new(TimeSpan)
+    _set_begin(span, begin)
+    _set_end(span, end)
+    return span
+
 
 @total_ordering
 class Event:
@@ -111,10 +158,12 @@ class Event:
     start and end of the 'part' timespan.
     """
 
+    __slots__ = ("whole", "part", "value")
+
     def __init__(self, whole, part, value):
-        self.whole = whole
-        self.part = part
-        self.value = value
+        _set_whole(self, whole)
+        _set_part(self, part)
+        _set_value(self, value)
 
     def whole_or_part(self):
         """Returns the 'whole' timespan if it's present, othewise the 'part'"""
@@ -126,11 +175,11 @@ class Event:
     def with_span(self, func):
         """Returns a new event with the function f applies to the event timespan."""
         whole = None if not self.whole else func(self.whole)
-        return Event(whole, func(self.part), self.value)
+        return _event(whole, func(self.part), self.value)
 
     def with_value(self, func):
         """Returns a new event with the function f applies to the event value."""
-        return Event(self.whole, self.part, func(self.value))
+        return _event(self.whole, self.part, func(self.value))
 
     def has_onset(self) -> bool:
         """Test whether the event contains the onset, i.e that
@@ -141,7 +190,11 @@ class Event:
         return f"Event({repr(self.whole)}, {repr(self.part)}, {repr(self.value)})"
 
     def __str__(self) -> str:
-        return f"({self.whole}, {self.part}, {pformat(self.value)})"
+        value = self.value
+        if isinstance(value, ControlMap):
+            # Printed like a dict, with sorted keys
+            value = dict(value)
+        return f"({self.whole}, {self.part}, {pformat(value)})"
 
     def __eq__(self, other) -> bool:
         if isinstance(other, Event):
@@ -162,43 +215,257 @@ class Event:
             and self.part <= other.part
         )
 
+    def __hash__(self) -> int:
+        return hash((self.whole, self.part, self.value))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Event objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Event objects are immutable")
+
+    def __reduce__(self):
+        return (Event, (self.whole, self.part, self.value))
+
+
+_set_whole = Event.whole.__set__
+_set_part = Event.part.__set__
+_set_value = Event.value.__set__
+
+
+def _event(whole, part, value) -> Event:
+    """Fast Event constructor for internal use"""
+    event = _object_new(Event)
+    _set_whole(event, whole)
+    _set_part(event, part)
+    _set_value(event, value)
+    return event
+
+
+def _lcm_periods(*periods) -> Optional[Fraction]:
+    """Returns the least common multiple of rational periods, or None if any of
+    them is unknown"""
+    result = Fraction(1)
+    for i, period in enumerate(periods):
+        if period is None:
+            return None
+        if i == 0:
+            result = Fraction(period)
+            continue
+        period = Fraction(period)
+        numerator = result.numerator * period.numerator
+        numerator //= math.gcd(result.numerator, period.numerator)
+        result = Fraction(numerator, math.gcd(result.denominator, period.denominator))
+    return result
+
+
+# Default maximum number of query results kept by `Pattern.cached`
+_cache_size = 256
+
+
+def set_cache_size(maxsize: int):
+    """Sets the default maximum number of query results kept by
+    `Pattern.cached`, for patterns cached from now on"""
+    global _cache_size
+    if maxsize < 0:
+        raise ValueError("maxsize should be a non-negative integer")
+    _cache_size = maxsize
+
+
+def get_cache_size() -> int:
+    """Returns the default maximum number of query results kept by
+    `Pattern.cached`"""
+    return _cache_size
+
 
 class Pattern:
     """
     Pattern class, representing discrete and continuous events as a
     function of time.
+
+    A pattern is built from a node (see `Node`), which describes how it is
+    computed and answers its queries.  A pattern can also be built from a
+    query function, that takes a `TimeSpan` and returns a list of events.
     """
 
     def __init__(self, query):
-        self.query = query
+        # Patterns can be built from a query function, or from a node
+        node = query if isinstance(query, Node) else Query(query)
+        self.node = node
+        self.query = node.query
+
+    def query_batch(self, span):
+        """
+        Queries the pattern like `query`, but returns an `EventBatch`, a
+        columnar representation of the events backed by NumPy arrays.
+
+        Core combinators (pure, stack, slowcat/fastcat, fast/slow, early/late,
+        onsets_only, fmap) transform whole batches at once, other patterns
+        fall back to converting the events returned by `query`.
+
+        """
+        return self.node.query_batch(span)
+
+    def query_many(self, spans) -> list:
+        """
+        Queries the pattern for each of the given spans, returning a list with
+        the list of events of each span.
+
+        The result is the same as querying each span separately, but core
+        combinators (stack, slowcat/fastcat, timecat, time transformations
+        and the applicative combinators) traverse the pattern once for the
+        whole batch of spans.
+
+        """
+        return self.node.query_many(spans)
+
+    def iter_query(self, span):
+        """
+        Queries the pattern like `query`, but returns an iterator over the
+        events instead of a list.
+
+        Core combinators stream events through generators without building
+        intermediate lists, so consumers can stop early (e.g. after finding
+        the first event) and memory use stays flat on large stacks.
+
+        """
+        return self.node.iter_query(span)
+
+    def iter_onsets(self, span):
+        """
+        Returns an iterator over the events of the span that include their
+        onset, i.e. the same events as `onsets_only().iter_query(span)`.
+
+        Core combinators (pure, stack, slowcat/fastcat, timecat, time
+        transformations, fmap and the structure of `app_left` and control
+        merges) only ask their patterns for events with onsets, so the
+        fragments of events that began before the span are not built.
+
+        """
+        return self.node.iter_onsets(span)
+
+    def period(self) -> Optional[Fraction]:
+        """
+        Returns the period of the pattern in cycles, i.e. the length of time
+        after which it repeats itself exactly, or None if it is unknown or the
+        pattern does not repeat (e.g. patterns using randomness).
+
+        The period is derived from the patterns a pattern is made of, for
+        `pure`, `stack`, `slowcat`/`fastcat`, `timecat`, `polymeter`, `euclid`,
+        the time transformations and the applicative combinators.
+
+        >>> fastcat("bd", slowcat("sn", "cp", "hh")).period()
+        Fraction(3, 1)
+
+        """
+        return self.node.period()
+
+    def cycles(self, start: int, stop: int) -> list:
+        """
+        Queries whole cycles from `start` up to (but not including) `stop`,
+        returning a list with the list of events of each cycle.
+
+        >>> s("bd sn").cycles(0, 1000)
+
+        """
+        return self.query_many([TimeSpan(c, c + 1) for c in range(start, stop)])
+
+    def cached(self, maxsize: Optional[int] = None):
+        """
+        Returns the same pattern, but memoizing the results of the last
+        `maxsize` queries (by default, the global size set with
+        `set_cache_size`), evicting the least recently used ones.
+
+        Results are cached by query span, so patterns that are queried
+        repeatedly on the same spans (e.g. by a stream and a visualization,
+        or the inner pattern of `>>`) are only evaluated once.  Queries are
+        only answered from the cache for exactly the same span, which keeps
+        continuous patterns correct.  Patterns should not be cached if they
+        are non-deterministic (e.g. they depend on external state).
+
+        Hit and miss counters are available through `cache_info()`, and the
+        cache can be emptied with `cache_clear()`:
+
+        >>> pat = (s("bd*2 sn") >> n("0 1")).cached(maxsize=64)
+        >>> pat.first_cycle()
+        >>> pat.cache_info()
+        CacheInfo(hits=0, misses=1, maxsize=64, currsize=1)
+
+        """
+        if maxsize is None:
+            maxsize = _cache_size
+        if maxsize < 0:
+            raise ValueError("maxsize should be a non-negative integer")
+
+        pat = Pattern(Cached(self, maxsize))
+        pat.cache_info = pat.node.cache_info
+        pat.cache_clear = pat.node.cache_clear
+        return pat
+
+    def periodic(self, period=None):
+        """
+        Returns the same pattern, but answering queries from a precomputed
+        table of the events of a single period, shifted to the queried cycles,
+        instead of evaluating the pattern again.
+
+        If `period` is not given, it is detected with `period()`.  Patterns
+        without a known period (e.g. random or continuous patterns) are
+        returned unchanged.  Periods are sliced at the onset of an event, so
+        that events are not split at the boundaries of the slices, and events
+        are returned in the order of the pattern within each slice.  Patterns
+        that can not be sliced this way (e.g. with events longer than the
+        period) are queried as usual.
+
+        >>> s(mini("bd*2 <sn cp> [~ hh]")).periodic()
+        >>> s(mini("bd*2 [sn cp]?")).periodic(period=4)
+
+        """
+        if period is None:
+            period = self.period()
+            if period is None:
+                return self
+        period = Fraction(period)
+        if period <= 0:
+            raise ValueError("period should be positive")
+
+        return Pattern(Periodic(self, period))
+
+    def optimize(self):
+        """
+        Returns an equivalent pattern that is cheaper to query, returning
+        the same events in the same order.
+
+        Chains of time transformations (`fast`, `slow`, `early`, `late`,
+        including the `*` and `/` modifiers of mini-notation) are fused into a
+        single transformation, that maps the query once and the events once,
+        so that the cost of a query no longer grows with the length of the
+        chain.
+
+        >>> pure("bd")._fast(2)._slow(3)._early(0.25).optimize().node
+        Affine(Pure('bd'), Fraction(2, 3), Fraction(1, 6))
+
+        """
+        return Pattern(_optimize(self.node, {}))
 
     def split_queries(self):
         """Splits queries at cycle boundaries. This makes some calculations
         easier to express, as all events are then constrained to happen within
         a cycle."""
-
-        def query(span) -> list:
-            return flatten([self.query(subspan) for subspan in span.span_cycles()])
-
-        return Pattern(query)
+        return Pattern(SplitQueries(self))
 
     def with_query_span(self, func):
         """Returns a new pattern, with the function applied to the timespan of the query."""
-        return Pattern(lambda span: self.query(func(span)))
+        return Pattern(WithQuerySpan(self, func))
 
     def with_query_time(self, func):
         """Returns a new pattern, with the function applied to both the begin
         and end of the the query timespan."""
-        return Pattern(lambda span: self.query(span.with_time(func)))
+        return Pattern(WithQueryTime(self, func))
 
     def with_event_span(self, func):
         """Returns a new pattern, with the function applied to each event
         timespan."""
-
-        def query(span):
-            return [event.with_span(func) for event in self.query(span)]
-
-        return Pattern(query)
+        return Pattern(WithEventSpan(self, func))
 
     def with_event_time(self, func):
         """Returns a new pattern, with the function applied to both the begin
@@ -211,31 +478,30 @@ class Pattern:
         each event. It has the alias 'fmap'.
 
         """
-
-        def query(span):
-            return [event.with_value(func) for event in self.query(span)]
-
-        return Pattern(query)
+        return Pattern(Fmap(self, func))
 
     # alias
     fmap = with_value
 
     def _filter_events(self, event_test):
-        return Pattern(lambda span: list(filter(event_test, self.query(span))))
+        return Pattern(FilterEvents(self, event_test))
 
     def _filter_values(self, value_test):
-        return Pattern(
-            lambda span: list(
-                filter(lambda event: value_test(event.value), self.query(span))
-            )
-        )
+        return self._filter_events(lambda event: value_test(event.value))
 
     def onsets_only(self):
         """Returns a new pattern that will only return events where the start
         of the 'whole' timespan matches the start of the 'part'
         timespan, i.e. the events that include their 'onset'.
+
+        The pattern is built once, and returned again by later calls (e.g.
+        by streams, on every tick).
         """
-        return self._filter_events(Event.has_onset)
+        try:
+            return self._onsets
+        except AttributeError:
+            self._onsets = Pattern(OnsetsOnly(self))
+            return self._onsets
 
     # applyPatToPatLeft :: Pattern (a -> b) -> Pattern a -> Pattern b
     # applyPatToPatLeft pf px = Pattern q
@@ -252,77 +518,18 @@ class Pattern:
         resolve wholes, applies a given pattern of values to that
         pattern of functions.
         """
-
-        def query(span):
-            event_funcs = self.query(span)
-            event_vals = pat_val.query(span)
-
-            def apply(event_func, event_val):
-                s = event_func.part.intersection(event_val.part)
-                if s == None:
-                    return None
-                return Event(
-                    whole_func(event_func.whole, event_val.whole),
-                    s,
-                    event_func.value(event_val.value),
-                )
-
-            return flatten(
-                [
-                    remove_nones(
-                        [apply(event_func, event_val) for event_val in event_vals]
-                    )
-                    for event_func in event_funcs
-                ]
-            )
-
-        return Pattern(query)
+        return Pattern(AppWhole(self, pat_val, whole_func))
 
     # A bit more complicated than this..
     def app_both(self, pat_val):
         """Tidal's <*>"""
-
-        def whole_func(span_a, span_b):
-            if span_a == None or span_b == None:
-                return None
-            return span_a.intersection_e(span_b)
-
-        return self._app_whole(whole_func, pat_val)
+        return self._app_whole(_whole_intersection, pat_val)
 
     def app_left(self, pat_val):
-        pat_func = self
-
-        def query(span):
-            events = []
-            for event_func in pat_func.query(span):
-                event_vals = pat_val.query(event_func.whole_or_part())
-
-                for event_val in event_vals:
-                    new_whole = event_func.whole
-                    new_part = event_func.part.intersection(event_val.part)
-                    if new_part:
-                        new_value = event_func.value(event_val.value)
-                        events.append(Event(new_whole, new_part, new_value))
-            return events
-
-        return Pattern(query)
+        return Pattern(AppLeft(self, pat_val))
 
     def app_right(self, pat_val):
-        pat_func = self
-
-        def query(span):
-            events = []
-            for event_val in pat_val.query(span):
-                event_funcs = pat_func.query(event_val.whole_or_part())
-                for event_func in event_funcs:
-                    new_whole = event_val.whole
-                    new_part = event_func.part.intersection(event_val.part)
-                    if new_part:
-                        new_value = event_func.value(event_val.value)
-                        events.append(Event(new_whole, new_part, new_value))
-            return events
-
-        return Pattern(query)
+        return Pattern(AppRight(self, pat_val))
 
     def __add__(self, other):
         return self.fmap(lambda x: lambda y: x + y).app_left(reify(other))
@@ -382,11 +589,7 @@ class Pattern:
               ((0, 1), (½, 1), {'n': 1, 's': 'c'})] ...~
 
         """
-        return reduce(
-            lambda a, b: a.fmap(lambda x: lambda y: {**x, **y}).app_left(b),
-            others,
-            self,
-        )
+        return self._combine(others, right=True)
 
     union = combine_right
 
@@ -406,11 +609,17 @@ class Pattern:
               ((0, 1), (½, 1), {'n': 1, 's': 'a'})] ...~
 
         """
-        return reduce(
-            lambda a, b: a.fmap(lambda x: lambda y: {**y, **x}).app_left(b),
-            others,
-            self,
-        )
+        return self._combine(others, right=False)
+
+    def _combine(self, others, right):
+        if not others:
+            return self
+        pats = (self, *others)
+        # Merging is associative on the left, so that chains of merges (e.g.
+        # `a >> b >> c`) are flattened into a single merge
+        if isinstance(self.node, Combine) and self.node.right == right:
+            pats = (*self.node.pats, *others)
+        return Pattern(Combine(pats, right))
 
     def __rshift__(self, other):
         """
@@ -451,26 +660,10 @@ class Pattern:
         return self.combine_left(*other)
 
     def _bind_whole(self, choose_whole, func):
-        pat_val = self
-
-        def query(span):
-            def withWhole(a, b):
-                return Event(choose_whole(a.whole, b.whole), b.part, b.value)
-
-            def match(a):
-                return [withWhole(a, b) for b in func(a.value).query(a.part)]
-
-            return flatten([match(ev) for ev in pat_val.query(span)])
-
-        return Pattern(query)
+        return Pattern(Bind(self, func, choose_whole))
 
     def bind(self, func):
-        def whole_func(a, b):
-            if a is None or b is None:
-                return None
-            return a.intersection_e(b)
-
-        return self._bind_whole(whole_func, func)
+        return self._bind_whole(_whole_intersection, func)
 
     def join(self):
         """Flattens a pattern of patterns into a pattern, where wholes are
@@ -478,7 +671,7 @@ class Pattern:
         return self.bind(id)
 
     def inner_bind(self, func):
-        return self._bind_whole(lambda _, b: b, func)
+        return self._bind_whole(_inner_whole, func)
 
     def inner_join(self):
         """Flattens a pattern of patterns into a pattern, where wholes are
@@ -486,7 +679,7 @@ class Pattern:
         return self.inner_bind(id)
 
     def outer_bind(self, func):
-        return self._bind_whole(lambda a, _: a, func)
+        return self._bind_whole(_outer_whole, func)
 
     def outer_join(self):
         """Flattens a pattern of patterns into a pattern, where wholes are
@@ -495,31 +688,34 @@ class Pattern:
 
     def _patternify(method):
         def patterned(self, *args):
+            # Joining a constant argument just splits queries at cycle
+            # boundaries, so the method is applied directly to constants,
+            # and to patterns (or mini-notation) equivalent to `pure`
+            if len(args) == 1 and not isinstance(args[0], (Pattern, str, list, tuple)):
+                return method(self, args[0]).split_queries()
             pat_arg = sequence(*args)
-            return pat_arg.fmap(lambda arg: method(self, arg)).inner_join()
+            pure_node = _pure_node(pat_arg.node)
+            if pure_node is not None:
+                return method(self, pure_node.value).split_queries()
+            return pat_arg.fmap(partial(method, self)).inner_join()
 
         return patterned
 
     def _fast(self, factor):
         """Speeds up a pattern by the given factor"""
-        fastQuery = self.with_query_time(lambda t: t * factor)
-        fastEvents = fastQuery.with_event_time(lambda t: t / factor)
-        return fastEvents
+        return Pattern(Fast(self, Fraction(factor)))
 
     fast = _patternify(_fast)
 
     def _slow(self, factor):
         """Slow slows down a pattern"""
-        return self._fast(1 / factor)
+        return self._fast(1 / Fraction(factor))
 
     slow = _patternify(_slow)
 
     def _early(self, offset):
         """Equivalent of Tidal's <~ operator"""
-        offset = Fraction(offset)
-        return self.with_query_time(lambda t: t + offset).with_event_time(
-            lambda t: t - offset
-        )
+        return Pattern(Early(self, to_time(offset)))
 
     early = _patternify(_early)
 
@@ -551,13 +747,7 @@ class Pattern:
         (or not) transformation on each cycle.
 
         """
-
-        def query(span):
-            if test_func(math.floor(span.begin)):
-                return func(self).query(span)
-            return self.query(span)
-
-        return Pattern(query).split_queries()
+        return Pattern(WhenCycle(self, test_func, func))
 
     def off(self, time_pat, func):
         return stack(self, func(self.early(time_pat)))
@@ -570,40 +760,13 @@ class Pattern:
         return fastcat(self, other)
 
     def rev(self):
-        def query(span):
-            cycle = span.begin.sam()
-            next_cycle = span.begin.next_sam()
-
-            def reflect(to_reflect):
-                reflected = to_reflect.with_time(
-                    lambda time: cycle + (next_cycle - time)
-                )
-                (reflected.begin, reflected.end) = (reflected.end, reflected.begin)
-                return reflected
-
-            events = self.query(reflect(span))
-            return [event.with_span(reflect) for event in events]
-
-        return Pattern(query).split_queries()
+        return Pattern(Rev(self))
 
     def jux(self, func, by=1):
         by = by / 2
 
-        def elem_or(dict, key, default):
-            if key in dict:
-                return dict[key]
-            return default
-
-        left = self.with_value(
-            lambda val: dict(
-                list(val.items()) + [("pan", elem_or(val, "pan", 0.5) - by)]
-            )
-        )
-        right = self.with_value(
-            lambda val: dict(
-                list(val.items()) + [("pan", elem_or(val, "pan", 0.5) + by)]
-            )
-        )
+        left = self.with_value(lambda val: val | {"pan": val.get("pan", 0.5) - by})
+        right = self.with_value(lambda val: val | {"pan": val.get("pan", 0.5) + by})
 
         return stack(left, func(right))
 
@@ -667,7 +830,7 @@ class Pattern:
         end = Fraction(end)
         if begin > end or end > 1 or begin > 1 or begin < 0 or end < 0:
             return silence()
-        return self.fastgap(Fraction(1, end - begin)).late(begin)
+        return self.fastgap(Fraction(1, end - begin))._late(begin)
 
     def fastgap(self, factor):
         """
@@ -681,24 +844,7 @@ class Pattern:
         """
         if factor <= 0:
             return silence()
-
-        factor_ = max(1, factor)
-
-        def munge_query(t):
-            return t.sam() + min(1, factor_ * t.cycle_pos())
-
-        def event_span_func(span):
-            begin = span.begin.sam() + Fraction(span.begin - span.begin.sam(), factor_)
-            end = span.begin.sam() + Fraction(span.end - span.begin.sam(), factor_)
-            return TimeSpan(begin, end)
-
-        def query(span):
-            new_span = TimeSpan(munge_query(span.begin), munge_query(span.end))
-            if new_span.begin == span.begin.next_sam():
-                return []
-            return [e.with_span(event_span_func) for e in self.query(new_span)]
-
-        return Pattern(query).split_queries()
+        return Pattern(FastGap(self, max(1, factor)))
 
     def striate(self, n_pat):
         """
@@ -714,7 +860,9 @@ class Pattern:
     def _striate(self, n):
         def merge_sample(samp_range):
             return self.fmap(
-                lambda v: {"s": v["s"] if isinstance(v, dict) else v, **samp_range}
+                lambda v: ControlMap(
+                    s=v["s"] if isinstance(v, Mapping) else v, **samp_range
+                )
             )
 
         samp_ranges = [dict(begin=i / n, end=(i + 1) / n) for i in range(n)]
@@ -724,12 +872,14 @@ class Pattern:
         """
         Samples the pattern at a rate of `n` events per cycle.
 
-        Useful for turning a continuous pattern into a discrete one.
+        Useful for turning a continuous pattern into a discrete one.  The
+        pattern is queried for all the segments of a query at once, so
+        signals sample all their values in a single call.
 
         >>> rand().segment(4)
 
         """
-        return pure(id).fast(n).app_left(self)
+        return Pattern(Segment(pure(id).fast(n), self))
 
     def range(self, min, max):
         """
@@ -758,19 +908,20 @@ class Pattern:
         """
         return self.degrade_by(0.5)
 
-    def degrade_by(self, by, prand=None):
+    def degrade_by(self, by, prand=None, seed=None):
         """
         Randomly removes events from pattern.
 
         You can control the percentage of events that are removed with `by`.
         With `prand` you can specify a different random pattern, must be a
-        numerical 0-1 ranged pattern.
+        numerical 0-1 ranged pattern, or with `seed` a different random
+        sequence (see `rand`).
 
         """
         if by == 0:
             return self
         if not prand:
-            prand = rand()
+            return Pattern(DegradeBy(self, by, False, _seed(seed)))
         return self.fmap(lambda a: lambda _: a).app_left(
             prand._filter_values(lambda v: v > by)
         )
@@ -783,18 +934,19 @@ class Pattern:
         """
         return self.undegrade_by(0.5)
 
-    def undegrade_by(self, by, prand=None):
+    def undegrade_by(self, by, prand=None, seed=None):
         """
         Same as `degrade`, but random values represent percentage of events to
         keep, not remove.
 
         You can control the percentage of events that are removed with `by`.
         With `prand` you can specify a different random pattern, must be a
-        numerical 0-1 ranged pattern.
+        numerical 0-1 ranged pattern, or with `seed` a different random
+        sequence (see `rand`).
 
         """
         if not prand:
-            prand = rand()
+            return Pattern(DegradeBy(self, by, True, _seed(seed)))
         return self.fmap(lambda a: lambda _: a).app_left(
             prand._filter_values(lambda v: v <= by)
         )
@@ -901,7 +1053,13 @@ class Pattern:
         >>> s("sd").euclid(5, 8, fastcat(0, 2, 4))
 
         """
-        return self.struct(_tparams(_euclid, k, n, rot).inner_join())
+        # Like `_patternify`, constant parameters are applied directly
+        params = [reify(p) for p in (k, n, rot)]
+        pure_nodes = [_pure_node(p.node) for p in params]
+        if all(node is not None for node in pure_nodes):
+            values = [node.value for node in pure_nodes]
+            return self.struct(_euclid(*values).split_queries())
+        return self.struct(_tparams(_euclid, *params).inner_join())
 
     def __repr__(self):
         events = [str(e) for e in self.first_cycle()]
@@ -913,192 +1071,1755 @@ class Pattern:
             "Patterns cannot be compared. Evaluate them with `.first_cycle()` or similar"
         )
 
+    def __reduce__(self):
+        return (Pattern, (self.node,))
+
+
+# Pattern nodes
+#
+# Patterns are built from a tree of nodes: each pattern holds a node
+# (`Pattern.node`) that names the operation the pattern was built with, and
+# holds its parameters and the patterns it is made of.  Queries are answered
+# by the nodes, so the query protocol (`query`, `iter_query`, `iter_onsets`,
+# `query_many`, `query_batch`, `period`) of each kind of pattern is
+# implemented in its node class.
+
+
+def _freeze(value):
+    """Returns a hashable version of a node parameter"""
+    if isinstance(value, Pattern):
+        return value.node
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, partial):
+        return (partial, value.func, _freeze(value.args), _freeze(value.keywords))
+    return value
+
+
+def _param_repr(value) -> str:
+    if isinstance(value, Pattern):
+        return repr(value.node)
+    if isinstance(value, (list, tuple)):
+        return f"[{', '.join(_param_repr(v) for v in value)}]"
+    if isinstance(value, partial):
+        args = ", ".join(_param_repr(v) for v in (value.func, *value.args))
+        return f"partial({args})"
+    if callable(value) and hasattr(value, "__qualname__"):
+        return value.__qualname__
+    return repr(value)
+
+
+class Node:
+    """
+    Base class of pattern nodes.
 
-def pure(value):
-    """Returns a pattern that repeats the given value once per cycle"""
-
-    def query(span):
-        return [
-            Event(Fraction(subspan.begin).whole_cycle(), subspan, value)
-            for subspan in span.span_cycles()
-        ]
+    Subclasses list their parameters in `_fields`, and implement at least
+    one of `query` or `iter_query`.  Nodes are immutable, and are compared
+    and hashed structurally: two nodes are equal if they are of the same
+    kind and their parameters are equal, where patterns are compared by
+    their nodes and functions by identity.
 
-    return Pattern(query)
+    """
 
+    __slots__ = _fields = ()
 
-def steady(value):
-    def query(span):
-        return [Event(None, span, value)]
+    def __init__(self, *params):
+        for name, param in zip(self._fields, params):
+            object.__setattr__(self, name, param)
 
-    return Pattern(query)
+    def params(self) -> tuple:
+        """Returns the parameters of the node"""
+        return tuple(getattr(self, name) for name in self._fields)
 
+    def children(self) -> list:
+        """Returns the patterns this node is made of"""
+        children = []
+        for param in self.params():
+            if isinstance(param, Pattern):
+                children.append(param)
+            elif isinstance(param, (list, tuple)):
+                children.extend(p for p in param if isinstance(p, Pattern))
+        return children
 
-def slowcat(*pats):
-    """
-    Concatenation: combines a list of patterns, switching between them
-    successively, one per cycle.
-    (currently behaves slightly differently from Tidal)
-    """
-    pats = [reify(pat) for pat in pats]
+    def query(self, span) -> list:
+        return list(self.iter_query(span))
 
-    def query(span):
-        pat = pats[math.floor(span.begin) % len(pats)]
-        return pat.query(span)
+    def iter_query(self, span):
+        return iter(self.query(span))
 
-    return Pattern(query).split_queries()
+    def iter_onsets(self, span):
+        return filter(Event.has_onset, self.iter_query(span))
 
+    def query_many(self, spans) -> list:
+        return [self.query(span) for span in spans]
 
-def fastcat(*pats):
-    """Concatenation: as with slowcat, but squashes a cycle from each
-    pattern into one cycle"""
-    return slowcat(*pats)._fast(len(pats))
+    def query_batch(self, span):
+        from .batch import EventBatch
 
+        return EventBatch.from_events(self.query(span))
 
-# alias
-cat = fastcat
+    def period(self) -> Optional[Fraction]:
+        return None
 
+    def __setattr__(self, name, value):
+        raise AttributeError("Node objects are immutable")
 
-def stack(*pats):
-    """Pile up patterns"""
-    pats = [reify(pat) for pat in pats]
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and _freeze(self.params()) == _freeze(
+            other.params()
+        )
 
-    def query(span):
-        return flatten([pat.query(span) for pat in pats])
+    def __hash__(self) -> int:
+        try:
+            return hash((type(self), _freeze(self.params())))
+        except TypeError:
+            # Some parameter (e.g. a value) is not hashable
+            return hash(type(self))
 
-    return Pattern(query)
+    def __reduce__(self):
+        return (type(self), self.params())
 
+    def __repr__(self) -> str:
+        params = ", ".join(_param_repr(p) for p in self.params())
+        return f"{type(self).__name__}({params})"
 
-def _sequence_count(x):
-    from .mini import mini
 
-    if type(x) == list or type(x) == tuple:
-        if len(x) == 1:
-            return _sequence_count(x[0])
-        else:
-            return (fastcat(*[sequence(x) for x in x]), len(x))
-    if isinstance(x, Pattern):
-        return (x, 1)
-    if isinstance(x, str):
-        return (mini(x), 1)
-    return (pure(x), 1)
+class Query(Node):
+    """A pattern defined by an arbitrary query function"""
 
+    __slots__ = _fields = ("func",)
 
-def sequence(*args):
-    return _sequence_count(args)[0]
+    def query(self, span):
+        return self.func(span)
 
 
-def polymeter(*args, steps=None):
-    seqs = [_sequence_count(x) for x in args]
-    if len(seqs) == 0:
-        return silence()
-    if not steps:
-        steps = seqs[0][1]
-    pats = []
-    for seq in seqs:
-        if seq[1] == 0:
-            next
-        if steps == seq[1]:
-            pats.append(seq[0])
-        else:
-            pats.append(seq[0]._fast(Fraction(steps) / Fraction(seq[1])))
-    return stack(*pats)
+class Pure(Node):
+    """Repeats a value once per cycle"""
 
+    __slots__ = _fields = ("value",)
 
-# alias
-pm = polymeter
+    def query(self, span):
+        value = self.value
+        return [
+            _event(subspan.begin.whole_cycle(), subspan, value)
+            for subspan in span.span_cycles()
+        ]
 
+    def iter_query(self, span):
+        value = self.value
+        return (
+            _event(subspan.begin.whole_cycle(), subspan, value)
+            for subspan in span.span_cycles()
+        )
 
-def polyrhythm(*xs):
-    seqs = [sequence(x) for x in xs]
+    def iter_onsets(self, span):
+        value = self.value
+        return (
+            _event(subspan.begin.whole_cycle(), subspan, value)
+            for subspan in span.span_cycles()
+            if subspan.begin == subspan.begin.sam()
+        )
 
-    if len(seqs) == 0:
-        return silence()
+    def query_batch(self, span):
+        from .batch import EventBatch
 
-    return stack(*seqs)
+        return EventBatch.pure(span, self.value)
 
+    def period(self):
+        return Fraction(1)
 
-# alias
-pr = polyrhythm
 
+class Steady(Node):
+    """A continuous, constant value"""
 
-def reify(x) -> Pattern:
-    from .mini import mini
+    __slots__ = _fields = ("value",)
 
-    if not isinstance(x, Pattern):
-        if isinstance(x, str):
-            return mini(x)
-        return pure(x)
-    return x
+    def query(self, span):
+        return [_event(None, span, self.value)]
 
+    def iter_onsets(self, span):
+        return iter(())
 
-def _tparams(func, *params):
-    if not params:
-        return silence()
-    curried_func = curry(func)
-    return reduce(
-        lambda a, b: a.app_both(reify(b)),
-        params[1:],
-        reify(params[0]).fmap(curried_func),
-    )
 
+class Silence(Node):
+    """No events"""
 
-# Randomness
-RANDOM_CONSTANT = 2**29
-RANDOM_CYCLES_LENGTH = 300
+    __slots__ = _fields = ()
 
+    def query(self, span):
+        return []
 
-def xorwise(x: int) -> int:
-    """
-    Xorshift RNG
+    def period(self):
+        return Fraction(1)
 
-    cf. George Marsaglia (2003). "Xorshift RNGs". Journal of Statistical Software 8:14.
-    https://www.jstatsoft.org/article/view/v008i14
 
-    """
-    a = (x << 13) ^ x
-    b = (a >> 17) ^ a
-    return (b << 5) ^ b
+class Signal(Node):
+    """A continuous value, sampled from a function of time at the midpoint of
+    the query.  `many`, if not None, samples a list of times at once (with
+    the same values as `func`), for batches of queries."""
 
+    __slots__ = _fields = ("func", "many")
 
-def time_to_int_seed(a: float) -> int:
-    """
-    Stretch RANDOM_CYCLES_LENGTH cycles over the range of [0, RANDOM_CONSTANT)
-    then apply the xorshift algorithm.
+    def query(self, span):
+        return [_event(None, span, self.func(time_value(span.midpoint())))]
 
-    """
-    return xorwise(math.trunc((a / RANDOM_CYCLES_LENGTH) * RANDOM_CONSTANT))
+    def iter_onsets(self, span):
+        return iter(())
 
+    def query_many(self, spans):
+        times = [time_value(span.midpoint()) for span in spans]
+        if self.many is None:
+            values = map(self.func, times)
+        else:
+            values = self.many(times)
+        return [[_event(None, span, value)] for span, value in zip(spans, values)]
 
-def int_seed_to_rand(a: int) -> float:
-    return (a % RANDOM_CONSTANT) / RANDOM_CONSTANT
 
+class Stack(Node):
+    """Plays patterns at the same time"""
 
-def time_to_rand(a):
-    return int_seed_to_rand(time_to_int_seed(a))
+    __slots__ = _fields = ("pats",)
 
+    def query(self, span):
+        return [event for pat in self.pats for event in pat.query(span)]
 
-# Signals
+    def iter_query(self, span):
+        return chain.from_iterable(pat.iter_query(span) for pat in self.pats)
 
+    def iter_onsets(self, span):
+        return chain.from_iterable(pat.iter_onsets(span) for pat in self.pats)
 
-def silence():
-    return Pattern(lambda _: [])
+    def query_many(self, spans):
+        results = [[] for _ in spans]
+        for pat in self.pats:
+            for events, pat_events in zip(results, pat.query_many(spans)):
+                events.extend(pat_events)
+        return results
 
+    def query_batch(self, span):
+        from .batch import EventBatch
 
-def signal(func):
-    def query(span):
-        return [Event(None, span, func(span.midpoint()))]
+        return EventBatch.concat([pat.query_batch(span) for pat in self.pats])
 
-    return Pattern(query)
+    def period(self):
+        return _lcm_periods(*[pat.period() for pat in self.pats])
 
 
-sine2 = lambda: signal(lambda t: math.sin(math.pi * 2 * t))
-sine = lambda: signal(lambda t: (math.sin(math.pi * 2 * t) + 1) / 2)
+class Slowcat(Node):
+    """Plays patterns one after the other, one per cycle"""
 
-cosine2 = lambda: sine2().early(0.25)
-cosine = lambda: sine().early(0.25)
+    __slots__ = _fields = ("pats",)
 
-saw2 = lambda: signal(lambda t: (t % 1) * 2)
-saw = lambda: signal(lambda t: t % 1)
+    def _cycle_queries(self, span):
+        """Yields the pattern to query for each cycle of a span, with the
+        part of the span within that cycle"""
+        pats = self.pats
+        begin, end = span.begin, span.end
+        if end <= begin:
+            return
+        n = len(pats)
+        index = math.floor(begin) % n
+        while True:
+            next_begin = begin.next_sam()
+            if end <= next_begin:
+                yield pats[index], _timespan(begin, end)
+                return
+            yield pats[index], _timespan(begin, next_begin)
+            begin = next_begin
+            index = (index + 1) % n
+
+    def query(self, span):
+        begin = span.begin
+        if span.end <= begin.next_sam():
+            # Spans within a cycle are the most common case
+            if span.end <= begin:
+                return []
+            return self.pats[math.floor(begin) % len(self.pats)].query(span)
+        return [
+            event
+            for pat, subspan in self._cycle_queries(span)
+            for event in pat.query(subspan)
+        ]
+
+    def iter_query(self, span):
+        return chain.from_iterable(
+            pat.iter_query(subspan) for pat, subspan in self._cycle_queries(span)
+        )
+
+    def iter_onsets(self, span):
+        return chain.from_iterable(
+            pat.iter_onsets(subspan) for pat, subspan in self._cycle_queries(span)
+        )
+
+    def query_many(self, spans):
+        # Group the cycles of all spans by pattern, to query each pattern once
+        subspans = flatten([span.span_cycles() for span in spans])
+        groups = {}
+        for i, span in enumerate(subspans):
+            groups.setdefault(math.floor(span.begin) % len(self.pats), []).append(i)
+        results = [None] * len(subspans)
+        for pat_index, indices in groups.items():
+            pat_spans = [subspans[i] for i in indices]
+            for i, events in zip(indices, self.pats[pat_index].query_many(pat_spans)):
+                results[i] = events
+        results = iter(results)
+        return [flatten(islice(results, len(span.span_cycles()))) for span in spans]
+
+    def query_batch(self, span):
+        from .batch import EventBatch
+
+        return EventBatch.concat(
+            [pat.query_batch(subspan) for pat, subspan in self._cycle_queries(span)]
+        )
+
+    def period(self):
+        return _lcm_periods(len(self.pats), *[pat.period() for pat in self.pats])
+
+
+class Timecat(Node):
+    """Plays patterns one after the other within each cycle, each one
+    compressed into its own segment of the cycle, from `begins[i]` to
+    `ends[i]`.  Equivalent to a stack of the (compressed) patterns, but only
+    the segments overlapping a query are queried."""
+
+    __slots__ = _fields = ("pats", "begins", "ends")
+
+    def _indices(self, span):
+        # Events of a segment are within [k + begin, k + end] for some cycle
+        # k, so the segments that might have events in the span are the
+        # ones that overlap it (with their bounds), found by bisection
+        n = len(self.pats)
+        if span.end - span.begin >= 1:
+            return range(n)
+        begin = span.begin.cycle_pos()
+        end = begin + (span.end - span.begin)
+        first = bisect_left(self.ends, begin)
+        if end <= 1:
+            return range(first, bisect_right(self.begins, end))
+        # The span crosses a cycle boundary
+        last = bisect_right(self.begins, end - 1)
+        if last >= first:
+            return range(n)
+        return chain(range(last), range(first, n))
+
+    def query(self, span):
+        pats = self.pats
+        return [event for i in self._indices(span) for event in pats[i].query(span)]
+
+    def iter_query(self, span):
+        pats = self.pats
+        return chain.from_iterable(
+            pats[i].iter_query(span) for i in self._indices(span)
+        )
+
+    def iter_onsets(self, span):
+        pats = self.pats
+        return chain.from_iterable(
+            pats[i].iter_onsets(span) for i in self._indices(span)
+        )
+
+    def query_many(self, spans):
+        # Query each segment once, with the spans that overlap it
+        span_indices = [[] for _ in self.pats]
+        for j, span in enumerate(spans):
+            for i in self._indices(span):
+                span_indices[i].append(j)
+        results = [[] for _ in spans]
+        for pat, indices in zip(self.pats, span_indices):
+            if indices:
+                pat_spans = [spans[j] for j in indices]
+                for j, events in zip(indices, pat.query_many(pat_spans)):
+                    results[j].extend(events)
+        return results
+
+    def query_batch(self, span):
+        from .batch import EventBatch
+
+        pats = self.pats
+        return EventBatch.concat(
+            [pats[i].query_batch(span) for i in self._indices(span)]
+        )
+
+    def period(self):
+        return _lcm_periods(*[pat.period() for pat in self.pats])
+
+
+class SplitQueries(Node):
+    """Splits queries at cycle boundaries"""
+
+    __slots__ = _fields = ("pat",)
+
+    def iter_query(self, span):
+        pat = self.pat
+        return chain.from_iterable(
+            pat.iter_query(subspan) for subspan in span.span_cycles()
+        )
+
+    def iter_onsets(self, span):
+        pat = self.pat
+        return chain.from_iterable(
+            pat.iter_onsets(subspan) for subspan in span.span_cycles()
+        )
+
+    def query_many(self, spans):
+        subspans = [span.span_cycles() for span in spans]
+        results = iter(self.pat.query_many(flatten(subspans)))
+        return [flatten(islice(results, len(s))) for s in subspans]
+
+    def period(self):
+        return _lcm_periods(self.pat.period(), 1)
+
+
+class SplitQueriesAt(Node):
+    """Splits queries at the points of one or more grids, each given as a
+    `(step, phase)` pair for the points `phase + k * step`.  Built by
+    `Pattern.optimize` from nested `SplitQueries` nodes."""
+
+    __slots__ = _fields = ("pat", "grids")
+
+    def _split(self, span):
+        begin = span.begin
+        end = span.end
+        if self.grids == ((1, 0),):
+            return span.span_cycles()
+        if end <= begin:
+            return []
+        points = set()
+        for step, phase in self.grids:
+            point = phase + (math.floor((begin - phase) / step) + 1) * step
+            while point < end:
+                points.add(point)
+                point += step
+        spans = []
+        for point in sorted(points):
+            spans.append(TimeSpan(begin, point))
+            begin = point
+        spans.append(TimeSpan(begin, end))
+        return spans
+
+    def iter_query(self, span):
+        pat = self.pat
+        return chain.from_iterable(
+            pat.iter_query(subspan) for subspan in self._split(span)
+        )
+
+    def iter_onsets(self, span):
+        pat = self.pat
+        return chain.from_iterable(
+            pat.iter_onsets(subspan) for subspan in self._split(span)
+        )
+
+    def query_many(self, spans):
+        subspans = [self._split(span) for span in spans]
+        results = iter(self.pat.query_many(flatten(subspans)))
+        return [flatten(islice(results, len(s))) for s in subspans]
+
+    def period(self):
+        return _lcm_periods(self.pat.period(), *[step for step, _ in self.grids])
+
+
+class WithQuerySpan(Node):
+    """Applies a function to the query timespan"""
+
+    __slots__ = _fields = ("pat", "func")
+
+    def query(self, span):
+        return self.pat.query(self.func(span))
+
+    def iter_query(self, span):
+        return self.pat.iter_query(self.func(span))
+
+    def query_many(self, spans):
+        func = self.func
+        return self.pat.query_many([func(span) for span in spans])
+
+
+class WithQueryTime(Node):
+    """Applies a function to the begin and end of the query timespan"""
+
+    __slots__ = _fields = ("pat", "func")
+
+    def query(self, span):
+        return self.pat.query(span.with_time(self.func))
+
+    def iter_query(self, span):
+        return self.pat.iter_query(span.with_time(self.func))
+
+    def query_many(self, spans):
+        func = self.func
+        return self.pat.query_many([span.with_time(func) for span in spans])
+
+
+class WithEventSpan(Node):
+    """Applies a function to the timespans of events"""
+
+    __slots__ = _fields = ("pat", "func")
+
+    def query(self, span):
+        func = self.func
+        return [event.with_span(func) for event in self.pat.query(span)]
+
+    def iter_query(self, span):
+        func = self.func
+        return (event.with_span(func) for event in self.pat.iter_query(span))
+
+    def query_many(self, spans):
+        func = self.func
+        return [
+            [event.with_span(func) for event in events]
+            for events in self.pat.query_many(spans)
+        ]
+
+
+class _TimeTransform(Node):
+    """Base class of nodes that transform time with a function applied to
+    the query times, and its inverse applied to the event timespans"""
+
+    __slots__ = _fields = ()
+
+    def query(self, span):
+        event_span = self._event_span
+        return [
+            event.with_span(event_span)
+            for event in self.pat.query(span.with_time(self._query_time))
+        ]
+
+    def iter_query(self, span):
+        event_span = self._event_span
+        return (
+            event.with_span(event_span)
+            for event in self.pat.iter_query(span.with_time(self._query_time))
+        )
+
+    def iter_onsets(self, span):
+        # Onsets stay onsets, as time is transformed by increasing functions
+        event_span = self._event_span
+        return (
+            event.with_span(event_span)
+            for event in self.pat.iter_onsets(span.with_time(self._query_time))
+        )
+
+    def query_many(self, spans):
+        query_time = self._query_time
+        event_span = self._event_span
+        return [
+            [event.with_span(event_span) for event in events]
+            for events in self.pat.query_many(
+                [span.with_time(query_time) for span in spans]
+            )
+        ]
+
+
+class Fast(_TimeTransform):
+    """Speeds up a pattern by a (rational) factor"""
+
+    __slots__ = _fields = ("pat", "factor")
+
+    def _query_time(self, t):
+        return t * self.factor
+
+    def _event_span(self, span):
+        factor = self.factor
+        return TimeSpan(span.begin / factor, span.end / factor)
+
+    def query_batch(self, span):
+        if self.factor <= 0:
+            # Batches can only be sped up, so other factors are queried
+            # like `query` does
+            from .batch import EventBatch
+
+            return EventBatch.from_events(self.query(span))
+        return self.pat.query_batch(span.with_time(self._query_time)).fast(self.factor)
+
+    def period(self):
+        period = self.pat.period()
+        if self.factor <= 0 or period is None:
+            return None
+        return period / self.factor
+
+
+class Fastcat(Fast):
+    """Plays patterns one after the other within each cycle: a `Fast` of a
+    `Slowcat` by the number of its patterns, that queries the patterns of
+    the `Slowcat` directly for each of their segments"""
+
+    __slots__ = _fields = ("pat", "factor")
+
+    def query(self, span):
+        event_span = self._event_span
+        return [
+            event.with_span(event_span)
+            for pat, subspan in self.pat.node._cycle_queries(
+                span.with_time(self._query_time)
+            )
+            for event in pat.query(subspan)
+        ]
+
+    def iter_query(self, span):
+        event_span = self._event_span
+        return (
+            event.with_span(event_span)
+            for pat, subspan in self.pat.node._cycle_queries(
+                span.with_time(self._query_time)
+            )
+            for event in pat.iter_query(subspan)
+        )
+
+    def iter_onsets(self, span):
+        event_span = self._event_span
+        return (
+            event.with_span(event_span)
+            for pat, subspan in self.pat.node._cycle_queries(
+                span.with_time(self._query_time)
+            )
+            for event in pat.iter_onsets(subspan)
+        )
+
+
+class Early(_TimeTransform):
+    """Shifts a pattern earlier in time by an offset"""
+
+    __slots__ = _fields = ("pat", "offset")
+
+    def _query_time(self, t):
+        return t + self.offset
+
+    def _event_span(self, span):
+        offset = self.offset
+        return TimeSpan(span.begin - offset, span.end - offset)
+
+    def query_batch(self, span):
+        return self.pat.query_batch(span.with_time(self._query_time)).early(self.offset)
+
+    def period(self):
+        return self.pat.period()
+
+
+class Affine(_TimeTransform):
+    """Speeds up a pattern by a (positive) factor and shifts it earlier in
+    time, in a single step: query times are mapped to `t * scale + offset`.
+    Built by `Pattern.optimize` from chains of `Fast` and `Early` nodes."""
+
+    __slots__ = _fields = ("pat", "scale", "offset")
+
+    def _query_time(self, t):
+        return t * self.scale + self.offset
+
+    def _event_span(self, span):
+        scale = self.scale
+        offset = self.offset
+        return TimeSpan((span.begin - offset) / scale, (span.end - offset) / scale)
+
+    def query_batch(self, span):
+        batch = self.pat.query_batch(span.with_time(self._query_time))
+        return batch.early(self.offset).fast(self.scale)
+
+    def period(self):
+        period = self.pat.period()
+        if period is None:
+            return None
+        return period / self.scale
+
+
+class Fmap(Node):
+    """Applies a function to the values of events"""
+
+    __slots__ = _fields = ("pat", "func")
+
+    def query(self, span):
+        func = self.func
+        return [event.with_value(func) for event in self.pat.query(span)]
+
+    def iter_query(self, span):
+        func = self.func
+        return (event.with_value(func) for event in self.pat.iter_query(span))
+
+    def iter_onsets(self, span):
+        func = self.func
+        return (event.with_value(func) for event in self.pat.iter_onsets(span))
+
+    def query_many(self, spans):
+        func = self.func
+        return [
+            [event.with_value(func) for event in events]
+            for events in self.pat.query_many(spans)
+        ]
+
+    def query_batch(self, span):
+        return self.pat.query_batch(span).fmap(self.func)
+
+    def period(self):
+        return self.pat.period()
+
+
+class FilterEvents(Node):
+    """Keeps the events that pass a test"""
+
+    __slots__ = _fields = ("pat", "test")
+
+    def query(self, span):
+        return list(filter(self.test, self.pat.query(span)))
+
+    def iter_query(self, span):
+        return filter(self.test, self.pat.iter_query(span))
+
+    def iter_onsets(self, span):
+        return filter(self.test, self.pat.iter_onsets(span))
+
+    def query_many(self, spans):
+        test = self.test
+        return [list(filter(test, events)) for events in self.pat.query_many(spans)]
+
+    def period(self):
+        return self.pat.period()
+
+
+class DegradeBy(Node):
+    """Removes the events whose random value, sampled at the middle of their
+    whole, is at most `amount` (or above it if `undegrade` is true).  Same as
+    applying the events to a filtered `rand()` with `app_left`, but the
+    random values of all the events of a query are sampled at once.  `seed`
+    is the offset of the random sequence, None for the current one."""
+
+    __slots__ = _fields = ("pat", "amount", "undegrade", "seed")
+
+    def _degrade(self, events):
+        spans = [event.whole_or_part() for event in events]
+        rands = _times_to_rand([span.midpoint() for span in spans], self.seed)
+        amount = self.amount
+        undegrade = self.undegrade
+        return [
+            event
+            for event, span, r in zip(events, spans, rands)
+            if (r <= amount if undegrade else r > amount)
+            # Like `app_left`, drop points at the end of their whole
+            and not (event.part.begin == event.part.end == span.end > span.begin)
+        ]
+
+    def query(self, span):
+        return self._degrade(self.pat.query(span))
+
+    def iter_onsets(self, span):
+        return iter(self._degrade(list(self.pat.iter_onsets(span))))
+
+    def query_many(self, spans):
+        return [self._degrade(events) for events in self.pat.query_many(spans)]
+
+    def query_batch(self, span):
+        from .batch import ticks_to_rand
+
+        seed = _random_seed.get() if self.seed is None else self.seed
+        batch = self.pat.query_batch(span)
+        # Midpoints of the wholes, at twice the resolution
+        rands = ticks_to_rand(
+            batch.whole_begin + batch.whole_end, 2 * batch.resolution, seed
+        )
+        amount = float(self.amount)
+        keep = rands <= amount if self.undegrade else rands > amount
+        points = batch.part_begin == batch.part_end
+        keep &= ~(
+            points
+            & (batch.part_end == batch.whole_end)
+            & (batch.whole_begin < batch.whole_end)
+        )
+        return batch.filter(keep)
+
+
+class OnsetsOnly(Node):
+    """Keeps the events that include their onset"""
+
+    __slots__ = _fields = ("pat",)
+
+    def query(self, span):
+        return list(self.pat.iter_onsets(span))
+
+    def iter_query(self, span):
+        return self.pat.iter_onsets(span)
+
+    def iter_onsets(self, span):
+        return self.pat.iter_onsets(span)
+
+    def query_many(self, spans):
+        return [
+            list(filter(Event.has_onset, events))
+            for events in self.pat.query_many(spans)
+        ]
+
+    def query_batch(self, span):
+        return self.pat.query_batch(span).onsets_only()
+
+    def period(self):
+        return self.pat.period()
+
+
+def _whole_intersection(span_a, span_b):
+    if span_a is None or span_b is None:
+        return None
+    return span_a.intersection_e(span_b)
+
+
+def _overlapping_parts(events_a, events_b) -> list:
+    """
+    Returns, for each event of `events_a`, the (sorted) indices of the events
+    of `events_b` whose parts overlap or touch its part, i.e. the events whose
+    parts may intersect with it.
+
+    Events are matched by sweeping over both lists sorted by the beginning of
+    their parts, keeping the events of `events_b` that are still active,
+    instead of comparing every pair.
+
+    """
+    matches = [[] for _ in events_a]
+    if not events_a or not events_b:
+        return matches
+    order_b = sorted(range(len(events_b)), key=lambda j: events_b[j].part.begin)
+    begins_b = [events_b[j].part.begin for j in order_b]
+    next_b = 0
+    active = []
+    for i in sorted(range(len(events_a)), key=lambda i: events_a[i].part.begin):
+        begin = events_a[i].part.begin
+        end = events_a[i].part.end
+        while next_b < len(order_b) and begins_b[next_b] <= begin:
+            active.append(order_b[next_b])
+            next_b += 1
+        active = [j for j in active if events_b[j].part.end >= begin]
+        # Active events began before this one, and the events beginning
+        # within it follow them
+        starting = order_b[next_b : bisect_right(begins_b, end, next_b)]
+        matches[i] = sorted(active + starting)
+    return matches
+
+
+class AppWhole(Node):
+    """Applies a pattern of functions to a pattern of values, with a function
+    to resolve the wholes of the resulting events"""
+
+    __slots__ = _fields = ("pat_func", "pat_val", "whole_func")
+
+    def _app(self, event_funcs, event_vals):
+        whole_func = self.whole_func
+        events = []
+        matches = _overlapping_parts(event_funcs, event_vals)
+        for event_func, indices in zip(event_funcs, matches):
+            for event_val in map(event_vals.__getitem__, indices):
+                s = event_func.part.intersection(event_val.part)
+                if s is not None:
+                    events.append(
+                        _event(
+                            whole_func(event_func.whole, event_val.whole),
+                            s,
+                            event_func.value(event_val.value),
+                        )
+                    )
+        return events
+
+    def query(self, span):
+        return self._app(self.pat_func.query(span), self.pat_val.query(span))
+
+    def query_many(self, spans):
+        return [
+            self._app(event_funcs, event_vals)
+            for event_funcs, event_vals in zip(
+                self.pat_func.query_many(spans), self.pat_val.query_many(spans)
+            )
+        ]
+
+    def period(self):
+        return _lcm_periods(self.pat_func.period(), self.pat_val.period())
+
+
+class AppLeft(Node):
+    """Applies a pattern of functions to a pattern of values, keeping the
+    structure of the functions.  Values are queried for the whole of each
+    function event, as continuous values (e.g. `saw`) are sampled for each
+    event, so they can't be matched by a sweep like in `AppWhole`."""
+
+    __slots__ = _fields = ("pat_func", "pat_val")
+
+    @staticmethod
+    def _apply(event_func, event_vals):
+        for event_val in event_vals:
+            new_whole = event_func.whole
+            new_part = event_func.part.intersection(event_val.part)
+            if new_part:
+                new_value = event_func.value(event_val.value)
+                yield _event(new_whole, new_part, new_value)
+
+    def iter_query(self, span):
+        apply = self._apply
+        pat_val = self.pat_val
+        for event_func in self.pat_func.iter_query(span):
+            yield from apply(event_func, pat_val.iter_query(event_func.whole_or_part()))
+
+    def iter_onsets(self, span):
+        # Events keep the wholes of the function events, and parts within
+        # theirs, so only function events with onsets can give onsets
+        apply = self._apply
+        pat_val = self.pat_val
+        for event_func in self.pat_func.iter_onsets(span):
+            events = apply(event_func, pat_val.iter_query(event_func.whole))
+            yield from filter(Event.has_onset, events)
+
+    def query_many(self, spans):
+        # Query values for the function events of all spans at once
+        func_events = self.pat_func.query_many(spans)
+        val_events = iter(
+            self.pat_val.query_many(
+                [ef.whole_or_part() for efs in func_events for ef in efs]
+            )
+        )
+        results = []
+        for efs in func_events:
+            events = []
+            for event_func in efs:
+                events.extend(self._apply(event_func, next(val_events)))
+            results.append(events)
+        return results
+
+    def period(self):
+        return _lcm_periods(self.pat_func.period(), self.pat_val.period())
+
+
+class Segment(AppLeft):
+    """`AppLeft` that queries the values of all the function events of a
+    query at once (see `Pattern.segment`)"""
+
+    __slots__ = _fields = ("pat_func", "pat_val")
+
+    def query(self, span):
+        return self.query_many([span])[0]
+
+    def iter_query(self, span):
+        return iter(self.query(span))
+
+
+class AppRight(Node):
+    """Applies a pattern of functions to a pattern of values, keeping the
+    structure of the values.  Functions are queried for the whole of each
+    value event, like values in `AppLeft`."""
+
+    __slots__ = _fields = ("pat_func", "pat_val")
+
+    @staticmethod
+    def _apply(event_val, event_funcs):
+        for event_func in event_funcs:
+            new_whole = event_val.whole
+            new_part = event_func.part.intersection(event_val.part)
+            if new_part:
+                new_value = event_func.value(event_val.value)
+                yield _event(new_whole, new_part, new_value)
+
+    def iter_query(self, span):
+        apply = self._apply
+        pat_func = self.pat_func
+        for event_val in self.pat_val.iter_query(span):
+            yield from apply(event_val, pat_func.iter_query(event_val.whole_or_part()))
+
+    def query_many(self, spans):
+        # Query functions for the value events of all spans at once
+        val_events = self.pat_val.query_many(spans)
+        func_events = iter(
+            self.pat_func.query_many(
+                [ev.whole_or_part() for evs in val_events for ev in evs]
+            )
+        )
+        results = []
+        for evs in val_events:
+            events = []
+            for event_val in evs:
+                events.extend(self._apply(event_val, next(func_events)))
+            results.append(events)
+        return results
+
+    def period(self):
+        return _lcm_periods(self.pat_func.period(), self.pat_val.period())
+
+
+class Combine(Node):
+    """Merges patterns of dicts (control patterns) with the structure of the
+    first one.  Values of later patterns replace the values of earlier ones
+    with the same key if `right` is true, and the other way around otherwise.
+
+    Equivalent to a chain of `app_left`, but each pattern is queried once for
+    the whole of each event of the first pattern, and merged values are built
+    in a single pass."""
+
+    __slots__ = _fields = ("pats", "right")
+
+    def _merge(self, values):
+        return ControlMap.merge(values if self.right else values[::-1])
+
+    def _combine(self, event, events=None):
+        """Merges an event of the first pattern with the events of the other
+        patterns, which can be given if they were already queried"""
+        whole = event.whole
+        fragments = [(event.part, (event.value,))]
+        for i, pat in enumerate(self.pats[1:]):
+            if whole is not None:
+                others = pat.query(whole) if events is None else events[i]
+            new_fragments = []
+            for part, values in fragments:
+                if whole is None:
+                    others = pat.query(part)
+                for other in others:
+                    new_part = part.intersection(other.part)
+                    if new_part is not None:
+                        new_fragments.append((new_part, (*values, other.value)))
+            fragments = new_fragments
+        merge = self._merge
+        return [_event(whole, part, merge(values)) for part, values in fragments]
+
+    def iter_query(self, span):
+        combine = self._combine
+        for event in self.pats[0].iter_query(span):
+            yield from combine(event)
+
+    def iter_onsets(self, span):
+        # Like `AppLeft`, only the events of the first pattern with onsets
+        # can give onsets
+        combine = self._combine
+        for event in self.pats[0].iter_onsets(span):
+            yield from filter(Event.has_onset, combine(event))
+
+    def query_many(self, spans):
+        # Query the other patterns for the events of all spans at once
+        structure = self.pats[0].query_many(spans)
+        wholes = [ev.whole for evs in structure for ev in evs if ev.whole is not None]
+        others = iter(zip(*[pat.query_many(wholes) for pat in self.pats[1:]]))
+        return [
+            flatten(
+                self._combine(ev, None if ev.whole is None else next(others))
+                for ev in evs
+            )
+            for evs in structure
+        ]
+
+    def period(self):
+        return _lcm_periods(*[pat.period() for pat in self.pats])
+
+
+def _inner_whole(_, whole):
+    return whole
+
+
+def _outer_whole(whole, _):
+    return whole
+
+
+class Bind(Node):
+    """Builds a pattern from each value of a pattern with a function, and
+    flattens the result, with a function to choose the wholes of the
+    resulting events from the outer and inner wholes"""
+
+    _fields = ("pat", "func", "choose_whole")
+    __slots__ = _fields + ("_period",)
+
+    def _with_whole(self, a, b):
+        return _event(self.choose_whole(a.whole, b.whole), b.part, b.value)
+
+    def iter_query(self, span):
+        func = self.func
+        with_whole = self._with_whole
+        for a in self.pat.iter_query(span):
+            for b in func(a.value).iter_query(a.part):
+                yield with_whole(a, b)
+
+    def query_many(self, spans):
+        outer_events = self.pat.query_many(spans)
+        events = flatten(outer_events)
+        # Build the inner pattern once for each distinct outer value, and
+        # query it for the parts of all events with that value at once.
+        groups = {}
+        for i, ev in enumerate(events):
+            try:
+                key = (type(ev.value), ev.value)
+                hash(key)
+            except TypeError:
+                key = i
+            groups.setdefault(key, []).append(i)
+        matches = [None] * len(events)
+        for indices in groups.values():
+            inner_pat = self.func(events[indices[0]].value)
+            parts = [events[i].part for i in indices]
+            for i, bs in zip(indices, inner_pat.query_many(parts)):
+                matches[i] = [self._with_whole(events[i], b) for b in bs]
+        matches = iter(matches)
+        return [flatten(islice(matches, len(evs))) for evs in outer_events]
+
+    def query_batch(self, span):
+        if self.choose_whole is not _inner_whole:
+            return super().query_batch(span)
+        from .batch import EventBatch
+
+        return EventBatch.concat(
+            [self.func(ev.value).query_batch(ev.part) for ev in self.pat.query(span)]
+        )
+
+    def period(self):
+        # Combines the period of the outer pattern with the periods of the
+        # inner patterns of the values in one outer period
+        try:
+            return self._period
+        except AttributeError:
+            pass
+        period = self.pat.period()
+        if period is not None:
+            events = self.pat.query(TimeSpan(0, period))
+            period = _lcm_periods(
+                period, *[self.func(ev.value).period() for ev in events]
+            )
+        object.__setattr__(self, "_period", period)
+        return period
+
+
+class WhenCycle(Node):
+    """Applies a function to a pattern on the cycles that pass a test"""
+
+    __slots__ = _fields = ("pat", "test_func", "func")
+
+    def _pat(self, span):
+        if self.test_func(math.floor(span.begin)):
+            return self.func(self.pat)
+        return self.pat
+
+    def iter_query(self, span):
+        return chain.from_iterable(
+            self._pat(subspan).iter_query(subspan) for subspan in span.span_cycles()
+        )
+
+
+class Rev(Node):
+    """Reverses each cycle of a pattern"""
+
+    __slots__ = _fields = ("pat",)
+
+    def _query_cycle(self, span):
+        cycle = span.begin.sam()
+        next_cycle = span.begin.next_sam()
+
+        def reflect(to_reflect):
+            return _timespan(
+                cycle + (next_cycle - to_reflect.end),
+                cycle + (next_cycle - to_reflect.begin),
+            )
+
+        events = self.pat.iter_query(reflect(span))
+        return (event.with_span(reflect) for event in events)
+
+    def iter_query(self, span):
+        return chain.from_iterable(
+            self._query_cycle(subspan) for subspan in span.span_cycles()
+        )
+
+    def period(self):
+        return _lcm_periods(self.pat.period(), 1)
+
+
+class FastGap(Node):
+    """Speeds up a pattern by a factor, but keeping its cyclic alignment, so
+    that each cycle is squashed into its beginning"""
+
+    __slots__ = _fields = ("pat", "factor")
+
+    def _munge_query(self, t):
+        return t.sam() + min(1, self.factor * t.cycle_pos())
+
+    def _munge_span(self, span):
+        new_span = TimeSpan(self._munge_query(span.begin), self._munge_query(span.end))
+        if new_span.begin == span.begin.next_sam():
+            return None
+        return new_span
+
+    def _event_span(self, span):
+        begin = span.begin.sam() + Fraction(span.begin - span.begin.sam(), self.factor)
+        end = span.begin.sam() + Fraction(span.end - span.begin.sam(), self.factor)
+        return TimeSpan(begin, end)
+
+    def _query_cycle(self, span):
+        new_span = self._munge_span(span)
+        if new_span is None:
+            return []
+        return [e.with_span(self._event_span) for e in self.pat.query(new_span)]
+
+    def query(self, span):
+        return flatten([self._query_cycle(subspan) for subspan in span.span_cycles()])
+
+    def query_many(self, spans):
+        subspans = [span.span_cycles() for span in spans]
+        new_spans = [self._munge_span(span) for span in flatten(subspans)]
+        results = iter(self.pat.query_many([s for s in new_spans if s is not None]))
+        events = iter(
+            []
+            if new_span is None
+            else [e.with_span(self._event_span) for e in next(results)]
+            for new_span in new_spans
+        )
+        return [flatten(islice(events, len(s))) for s in subspans]
+
+    def period(self):
+        return _lcm_periods(self.pat.period(), 1)
+
+
+class Cached(Node):
+    """Memoizes the results of the last `maxsize` queries"""
+
+    _fields = ("pat", "maxsize")
+    __slots__ = _fields + ("_query",)
+
+    def __init__(self, pat, maxsize):
+        super().__init__(pat, maxsize)
+        # Events are immutable, so only the list of events is copied on hits
+        query = lru_cache(maxsize)(lambda span: tuple(pat.query(span)))
+        object.__setattr__(self, "_query", query)
+
+    def query(self, span):
+        return list(self._query(span))
+
+    def iter_query(self, span):
+        return iter(self._query(span))
+
+    def period(self):
+        return self.pat.period()
+
+    def cache_info(self):
+        return self._query.cache_info()
+
+    def cache_clear(self):
+        self._query.cache_clear()
+
+
+class Periodic(Node):
+    """Answers queries from a table of the events of a single period"""
+
+    _fields = ("pat", "period_")
+    __slots__ = _fields + ("_table",)
+
+    def _build_table(self):
+        # The table is None if the events can not be sliced (e.g. continuous
+        # events, whose values depend on the query span), or if every slice
+        # of a period would cut an event in two
+        period = self.period_
+        phase = Fraction(0)
+        events = self.pat.query(TimeSpan(0, period))
+        if any(e.whole is None or e.part.begin >= e.part.end for e in events):
+            return None
+        if any(self._crosses(e.whole, phase) for e in events):
+            # Slices start at the onset of an event instead, so that events
+            # crossing the start of cycles are not split
+            phases = sorted({e.whole.begin % period for e in events})
+            phase = next(
+                (
+                    p
+                    for p in phases
+                    if not any(self._crosses(e.whole, p) for e in events)
+                ),
+                None,
+            )
+            if phase is None:
+                return None
+            events = self.pat.query(TimeSpan(phase, phase + period))
+        # Events are kept in the order of the pattern, and looked up by onset
+        order = sorted(range(len(events)), key=lambda i: events[i].part.begin)
+        begins = [events[i].part.begin for i in order]
+        max_length = max((e.part.end - e.part.begin for e in events), default=0)
+        return events, order, begins, max_length, phase
+
+    def _crosses(self, whole, time):
+        # Whether a whole contains a start of slice (`time` plus a multiple of
+        # the period) other than its onset
+        period = self.period_
+        start = (time - whole.begin) % period or period
+        return start < whole.end - whole.begin
+
+    def _query_period(self, begin, end, offset):
+        # Queries [begin, end) from the table, shifted by `offset`
+        events, order, begins, max_length, _ = self._table
+        lo = bisect_left(begins, begin - max_length)
+        hi = bisect_left(begins, end)
+        result = []
+        for i in sorted(i for i in order[lo:hi] if events[i].part.end > begin):
+            event = events[i]
+            part = event.part
+            whole = event.whole
+            result.append(
+                _event(
+                    _timespan(whole.begin + offset, whole.end + offset),
+                    _timespan(
+                        max(part.begin, begin) + offset,
+                        min(part.end, end) + offset,
+                    ),
+                    event.value,
+                )
+            )
+        return result
+
+    def query(self, span):
+        try:
+            table = self._table
+        except AttributeError:
+            table = self._build_table()
+            object.__setattr__(self, "_table", table)
+        if table is None or span.begin == span.end:
+            return self.pat.query(span)
+        period = self.period_
+        phase = table[-1]
+        events = []
+        cycle = math.floor((span.begin - phase) / period)
+        while True:
+            offset = to_time(cycle * period)
+            end = span.end - offset
+            events.extend(
+                self._query_period(
+                    max(span.begin - offset, phase), min(end, phase + period), offset
+                )
+            )
+            if end <= phase + period:
+                return events
+            cycle += 1
+
+    def period(self):
+        return self.period_
+
+
+# Optimization
+#
+# `Pattern.optimize` rewrites the node tree of a pattern into an equivalent
+# one that is cheaper to query.  Rewrites are exact: optimized patterns
+# return the same events, in the same order, as the original ones.
+
+
+def _affine_parts(node):
+    """Returns the pattern, scale and offset of a time transformation node,
+    or None if the node is not one"""
+    if isinstance(node, Fast) and node.factor > 0:
+        return node.pat, node.factor, Fraction(0)
+    if isinstance(node, Early):
+        return node.pat, Fraction(1), node.offset
+    if isinstance(node, Affine):
+        return node.pat, node.scale, node.offset
+    return None
+
+
+def _split_parts(node):
+    """Returns the pattern and the grids of the split points of a node that
+    splits queries, or None if the node is not one"""
+    if isinstance(node, SplitQueries):
+        return node.pat, ((Fraction(1), Fraction(0)),)
+    if isinstance(node, SplitQueriesAt):
+        return node.pat, node.grids
+    return None
+
+
+def _merge_grids(grids) -> tuple:
+    """Normalizes grids of split points, dropping the ones whose points all
+    belong to another grid"""
+    grids = {(Fraction(step), Fraction(phase) % step) for step, phase in grids}
+    return tuple(
+        sorted(
+            (step, phase)
+            for step, phase in grids
+            if not any(
+                (other_step, other_phase) != (step, phase)
+                and (step / other_step).denominator == 1
+                and ((phase - other_phase) / other_step).denominator == 1
+                for other_step, other_phase in grids
+            )
+        )
+    )
+
+
+def _time_transform(pat, scale, offset):
+    """Returns the simplest node that maps query times to `t * scale + offset`"""
+    if scale == 1:
+        if offset == 0:
+            return pat.node
+        return Early(pat, to_time(offset))
+    if offset == 0:
+        return Fast(pat, Fraction(scale))
+    return Affine(pat, Fraction(scale), to_time(offset))
+
+
+def _pure_node(node) -> Optional[Pure]:
+    """Returns the `Pure` node a node is made of if the node is equivalent to
+    it, looking through the wrappers that leave it unchanged (e.g. the ones
+    mini-notation builds around single values), or None"""
+    while not isinstance(node, Pure):
+        if isinstance(node, Stack) and len(node.pats) == 1:
+            node = node.pats[0].node
+        elif isinstance(node, SplitQueries):
+            node = node.pat.node
+        elif isinstance(node, (Fast, FastGap)) and node.factor == 1:
+            node = node.pat.node
+        elif isinstance(node, Early) and node.offset == math.floor(node.offset):
+            node = node.pat.node
+        else:
+            return None
+    return node
+
+
+def _constant_node(pat) -> Optional[Pure]:
+    """Returns a `Pure` node equivalent to a pattern, i.e. to a pattern that
+    has a single event per cycle spanning the whole cycle, or None"""
+    node = _pure_node(pat.node)
+    if node is not None:
+        return node
+    if pat.period() != 1:
+        return None
+    cycle = TimeSpan(0, 1)
+    events = pat.query(cycle)
+    if len(events) != 1:
+        return None
+    event = events[0]
+    if event.whole is None or event.whole != cycle or event.part != cycle:
+        return None
+    return Pure(event.value)
+
+
+def _optimize(node, memo):
+    """Returns an optimized version of a node.  Nodes are optimized once even
+    if they are shared, with `memo` mapping their identity to the result."""
+    key = _object_id(node)
+    if key in memo:
+        return memo[key][1]
+    params = node.params()
+    new_params = tuple(_optimize_param(param, memo) for param in params)
+    new_node = node
+    if any(a is not b for a, b in zip(new_params, params)):
+        new_node = type(node)(*new_params)
+    result = _rewrite(new_node, memo)
+    # Keep the original node, so that its identity is not reused
+    memo[key] = (node, result)
+    return result
+
+
+def _optimize_param(param, memo):
+    if isinstance(param, Pattern):
+        node = _optimize(param.node, memo)
+        return param if node is param.node else Pattern(node)
+    if isinstance(param, (list, tuple)) and any(isinstance(p, Pattern) for p in param):
+        new_param = [_optimize_param(p, memo) for p in param]
+        if any(a is not b for a, b in zip(new_param, param)):
+            return type(param)(new_param)
+    return param
+
+
+def _rewrite(node, memo):
+    """Rewrites a node whose children are already optimized"""
+    if isinstance(node, Stack) and len(node.pats) == 1:
+        return node.pats[0].node
+
+    if isinstance(node, FastGap) and node.factor == 1:
+        return _rewrite(SplitQueries(node.pat), memo)
+
+    if isinstance(node, Bind) and node.choose_whole is _inner_whole:
+        # Joining a pattern of a constant value (e.g. `fast(2)`, or
+        # `fast("2")` from mini-notation) just splits the queries of the
+        # inner pattern at cycle boundaries
+        pure_node = _constant_node(node.pat)
+        if pure_node is not None:
+            inner = node.func(pure_node.value)
+            if isinstance(inner, Pattern):
+                inner = Pattern(_optimize(inner.node, memo))
+                return _rewrite(SplitQueries(inner), memo)
+
+    split = _split_parts(node)
+    if split is not None:
+        pat, grids = split
+        inner_split = _split_parts(pat.node)
+        if inner_split is not None:
+            pat, inner_grids = inner_split
+            grids = grids + inner_grids
+        grids = _merge_grids(grids)
+        if grids == ((1, 0),):
+            return SplitQueries(pat)
+        return SplitQueriesAt(pat, grids)
+
+    affine = _affine_parts(node)
+    if affine is not None:
+        # Fuses nested time transformations into a single one, moving the
+        # query splits found in between out of the transformation
+        pat, scale, offset = affine
+        grids = []
+        while True:
+            inner_affine = _affine_parts(pat.node)
+            if inner_affine is not None:
+                pat, inner_scale, inner_offset = inner_affine
+                scale, offset = scale * inner_scale, offset * inner_scale + inner_offset
+                continue
+            inner_split = _split_parts(pat.node)
+            if inner_split is not None:
+                pat, inner_grids = inner_split
+                grids.extend(
+                    (step / scale, (phase - offset) / scale)
+                    for step, phase in inner_grids
+                )
+                continue
+            break
+        node = _time_transform(pat, scale, offset)
+        if grids:
+            return _rewrite(SplitQueriesAt(Pattern(node), tuple(grids)), memo)
+
+    return node
+
+
+def pure(value):
+    """Returns a pattern that repeats the given value once per cycle"""
+    return Pattern(Pure(value))
+
+
+def steady(value):
+    return Pattern(Steady(value))
+
+
+def slowcat(*pats):
+    """
+    Concatenation: combines a list of patterns, switching between them
+    successively, one per cycle.
+    (currently behaves slightly differently from Tidal)
+    """
+    return Pattern(Slowcat(tuple(reify(pat) for pat in pats)))
+
+
+def fastcat(*pats):
+    """Concatenation: as with slowcat, but squashes a cycle from each
+    pattern into one cycle"""
+    return Pattern(Fastcat(slowcat(*pats), Fraction(len(pats))))
+
+
+# alias
+cat = fastcat
+
+
+def stack(*pats):
+    """Pile up patterns"""
+    return Pattern(Stack(tuple(reify(pat) for pat in pats)))
+
+
+def _sequence_count(x):
+    from .mini import mini
+
+    if type(x) == list or type(x) == tuple:
+        if len(x) == 1:
+            return _sequence_count(x[0])
+        else:
+            return (fastcat(*[sequence(x) for x in x]), len(x))
+    if isinstance(x, Pattern):
+        return (x, 1)
+    if isinstance(x, str):
+        return (mini(x), 1)
+    return (pure(x), 1)
+
+
+def sequence(*args):
+    return _sequence_count(args)[0]
+
+
+def polymeter(*args, steps=None):
+    seqs = [_sequence_count(x) for x in args]
+    if len(seqs) == 0:
+        return silence()
+    if not steps:
+        steps = seqs[0][1]
+    pats = []
+    for seq in seqs:
+        if seq[1] == 0:
+            next
+        if steps == seq[1]:
+            pats.append(seq[0])
+        else:
+            pats.append(seq[0]._fast(Fraction(steps) / Fraction(seq[1])))
+    return stack(*pats)
+
+
+# alias
+pm = polymeter
+
+
+def polyrhythm(*xs):
+    seqs = [sequence(x) for x in xs]
+
+    if len(seqs) == 0:
+        return silence()
+
+    return stack(*seqs)
+
+
+# alias
+pr = polyrhythm
+
+
+def reify(x) -> Pattern:
+    from .mini import mini
+
+    if not isinstance(x, Pattern):
+        if isinstance(x, str):
+            return mini(x)
+        return pure(x)
+    return x
+
+
+def _tparams(func, *params):
+    if not params:
+        return silence()
+    curried_func = curry(func)
+    return reduce(
+        lambda a, b: a.app_both(reify(b)),
+        params[1:],
+        reify(params[0]).fmap(curried_func),
+    )
+
+
+# Randomness
+RANDOM_CONSTANT = 2**29
+RANDOM_CYCLES_LENGTH = 300
+
+
+def xorwise(x: int) -> int:
+    """
+    Xorshift RNG
+
+    cf. George Marsaglia (2003). "Xorshift RNGs". Journal of Statistical Software 8:14.
+    https://www.jstatsoft.org/article/view/v008i14
+
+    """
+    a = (x << 13) ^ x
+    b = (a >> 17) ^ a
+    return (b << 5) ^ b
+
+
+def time_to_int_seed(a: float, seed: int = 0) -> int:
+    """
+    Stretch RANDOM_CYCLES_LENGTH cycles over the range of [0, RANDOM_CONSTANT)
+    then apply the xorshift algorithm.
+
+    A non-zero `seed` offset (see `seed_offset`) selects another random
+    sequence: it is added to the stretched time before the algorithm, and to
+    the result before a second round of it, as xorshift alone is linear and
+    would keep sequences correlated.
+
+    """
+    x = xorwise(math.trunc((a / RANDOM_CYCLES_LENGTH) * RANDOM_CONSTANT) + seed)
+    if seed:
+        x = xorwise(x % RANDOM_CONSTANT + seed)
+    return x
+
+
+def int_seed_to_rand(a: int) -> float:
+    return (a % RANDOM_CONSTANT) / RANDOM_CONSTANT
+
+
+def seed_offset(seed) -> int:
+    """
+    Returns the offset of the random sequence selected by a seed, an int or
+    a str.  Offsets are the same in every process (they do not depend on
+    Python's hash randomization), and seed 0 (or None) selects the default
+    sequence.
+
+    """
+    if seed is None or seed == 0:
+        return 0
+    if not isinstance(seed, str):
+        seed = str(int(seed))
+    return zlib.crc32(seed.encode()) % RANDOM_CONSTANT
+
+
+# Offset of the random sequence used when none is given
+_random_seed = ContextVar("random_seed", default=0)
+
+
+@contextmanager
+def random_seed(seed):
+    """
+    Selects the random sequence used by the random functions (e.g. `rand`,
+    `irand`, `degrade_by`, `sometimes_by`, `choose`) for the patterns queried
+    within the block, unless they were given a seed of their own.  Streams
+    use it to get independent randomness.
+
+    >>> with random_seed("drums"):
+    ...     events = pure("bd").fast(8).degrade().first_cycle()
+
+    """
+    token = _random_seed.set(seed_offset(seed))
+    try:
+        yield
+    finally:
+        _random_seed.reset(token)
+
+
+def _seed(seed) -> Optional[int]:
+    """Returns the offset of an optional seed, None if it is not given"""
+    return None if seed is None else seed_offset(seed)
+
+
+def time_to_rand(a, seed: Optional[int] = None):
+    """
+    Returns the random value of a time, in the range [0, 1), from the random
+    sequence of a seed offset (see `seed_offset`), or of the current
+    `random_seed` if it is None.
+
+    Values are cached by time and seed, as the same times are sampled again
+    when cycles are queried repeatedly, e.g. by `sometimes_by` or by
+    overlapping stream queries.
+
+    """
+    if seed is None:
+        seed = _random_seed.get()
+    return _time_to_rand(a, seed)
+
+
+@lru_cache(maxsize=4096, typed=True)
+def _time_to_rand(a, seed: int):
+    return int_seed_to_rand(time_to_int_seed(a, seed))
+
+
+# Lists of times at least this long are sampled at once with NumPy
+_VECTORIZED_RAND_MIN = 16
+
+
+def _times_to_rand(times: list, seed: Optional[int] = None) -> list:
+    """Returns the random values of a list of (rational) times, like
+    `time_to_rand`, using the vectorized engine of `vortex.batch` for long
+    lists when NumPy is available"""
+    if seed is None:
+        seed = _random_seed.get()
+    if len(times) >= _VECTORIZED_RAND_MIN:
+        from . import batch
+
+        if batch.np is not None:
+            return batch.times_to_rand(times, seed).tolist()
+    return [_time_to_rand(t, seed) for t in times]
+
+
+# Signals
+
+
+def silence():
+    return Pattern(Silence())
+
+
+def signal(func, many=None):
+    """
+    Returns a continuous pattern of the values of a function of time, sampled
+    at the midpoint of each query.
+
+    `many`, if given, is a function returning the values of a list of times
+    at once, the same as calling `func` on each of them.  It is used when the
+    pattern is sampled many times at once, e.g. by `segment`.
+
+    """
+    return Pattern(Signal(func, many))
+
+
+sine2 = lambda: signal(lambda t: math.sin(math.pi * 2 * t))
+sine = lambda: signal(lambda t: (math.sin(math.pi * 2 * t) + 1) / 2)
+
+cosine2 = lambda: sine2().early(0.25)
+cosine = lambda: sine().early(0.25)
+
+saw2 = lambda: signal(lambda t: (t % 1) * 2)
+saw = lambda: signal(lambda t: t % 1)
 
 isaw2 = lambda: signal(lambda t: (1 - (t % 1)) * 2)
 isaw = lambda: signal(lambda t: 1 - (t % 1))
@@ -1110,17 +2831,26 @@ square2 = lambda: signal(lambda t: (math.floor((t * 2) % 2) * 2) - 1)
 square = lambda: signal(lambda t: math.floor((t * 2) % 2))
 
 
-def rand():
+def rand(seed=None):
     """
     Generate a continuous pattern of pseudo-random numbers between `0` and `1`.
 
+    With a `seed` (an int or a str), numbers come from the random sequence of
+    that seed instead of the current one (see `random_seed`).
+
     >>> rand().segment(4)
+    >>> rand(seed=2).segment(4)
 
     """
-    return signal(time_to_rand)
+    if seed is None:
+        return signal(time_to_rand, _times_to_rand)
+    seed = seed_offset(seed)
+    return signal(
+        lambda t: _time_to_rand(t, seed), lambda times: _times_to_rand(times, seed)
+    )
 
 
-def irand(n: int):
+def irand(n: int, seed=None):
     """
     Generate a pattern of pseudo-random whole numbers between `0` to `n-1` inclusive.
 
@@ -1130,7 +2860,11 @@ def irand(n: int):
     >>> irand(16).segment(8)
 
     """
-    return signal(lambda t: math.floor(time_to_rand(t) * n))
+    seed = _seed(seed)
+    return signal(
+        lambda t: math.floor(time_to_rand(t, seed) * n),
+        lambda times: [math.floor(r * n) for r in _times_to_rand(times, seed)],
+    )
 
 
 def _perlin_with(p: Pattern) -> Pattern:
@@ -1158,10 +2892,30 @@ def perlin(p: Optional[Pattern] = None) -> Pattern:
 
     """
     if not p:
-        p = signal(id)
+        return signal(_perlin, _perlin_many)
     return _perlin_with(p)
 
 
+def _smoother_step(x):
+    return 6.0 * x**5 - 15.0 * x**4 + 10.0 * x**3
+
+
+def _perlin(t, rands=None):
+    """Perlin noise at time `t`, the same as `_perlin_with(signal(id))`, with
+    the random values of cycles taken from `rands` if given"""
+    a = math.floor(t)
+    ra = time_to_rand(a) if rands is None else rands[a]
+    rb = time_to_rand(a + 1) if rands is None else rands[a + 1]
+    return ra + _smoother_step(t - a) * (rb - ra)
+
+
+def _perlin_many(times: list) -> list:
+    # Sample the random value of each cycle once
+    cycles = {a for t in times for a in (math.floor(t), math.floor(t) + 1)}
+    rands = {a: time_to_rand(a) for a in cycles}
+    return [_perlin(t, rands) for t in times]
+
+
 # Hack to make module-level function versions of pattern methods.
 
 module_obj = sys.modules[__name__]
@@ -1245,12 +2999,15 @@ def timecat(*time_pat_tuples):
     for time, pat in time_pat_tuples:
         arranged.append((accum, accum + Fraction(time), reify(pat)))
         accum += time
-    return stack(
-        *[
-            pat.compress(Fraction(s, total), Fraction(e, total))
-            for s, e, pat in arranged
-        ]
+    pats = tuple(
+        pat.compress(Fraction(s, total), Fraction(e, total)) for s, e, pat in arranged
     )
+    if len(pats) == 1 or any(time < 0 for time, _ in time_pat_tuples):
+        # Negative sizes leave the segments unordered
+        return stack(*pats)
+    begins = tuple(Fraction(s, total) for s, _, _ in arranged)
+    ends = tuple(Fraction(e, total) for _, e, _ in arranged)
+    return Pattern(Timecat(pats, begins, ends))
 
 
 def _choose_with(pat, *vals):
@@ -1294,18 +3051,48 @@ def wchoose_with(pat, *pairs):
     Values are samples using the 0..1 ranged numerical pattern `pat`.
 
     """
+    from .batch import np, values_array, vectorized
+
     values, weights = list(zip(*pairs))
     cweights = list(accumulate(w for _, w in pairs))
     total = sum(weights)
+    # Cumulative weights can be searched by bisection unless some weights
+    # are negative
+    increasing = all(w >= 0 for w in weights)
+    if np is not None:
+        values_arr = values_array(list(values))
+        # Cumulative weights are compared exactly, unless they are floats
+        if all(type(w) is float for w in weights):
+            cweights_arr = np.array(cweights, dtype=float)
+        else:
+            cweights_arr = np.empty(len(cweights), dtype=object)
+            cweights_arr[:] = cweights
 
-    def match(r):
-        if r < 0 or r > 1:
+    def check_range(outside):
+        if outside:
             raise ValueError(
                 "value from random pattern used by `wchooseby` is outside 0-1 range"
             )
+
+    def choose(r):
+        if increasing:
+            return values[bisect_left(cweights, r * total)]
         indices = [i for i, c in enumerate(cweights) if c >= r * total]
         return values[indices[0]]
 
+    @vectorized
+    def match(r):
+        # The chosen value is the first one whose cumulative weight reaches
+        # r * total, and arrays of values (from batched queries) are
+        # matched at once
+        if np is not None and isinstance(r, np.ndarray):
+            check_range(np.any((r < 0) | (r > 1)))
+            if increasing:
+                return values_arr[np.searchsorted(cweights_arr, r * total)]
+            return values_array([choose(x) for x in r.tolist()])
+        check_range(r < 0 or r > 1)
+        return choose(r)
+
     return pat.fmap(match)
 
 
@@ -1314,8 +3101,10 @@ def wchoose(*vals):
     return wchoose_with(rand(), *vals)
 
 
+@lru_cache(maxsize=1024, typed=True)
 def _euclid(k: int, n: int, rotation: float):
-    """Generate an euclidean sequence, with optional rotation"""
+    """Generate an euclidean sequence, with optional rotation (sequences are
+    cached, as patterned parameters ask for them on every query)"""
     b = bjorklund(k, n)
     if rotation:
         b = rotate_left(b, rotation)
@@ -0,0 +1,194 @@
+"""
+Process pools
+
+Patterns are evaluated in pure Python, so the patterns of all streams are
+evaluated on a single core.  A `ProcessPool` evaluates them in worker
+processes instead: each stream is assigned to one of the workers, which
+queries its patterns and sends back the onsets of the queried spans as
+compact records, so that the streams of a set are spread over the cores.
+
+Patterns are made of closures (e.g. the functions given to `every`), which
+can not be sent to other processes, so the workers are sent the definitions
+of patterns instead: the source code of a pattern expression, with the names
+of the vortex DSL (see `define`).  Workers keep the patterns they evaluated
+from their definitions, so definitions are only evaluated once per worker.
+
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from .pattern import Pattern, TimeSpan, _event, _timespan, random_seed
+from .ticks import Tick, get_time_backend, set_time_backend
+
+
+def define(source: str) -> Pattern:
+    """
+    Evaluates a pattern definition, the source code of an expression of the
+    vortex DSL, and returns the pattern, which keeps its definition (as its
+    `source` attribute) so that it can be evaluated by a `ProcessPool`.
+
+    >>> define('s("bd*2 [sn cp]").every(3, lambda p: p.fast(2))')
+
+    """
+    import vortex
+
+    pattern = eval(source, dict(vars(vortex)))
+    if not isinstance(pattern, Pattern):
+        raise TypeError(f"{repr(source)} does not define a pattern")
+    pattern.source = source
+    return pattern
+
+
+def query_records(pattern: Pattern, span: TimeSpan) -> list:
+    """Returns the events of the pattern with onsets in the span, as
+    `(begin, end, value)` records of their wholes and values"""
+    return [(e.whole.begin, e.whole.end, e.value) for e in pattern.iter_onsets(span)]
+
+
+def records_to_events(records: list) -> list:
+    """Converts records of onsets (see `query_records`) back to events,
+    whose parts are their wholes"""
+    events = []
+    for begin, end, value in records:
+        whole = _timespan(begin, end)
+        events.append(_event(whole, whole, value))
+    return events
+
+
+@lru_cache(maxsize=256)
+def _defined_pattern(source: str) -> Pattern:
+    return define(source)
+
+
+def _query_windows(time_backend: tuple, windows: list) -> list:
+    """Queries windows of patterns in a worker process.  `windows` is a list
+    of `(source, seed, begin, end)` tuples, and the records of each window
+    are returned."""
+    backend, resolution = time_backend
+    if get_time_backend() != backend or Tick.resolution != resolution:
+        set_time_backend(backend, resolution)
+    results = []
+    for source, seed, begin, end in windows:
+        with random_seed(seed):
+            pattern = _defined_pattern(source)
+            results.append(query_records(pattern, TimeSpan(begin, end)))
+    return results
+
+
+def _query_window(time_backend: tuple, window: tuple) -> list:
+    return _query_windows(time_backend, [window])[0]
+
+
+class ProcessPool:
+    """
+    Evaluates the patterns of streams in worker processes
+
+    Streams are assigned to the workers in turn, by name, and always
+    evaluated by the same worker.  The queries of streams without a name are
+    sent to the workers in turn.  Patterns should be built with `define`.
+    Worker processes are spawned, so scripts creating a pool should do it
+    under `if __name__ == "__main__":`.
+
+    Parameters
+    ----------
+    processes: Optional[int]
+        Number of worker processes (default: the number of CPUs)
+
+    """
+
+    def __init__(self, processes: int = None):
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if processes < 1:
+            raise ValueError("processes should be a positive integer")
+        self.processes = processes
+        # Workers are spawned rather than forked, as forking a process whose
+        # threads (e.g. Link's and liblo's) hold locks can deadlock the child
+        context = multiprocessing.get_context("spawn")
+        self._executors = [
+            ProcessPoolExecutor(max_workers=1, mp_context=context)
+            for _ in range(processes)
+        ]
+        self._workers = {}
+        self._next_worker = 0
+        self._lock = threading.Lock()
+
+    def worker(self, name) -> int:
+        """Returns the index of the worker a stream is assigned to, or of the
+        next worker in turn for streams without a name (None), which are not
+        assigned to any"""
+        with self._lock:
+            index = self._workers.get(name)
+            if index is None:
+                index = self._next_worker
+                self._next_worker = (index + 1) % self.processes
+                if name is not None:
+                    self._workers[name] = index
+            return index
+
+    def submit(self, name, pattern: Pattern, span: TimeSpan, seed=None):
+        """
+        Queries the onsets of a pattern in a span in the worker of a stream,
+        with the given random seed (see `random_seed`), and returns a future
+        of their records (see `query_records`)
+
+        """
+        window = (_source(pattern), seed, span.begin, span.end)
+        executor = self._executors[self.worker(name)]
+        return executor.submit(_query_window, _time_backend(), window)
+
+    def query_many(self, queries: list) -> list:
+        """
+        Queries the onsets of the patterns of many streams at once, given as
+        a list of `(name, pattern, span, seed)` tuples, and returns the list
+        of records of each query.  Each worker queries all the patterns of
+        its streams in a single call.
+
+        """
+        by_worker = {}
+        for i, (name, pattern, span, seed) in enumerate(queries):
+            window = (_source(pattern), seed, span.begin, span.end)
+            by_worker.setdefault(self.worker(name), []).append((i, window))
+        time_backend = _time_backend()
+        futures = [
+            (
+                [i for i, _ in windows],
+                self._executors[index].submit(
+                    _query_windows, time_backend, [w for _, w in windows]
+                ),
+            )
+            for index, windows in by_worker.items()
+        ]
+        results = [None] * len(queries)
+        for indices, future in futures:
+            for i, records in zip(indices, future.result()):
+                results[i] = records
+        return results
+
+    def close(self):
+        """Shuts the worker processes down"""
+        for executor in self._executors:
+            executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _source(pattern: Pattern) -> str:
+    source = getattr(pattern, "source", None)
+    if source is None:
+        raise ValueError(
+            "Patterns evaluated by a process pool should be built with `define`"
+        )
+    return source
+
+
+def _time_backend() -> tuple:
+    return get_time_backend(), Tick.resolution
@@ -0,0 +1,151 @@
+"""
+Scheduler statistics
+
+Clocks and streams record the timing of each of their ticks: `ClockStats`
+records how late the clock thread wakes up for each tick (its jitter), and
+`StreamStats` how long each stream takes to query its pattern, how many
+events it plays, and how many of them are sent too late to be played on
+time.  Measures are kept over the last ticks, and summarized with their
+percentiles.
+
+"""
+
+import math
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+# Number of ticks over which measures are summarized (a bit less than a
+# minute at the clock's 20 ticks per second)
+DEFAULT_WINDOW = 1000
+
+
+class Samples:
+    """The last `window` values of a measure, with the count and total of
+    all the values.  Values are added by the clock thread, and can be read
+    from other threads."""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._values = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        with self._lock:
+            self._values.append(value)
+            self.count += 1
+            self.total += value
+
+    def values(self) -> List[float]:
+        """Returns the last values"""
+        with self._lock:
+            return list(self._values)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Returns the `p`th percentile (0..100) of the last values,
+        interpolated between the closest ranks, or None without values"""
+        return _percentile(sorted(self.values()), p)
+
+    def summary(self) -> Dict[str, float]:
+        """Returns the mean, median, 95th and 99th percentiles, and maximum
+        of the last values"""
+        values = sorted(self.values())
+        if not values:
+            return {}
+        return {
+            "mean": sum(values) / len(values),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+            "max": values[-1],
+        }
+
+
+def _percentile(values: list, p: float) -> Optional[float]:
+    if not values:
+        return None
+    if not 0 <= p <= 100:
+        raise ValueError("percentiles should be between 0 and 100")
+    rank = (len(values) - 1) * p / 100
+    lo = math.floor(rank)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (rank - lo)
+
+
+class ClockStats:
+    """Timing of the ticks of a clock: how late the clock thread woke up
+    for each tick (`jitter`), and how long notifying the subscribers took
+    (`tick_time`), in seconds"""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self.jitter = Samples(window)
+        self.tick_time = Samples(window)
+        self.errors = 0
+
+    def record_tick(self, jitter: float, tick_time: float):
+        self.jitter.add(jitter)
+        self.tick_time.add(tick_time)
+
+    def summary(self) -> dict:
+        return {
+            "ticks": self.jitter.count,
+            "jitter": self.jitter.summary(),
+            "tick_time": self.tick_time.summary(),
+            "errors": self.errors,
+        }
+
+
+class StreamStats:
+    """Timing of the ticks of a stream: how long querying its pattern took
+    (`query_time`, in seconds), how many events it played (`events`), and
+    how many of them were sent with a timestamp already in the past
+    (`late`)"""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self.query_time = Samples(window)
+        self.events = Samples(window)
+        self.late = 0
+
+    def record_tick(self, query_time: float, events: int, late: int):
+        self.query_time.add(query_time)
+        self.events.add(events)
+        self.late += late
+
+    def summary(self) -> dict:
+        return {
+            "ticks": self.query_time.count,
+            "query_time": self.query_time.summary(),
+            "events": self.events.summary(),
+            "late": self.late,
+        }
+
+
+def format_stats(clock: ClockStats, streams: Dict[str, StreamStats]) -> str:
+    """Formats the statistics of a clock and its streams as a single log
+    line, with times in milliseconds"""
+
+    def ms(samples: Samples) -> str:
+        summary = samples.summary()
+        if not summary:
+            return "-"
+        return "p50 %.2fms p99 %.2fms max %.2fms" % (
+            summary["p50"] * 1000,
+            summary["p99"] * 1000,
+            summary["max"] * 1000,
+        )
+
+    parts = [
+        "ticks %d" % clock.jitter.count,
+        "jitter %s" % ms(clock.jitter),
+        "tick %s" % ms(clock.tick_time),
+    ]
+    if clock.errors:
+        parts.append("errors %d" % clock.errors)
+    for name, stats in streams.items():
+        events = stats.events.summary()
+        parts.append(
+            "%s: query %s, %.1f events/tick, %d late"
+            % (name, ms(stats.query_time), events.get("mean", 0), stats.late)
+        )
+    return " | ".join(parts)
@@ -5,13 +5,16 @@ import math
 import threading
 import time
 from abc import ABC
+from collections import deque
 from fractions import Fraction
-from typing import Any, Dict
+from typing import Any, Dict, Union
 
 import liblo
 import link
 
 from vortex import *
+from vortex.pool import records_to_events
+from vortex.stats import ClockStats, StreamStats, format_stats
 
 _logger = logging.getLogger(__name__)
 
@@ -28,13 +31,20 @@ class LinkClock:
     ----------
     bpm: float
         beats per minute (default: 120)
+    stats_interval: Optional[float]
+        If given, the statistics of the clock and its streams (see
+        `stats_summary`) are logged every `stats_interval` seconds
 
     """
 
-    def __init__(self, bpm=120):
+    def __init__(self, bpm=120, stats_interval=None):
         self.bpm = bpm
+        self.stats_interval = stats_interval
+        self.stats = ClockStats()
 
         self._subscribers = []
+        # Errors already logged, by subscriber and type of exception
+        self._logged_errors = set()
         self._link = link.Link(bpm)
         self._is_running = False
         self._mutex = threading.Lock()
@@ -48,6 +58,11 @@ class LinkClock:
         """Unsubscribe from tick notifications"""
         with self._mutex:
             self._subscribers.remove(subscriber)
+            self._logged_errors = {
+                (sub, error)
+                for sub, error in self._logged_errors
+                if sub is not subscriber
+            }
 
     def start(self):
         """Start the clock"""
@@ -70,6 +85,36 @@ class LinkClock:
         """Returns whether clock is currently running"""
         return self._is_running
 
+    def stats_summary(self) -> Dict[str, Any]:
+        """
+        Returns the timing statistics of the last ticks of the clock and of
+        its subscribed streams, in seconds, with their percentiles:
+
+        * `jitter`: how late the clock thread woke up for each tick
+        * `tick_time`: how long notifying all subscribers took
+        * `errors`: the number of errors raised by subscribers (only the
+          first error of each type is logged for each subscriber)
+        * `streams`: for each stream (by name), the time it took to query
+          its pattern (`query_time`), the number of events it played per
+          tick (`events`), and the number of events sent with a timestamp
+          already in the past (`late`)
+
+        """
+        summary = self.stats.summary()
+        summary["streams"] = {
+            name: stats.summary() for name, stats in self._stream_stats().items()
+        }
+        return summary
+
+    def _stream_stats(self) -> Dict[str, StreamStats]:
+        with self._mutex:
+            subscribers = list(self._subscribers)
+        return {
+            getattr(sub, "name", None) or str(i): sub.stats
+            for i, sub in enumerate(subscribers)
+            if isinstance(getattr(sub, "stats", None), StreamStats)
+        }
+
     def _create_notify_thread(self):
         self._notify_thread = threading.Thread(target=self._notify_thread_target)
         self._notify_thread.start()
@@ -85,6 +130,7 @@ class LinkClock:
         _logger.info("Start beat: %f", start_beat)
 
         ticks = 0
+        last_stats_log = time.monotonic()
 
         # FIXME rate, bpc and latency should be constructor parameters
         rate = 1 / 20
@@ -107,16 +153,41 @@ class LinkClock:
             if not self._is_running:
                 break
 
+            woke_up = self._link.clock().micros()
+            tick_start = time.perf_counter()
+
             s = self._link.captureSessionState()
             cps = (s.tempo() / bpc) / 60
             cycle_from = s.beatAtTime(logical_now, 0) / bpc
             cycle_to = s.beatAtTime(logical_next, 0) / bpc
 
-            try:
-                for sub in self._subscribers:
+            for sub in self._subscribers:
+                # A failing subscriber should not stop the clock, or the
+                # other subscribers.  Errors are counted, but only logged the
+                # first time, as they tend to repeat on every tick.
+                try:
                     sub.notify_tick((cycle_from, cycle_to), s, cps, bpc, mill, now)
-            except:
-                pass
+                except Exception as e:
+                    self.stats.errors += 1
+                    with self._mutex:
+                        first = (sub, type(e)) not in self._logged_errors
+                        self._logged_errors.add((sub, type(e)))
+                    if first:
+                        _logger.exception(
+                            "Error notifying tick to %s (repeated errors are "
+                            "only counted in the clock statistics)",
+                            sub,
+                        )
+
+            self.stats.record_tick(
+                (woke_up - logical_now) / mill, time.perf_counter() - tick_start
+            )
+            if (
+                self.stats_interval is not None
+                and time.monotonic() - last_stats_log >= self.stats_interval
+            ):
+                last_stats_log = time.monotonic()
+                _logger.info("%s", format_stats(self.stats, self._stream_stats()))
 
             # sys.stdout.write(
             #     "cps %.2f | playing %s | cycle %.2f\r"
@@ -140,39 +211,278 @@ class BaseStream(ABC):
     ----------
     name: Optional[str]
         Name of the stream instance
+    seed: Optional[Union[int, str]]
+        Seed of the random sequence used by the random functions of the
+        patterns played by the stream (see `random_seed`), so that streams
+        with different seeds play independent random patterns
+    lookahead: float
+        Number of cycles of events to query ahead of the clock (default: 0).
+        When positive, the pattern is queried for whole windows of this
+        length, before their events are due, and events are played from a
+        buffer of pending events, so that slow queries do not delay ticks.
+        The buffer is discarded when the pattern changes.
+    threaded: bool
+        Whether to query the pattern in a worker thread of the stream
+        (default: False), which keeps the buffer filled `lookahead` cycles
+        ahead of the clock, so that the clock thread only takes the events
+        that are due from the buffer.  Requires a positive `lookahead`.
+    pool: Optional[vortex.pool.ProcessPool]
+        Process pool in which to query the patterns of the stream, like a
+        worker thread but in the process the pool assigns to the stream.
+        Only patterns built with `vortex.pool.define` can be queried in
+        other processes, others are queried like without a pool.  Requires a
+        positive `lookahead`.
 
     """
 
-    def __init__(self, name: str = None):
+    def __init__(
+        self, name: str = None, seed=None, lookahead=0, threaded=False, pool=None
+    ):
+        if (threaded or pool is not None) and not lookahead > 0:
+            raise ValueError("streams with workers require a positive lookahead")
+
         self.name = name
+        self.seed = seed
+        self.lookahead = lookahead
+        self.threaded = threaded
+        self.pool = pool
         self.pattern = None
 
+        # Pending events (sorted by onset) of the pattern queried ahead of
+        # time, with the onsets from `_pending_begin` to `_pending_end`, and
+        # the end of the last tick (the playhead).  The generation counts
+        # the times the buffer was started over, so that windows queried
+        # before are dropped.  The worker thread, if any, waits on the
+        # condition for the playhead to move.
+        self._pending = deque()
+        self._pending_pattern = None
+        self._pending_seed = None
+        self._pending_generation = 0
+        self._pending_begin = self._pending_end = None
+        self._playhead = None
+        self._pending_cond = threading.Condition()
+        self._worker = None
+        self._worker_running = False
+        self._pool_future = None
+        self.stats = StreamStats()
+
     def notify_tick(self, cycle, s, cps, bpc, mill, now):
         """Called by a Clock every time it ticks, when subscribed to it"""
         if not self.pattern:
             return
 
+        pattern = self.pattern
         cycle_from, cycle_to = cycle
-        es = self.pattern.onsets_only().query(TimeSpan(cycle_from, cycle_to))
-        if len(es):
-            _logger.debug("%s", [e.value for e in es])
-
-        for e in es:
+        span = TimeSpan(quantize_time(cycle_from), quantize_time(cycle_to))
+
+        start = time.perf_counter()
+        with random_seed(self.seed):
+            if self.lookahead > 0:
+                events = self._pending_events(pattern, span)
+            else:
+                events = pattern.iter_onsets(span)
+            played, late, send_time = self._play_events(
+                pattern, events, s, cps, bpc, mill, now
+            )
+            if self.lookahead > 0:
+                self._refill(pattern)
+        # Events may be generated while they are sent, so the time spent
+        # sending them is left out of the query time
+        query_time = time.perf_counter() - start - send_time
+        self.stats.record_tick(query_time, played, late)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns metrics of the buffer of pending events:
+
+        * `queue_depth`: the number of events queried ahead of the clock
+        * `ahead`: how many cycles after the playhead (the end of the last
+          tick) the pattern has been queried
+
+        """
+        with self._pending_cond:
+            if self._playhead is None:
+                ahead = 0.0
+            else:
+                ahead = float(self._pending_end - self._playhead)
+            return {"queue_depth": len(self._pending), "ahead": ahead}
+
+    def close(self):
+        """Stops the worker thread of a threaded stream"""
+        with self._pending_cond:
+            self._worker_running = False
+            self._pending_cond.notify()
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+
+    def _pending_events(self, pattern, span):
+        """Returns the events of the pattern with onsets in the span, taken
+        from the buffer of pending events (see `_refill`), and querying the
+        events that are due but not buffered yet"""
+        begin, end = span.begin, span.end
+        with self._pending_cond:
+            if (
+                self._pending_pattern is not pattern
+                or self._pending_seed != self.seed
+                or not self._pending_begin <= begin <= self._pending_end
+            ):
+                # The pattern (or seed) changed, or the clock jumped: start
+                # over (and drop the window the worker may be querying)
+                self._pending.clear()
+                self._pending_pattern = pattern
+                self._pending_seed = self.seed
+                self._pending_generation += 1
+                self._pending_begin = self._pending_end = begin
+            self._playhead = end
+            generation = self._pending_generation
+
+        while True:
+            with self._pending_cond:
+                if self._pending_end >= end:
+                    break
+                window = TimeSpan(self._pending_end, end)
+            # The buffer is behind the clock (e.g. on the first tick), so the
+            # events that are due are queried here, without holding the lock
+            events = list(pattern.iter_onsets(window))
+            with self._pending_cond:
+                self._add_window(generation, window, events)
+
+        with self._pending_cond:
+            pending = self._pending
+            # Drop events skipped by the clock
+            while pending and pending[0].whole.begin < begin:
+                pending.popleft()
+            events = []
+            while pending and pending[0].whole.begin < end:
+                events.append(pending.popleft())
+            self._pending_begin = end
+            return events
+
+    def _refill(self, pattern):
+        """Refills the buffer of pending events up to `lookahead` cycles
+        after the playhead when less than half of it is left, by the worker
+        thread or process if the stream has one.  It is called after the
+        events of a tick are sent, so that queries do not delay them."""
+        with self._pending_cond:
+            if self.pool is not None and hasattr(pattern, "source"):
+                self._submit_window()
+                return
+            if self.threaded:
+                if self._worker is None:
+                    self._start_worker()
+                self._pending_cond.notify()
+                return
+            window = self._next_window()
+            generation = self._pending_generation
+        if window is not None:
+            events = list(pattern.iter_onsets(window))
+            with self._pending_cond:
+                self._add_window(generation, window, events)
+
+    def _next_window(self):
+        """Returns the span to query to refill the buffer, or None if it is
+        at least half full"""
+        lookahead = to_time(self.lookahead)
+        if self._pending_end >= self._playhead + lookahead / 2:
+            return None
+        return TimeSpan(self._pending_end, self._playhead + lookahead)
+
+    def _add_window(self, generation, window, events):
+        """Adds the events of a window to the buffer, unless the buffer was
+        started over (for another pattern, seed, or position of the clock) or
+        refilled since the window was chosen"""
+        if self._pending_generation == generation and self._pending_end == window.begin:
+            self._pending.extend(sorted(events, key=lambda e: e.whole.begin))
+            self._pending_end = window.end
+
+    def _submit_window(self):
+        """Queries the next window in the process pool, unless a window is
+        already being queried"""
+        window = self._next_window()
+        if window is None or self._pool_future is not None:
+            return
+        generation = self._pending_generation
+        future = self.pool.submit(
+            self.name, self._pending_pattern, window, self._pending_seed
+        )
+        self._pool_future = future
+        future.add_done_callback(
+            lambda future: self._pool_window_done(future, generation, window)
+        )
+
+    def _pool_window_done(self, future, generation, window):
+        try:
+            events = records_to_events(future.result())
+        except Exception:
+            _logger.exception("Error querying pattern of stream %s", self.name)
+            events = []
+        with self._pending_cond:
+            self._pool_future = None
+            self._add_window(generation, window, events)
+            if self._pending_generation == generation:
+                self._submit_window()
+
+    def _start_worker(self):
+        self._worker_running = True
+        self._worker = threading.Thread(target=self._worker_target, daemon=True)
+        self._worker.start()
+
+    def _worker_target(self):
+        while True:
+            with self._pending_cond:
+                window = None
+                while self._worker_running:
+                    window = self._next_window()
+                    if window is not None:
+                        break
+                    self._pending_cond.wait()
+                if not self._worker_running:
+                    return
+                pattern = self._pending_pattern
+                seed = self._pending_seed
+                generation = self._pending_generation
+
+            # Patterns are queried without holding the lock, so that the
+            # clock thread can take due events in the meantime
+            try:
+                with random_seed(seed):
+                    events = list(pattern.iter_onsets(window))
+            except Exception:
+                _logger.exception("Error querying pattern of stream %s", self.name)
+                events = []
+
+            with self._pending_cond:
+                self._add_window(generation, window, events)
+
+    def _play_events(self, pattern, events, s, cps, bpc, mill, now):
+        # Events are sent as soon as they are generated, and generation stops
+        # if the pattern is replaced (or silenced) in the meantime.  Returns
+        # the number of events played and of late ones, and the time spent
+        # sending them.
+        played = late = 0
+        send_time = 0.0
+        for e in events:
+            if self.pattern is not pattern:
+                break
+            _logger.debug("%s", e.value)
             cycle_on = e.whole.begin
             cycle_off = e.whole.end
 
-            link_on = s.timeAtBeat(cycle_on * bpc, 0)
-            link_off = s.timeAtBeat(cycle_off * bpc, 0)
+            link_on = s.timeAtBeat(float(cycle_on * bpc), 0)
+            link_off = s.timeAtBeat(float(cycle_off * bpc), 0)
             delta_secs = (link_off - link_on) / mill
 
             # Maybe better to only calc this once??
             # + it would be better to send link time to supercollider..
             link_secs = now / mill
-            liblo_diff = liblo.time() - link_secs
+            liblo_now = liblo.time()
+            liblo_diff = liblo_now - link_secs
             nudge = e.value.get("nudge", 0)
             ts = (link_on / mill) + liblo_diff + self.latency + nudge
 
             # print("liblo time %f link_time %f link_on %f cycle_on %f liblo_diff %f ts %f" % (liblo.time(), link_secs, link_on, cycle_on, liblo_diff, ts))
+            send_start = time.perf_counter()
             self.notify_event(
                 e.value,
                 timestamp=ts,
@@ -180,6 +490,11 @@ class BaseStream(ABC):
                 cycle=float(cycle_on),
                 delta=float(delta_secs),
             )
+            send_time += time.perf_counter() - send_start
+            played += 1
+            if ts < liblo_now:
+                late += 1
+        return played, late, send_time
 
     def notify_event(
         self,
@@ -231,12 +546,16 @@ class SuperDirtStream(BaseStream):
         cycle: float,
         delta: float,
     ):
-        msg = []
-        for key, val in event.items():
-            if isinstance(val, Fraction):
-                val = float(val)
-            msg.append(key)
-            msg.append(val)
+        if isinstance(event, ControlMap):
+            # Control maps cache their flattened arguments
+            msg = list(event.osc_args())
+        else:
+            msg = []
+            for key, val in event.items():
+                if isinstance(val, (Fraction, Tick)):
+                    val = float(val)
+                msg.append(key)
+                msg.append(val)
         msg.extend(["cps", cps, "cycle", cycle, "delta", delta])
         _logger.info("%s", msg)
 
@@ -0,0 +1,374 @@
+"""
+Integer tick time representation
+
+By default, time values in Vortex are `fractions.Fraction` objects, which
+keeps them exact but makes every arithmetic operation pay for a gcd
+normalization.  The "ticks" backend stores time values as an integer count of
+ticks over a fixed number of ticks per cycle, so that common arithmetic
+(adding offsets, scaling by integer factors, comparing) is plain integer
+arithmetic.  Values that cannot be represented exactly at the current
+resolution automatically fall back to `Fraction`.
+
+The backend is selected per process with `set_time_backend`, and should be
+chosen before creating patterns:
+
+>>> set_time_backend("ticks")
+>>> set_time_backend("ticks", resolution=3 * 2**10)
+>>> set_time_backend("fraction")
+
+"""
+
+import math
+import numbers
+from fractions import Fraction
+
+# lcm(1..16) * 2**8, so that nested subdivisions up to 16 steps, and up to 12
+# levels of binary subdivisions, are representable.
+DEFAULT_RESOLUTION = 720720 * 2**8
+
+_use_ticks = False
+
+
+class Tick(numbers.Rational):
+    """
+    A time value stored as an integer number of ticks, where a cycle is
+    `Tick.resolution` ticks long.
+
+    Ticks behave like rational numbers and compare equal (and hash equal) to
+    the `Fraction` of the same value.  Arithmetic between ticks and integers
+    (or fractions whose denominator divides the resolution) returns ticks,
+    otherwise it falls back to `Fraction` (or `float`, as Fraction does).
+
+    """
+
+    __slots__ = ("ticks",)
+
+    resolution = DEFAULT_RESOLUTION
+
+    def __init__(self, ticks: int):
+        self.ticks = ticks
+
+    @staticmethod
+    def from_rational(numerator: int, denominator: int):
+        """Returns a Tick for `numerator / denominator` cycles if it is
+        representable, otherwise a Fraction"""
+        ticks, rem = divmod(numerator * Tick.resolution, denominator)
+        if rem:
+            return Fraction(numerator, denominator)
+        return Tick(ticks)
+
+    @staticmethod
+    def from_value(value):
+        """Converts an int, float, Fraction or Tick to a Tick if it is
+        representable, otherwise returns a Fraction"""
+        t = type(value)
+        if t is Tick:
+            return value
+        if t is int:
+            return Tick(value * Tick.resolution)
+        if t is not Fraction:
+            value = Fraction(value)
+        ticks, rem = divmod(value.numerator * Tick.resolution, value.denominator)
+        if rem:
+            return value
+        return Tick(ticks)
+
+    @property
+    def numerator(self) -> int:
+        return self.ticks // math.gcd(self.ticks, self.resolution)
+
+    @property
+    def denominator(self) -> int:
+        return self.resolution // math.gcd(self.ticks, self.resolution)
+
+    def as_fraction(self) -> Fraction:
+        return Fraction(self.ticks, self.resolution)
+
+    def sam(self):
+        """Returns the start of the cycle."""
+        return Tick(self.ticks - self.ticks % self.resolution)
+
+    def next_sam(self):
+        """Returns the start of the next cycle."""
+        return Tick(self.ticks - self.ticks % self.resolution + self.resolution)
+
+    def cycle_pos(self):
+        """Returns the position of a time value relative to the start of its cycle."""
+        return Tick(self.ticks % self.resolution)
+
+    # Arithmetic
+
+    def __add__(self, other):
+        t = type(other)
+        if t is Tick:
+            return Tick(self.ticks + other.ticks)
+        if t is int:
+            return Tick(self.ticks + other * self.resolution)
+        if isinstance(other, numbers.Rational):
+            return Tick.from_rational(
+                self.ticks * other.denominator + other.numerator * self.resolution,
+                self.resolution * other.denominator,
+            )
+        if isinstance(other, float):
+            return float(self) + other
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        t = type(other)
+        if t is Tick:
+            return Tick(self.ticks - other.ticks)
+        if t is int:
+            return Tick(self.ticks - other * self.resolution)
+        if isinstance(other, numbers.Rational):
+            return Tick.from_rational(
+                self.ticks * other.denominator - other.numerator * self.resolution,
+                self.resolution * other.denominator,
+            )
+        if isinstance(other, float):
+            return float(self) - other
+        return NotImplemented
+
+    def __rsub__(self, other):
+        t = type(other)
+        if t is int:
+            return Tick(other * self.resolution - self.ticks)
+        if isinstance(other, numbers.Rational):
+            return Tick.from_rational(
+                other.numerator * self.resolution - self.ticks * other.denominator,
+                self.resolution * other.denominator,
+            )
+        if isinstance(other, float):
+            return other - float(self)
+        return NotImplemented
+
+    def __mul__(self, other):
+        t = type(other)
+        if t is int:
+            return Tick(self.ticks * other)
+        if t is Tick:
+            return Tick.from_rational(
+                self.ticks * other.ticks, self.resolution * self.resolution
+            )
+        if isinstance(other, numbers.Rational):
+            ticks, rem = divmod(self.ticks * other.numerator, other.denominator)
+            if rem:
+                return Fraction(
+                    self.ticks * other.numerator, self.resolution * other.denominator
+                )
+            return Tick(ticks)
+        if isinstance(other, float):
+            return float(self) * other
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        t = type(other)
+        if t is int:
+            ticks, rem = divmod(self.ticks, other)
+            if rem:
+                return Fraction(self.ticks, self.resolution * other)
+            return Tick(ticks)
+        if t is Tick:
+            return Tick.from_rational(self.ticks, other.ticks)
+        if isinstance(other, numbers.Rational):
+            ticks, rem = divmod(self.ticks * other.denominator, other.numerator)
+            if rem:
+                return Fraction(
+                    self.ticks * other.denominator, self.resolution * other.numerator
+                )
+            return Tick(ticks)
+        if isinstance(other, float):
+            return float(self) / other
+        return NotImplemented
+
+    def __rtruediv__(self, other):
+        if isinstance(other, numbers.Rational):
+            return Tick.from_rational(
+                other.numerator * self.resolution, other.denominator * self.ticks
+            )
+        if isinstance(other, float):
+            return other / float(self)
+        return NotImplemented
+
+    def __floordiv__(self, other):
+        if type(other) is Tick:
+            return self.ticks // other.ticks
+        return self.as_fraction() // other
+
+    def __rfloordiv__(self, other):
+        return other // self.as_fraction()
+
+    def __mod__(self, other):
+        t = type(other)
+        if t is Tick:
+            return Tick(self.ticks % other.ticks)
+        if t is int:
+            return Tick(self.ticks % (other * self.resolution))
+        result = self.as_fraction() % other
+        if isinstance(result, Fraction):
+            return Tick.from_value(result)
+        return result
+
+    def __rmod__(self, other):
+        return other % self.as_fraction()
+
+    def __pow__(self, other):
+        return self.as_fraction() ** other
+
+    def __rpow__(self, other):
+        return other ** self.as_fraction()
+
+    def __neg__(self):
+        return Tick(-self.ticks)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Tick(abs(self.ticks))
+
+    # Conversions
+
+    def __float__(self) -> float:
+        return self.ticks / self.resolution
+
+    def __floor__(self) -> int:
+        return self.ticks // self.resolution
+
+    def __ceil__(self) -> int:
+        return -(-self.ticks // self.resolution)
+
+    def __trunc__(self) -> int:
+        if self.ticks < 0:
+            return -(-self.ticks // self.resolution)
+        return self.ticks // self.resolution
+
+    __int__ = __trunc__
+
+    def __round__(self, ndigits=None):
+        return round(self.as_fraction(), ndigits)
+
+    def __bool__(self) -> bool:
+        return self.ticks != 0
+
+    # Comparisons
+
+    def _cmp_ticks(self, other):
+        """Returns a pair of integers that compare like `self` and `other`,
+        or None if `other` is not a rational number"""
+        t = type(other)
+        if t is Tick:
+            return self.ticks, other.ticks
+        if t is int:
+            return self.ticks, other * self.resolution
+        if isinstance(other, numbers.Rational):
+            return (
+                self.ticks * other.denominator,
+                other.numerator * self.resolution,
+            )
+        return None
+
+    def __eq__(self, other) -> bool:
+        pair = self._cmp_ticks(other)
+        if pair is None:
+            if isinstance(other, float):
+                return self.as_fraction() == other
+            return NotImplemented
+        return pair[0] == pair[1]
+
+    def __lt__(self, other) -> bool:
+        pair = self._cmp_ticks(other)
+        if pair is None:
+            return self.as_fraction() < other
+        return pair[0] < pair[1]
+
+    def __le__(self, other) -> bool:
+        pair = self._cmp_ticks(other)
+        if pair is None:
+            return self.as_fraction() <= other
+        return pair[0] <= pair[1]
+
+    def __gt__(self, other) -> bool:
+        pair = self._cmp_ticks(other)
+        if pair is None:
+            return self.as_fraction() > other
+        return pair[0] > pair[1]
+
+    def __ge__(self, other) -> bool:
+        pair = self._cmp_ticks(other)
+        if pair is None:
+            return self.as_fraction() >= other
+        return pair[0] >= pair[1]
+
+    def __hash__(self) -> int:
+        # Must be the same hash as the equivalent Fraction (and int)
+        if self.ticks % self.resolution == 0:
+            return hash(self.ticks // self.resolution)
+        return hash(self.as_fraction())
+
+    def __repr__(self) -> str:
+        value = self.as_fraction()
+        return f"Tick({value.numerator}/{value.denominator})"
+
+    def __str__(self) -> str:
+        return str(self.as_fraction())
+
+
+def set_time_backend(backend: str, resolution: int = None):
+    """
+    Selects the representation of time values for this process.
+
+    Parameters
+    ----------
+    backend: str
+        Either "fraction" (the default) or "ticks"
+    resolution: Optional[int]
+        Number of ticks per cycle, used by the "ticks" backend.  Time values
+        are only representable as ticks if their denominator divides the
+        resolution.
+
+    """
+    global _use_ticks
+    if backend not in ("fraction", "ticks"):
+        raise ValueError(f"Unknown time backend {repr(backend)}")
+    if resolution is not None:
+        if resolution <= 0:
+            raise ValueError("resolution should be a positive integer")
+        Tick.resolution = int(resolution)
+    _use_ticks = backend == "ticks"
+
+
+def get_time_backend() -> str:
+    """Returns the name of the current time backend"""
+    return "ticks" if _use_ticks else "fraction"
+
+
+def to_time(value):
+    """Converts a number to a time value of the current backend"""
+    if _use_ticks:
+        return Tick.from_value(value)
+    return Fraction(value)
+
+
+def time_value(value):
+    """Converts a time value to a Fraction, for times that become the values
+    of events (e.g. sampled by signals), so that ticks do not leak into
+    them.  Other values are returned unchanged."""
+    if type(value) is Tick:
+        return value.as_fraction()
+    return value
+
+
+def quantize_time(value):
+    """
+    Like `to_time`, but with the "ticks" backend, rounds `value` down to the
+    nearest tick instead of falling back to a Fraction.  Useful for times
+    coming from a clock as floats.
+
+    """
+    if _use_ticks:
+        return Tick(math.floor(value * Tick.resolution))
+    return Fraction(value)